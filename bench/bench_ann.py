@@ -0,0 +1,55 @@
+"""
+IVF vs brute-force search on synthetic topic-clustered embeddings:
+
+    python bench/bench_ann.py [n_chunks ...]     # default 20000 100000
+
+Reports build time, per-query latency and recall@k (overlap with the exact top-k)
+for a few nprobe settings.
+"""
+import sys, time, pathlib
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from rag.ann import build_ivf, ivf_search, default_nprobe
+
+DIM, K, N_QUERIES = 384, 6, 200
+
+
+def clustered(centers, n, rng, spread=0.6):
+    x = centers[rng.integers(0, len(centers), n)] + spread * rng.standard_normal((n, DIM)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [20000, 100000]
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        # pages on shared topics; queries ask about the same topics
+        centers = rng.standard_normal((n // 10, DIM)).astype("float32")
+        emb = clustered(centers, n, rng)
+        queries = clustered(centers, N_QUERIES, rng)
+        t = time.perf_counter()
+        ivf = build_ivf(emb)
+        build_s = time.perf_counter() - t
+        nlist = len(ivf["centroids"])
+
+        t = time.perf_counter()
+        exact = []
+        for q in queries:
+            s = emb @ q
+            exact.append(set(np.argpartition(s, -K)[-K:]))
+        brute_ms = (time.perf_counter() - t) / N_QUERIES * 1e3
+        print(f"n={n} nlist={nlist} build {build_s:.1f}s  brute force {brute_ms:.2f} ms/query")
+
+        for nprobe in sorted({4, default_nprobe(nlist), 2 * default_nprobe(nlist)}):
+            t = time.perf_counter()
+            hits = 0
+            for q, ex in zip(queries, exact):
+                ids, _ = ivf_search(emb, ivf, q, K, nprobe=nprobe)
+                hits += len(ex & set(ids.tolist()))
+            ms = (time.perf_counter() - t) / N_QUERIES * 1e3
+            print(f"  nprobe={nprobe:>4}: {ms:6.2f} ms/query  recall@{K} {hits / (K * N_QUERIES):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Load test of the shared retriever: N concurrent users (threads, like Streamlit sessions
+on one server process) each searching distinct, uncached questions, with and without
+micro-batching (RuleRetriever(batch_ms=...)).
+
+    python bench/bench_batch.py [n_chunks] [batch_ms]     # default 50000 chunks, 3 ms
+
+The index is synthetic (n_chunks x 384, float32, exact search, BM25 on). The encoder is
+the real one when sentence_transformers is installed; otherwise a stand-in with the cost
+shape of a small transformer on CPU: a fixed 8 ms per forward pass plus 0.5 ms per text,
+spent outside the GIL as torch does.
+"""
+import sys, time, zlib, pathlib, tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from rag import retrieve
+from rag.index_store import write_index
+
+DIM = 384
+USERS = (1, 8, 32)
+QUERIES_PER_USER = 20
+WORDS = ["household", "income", "ceiling", "grant", "CPF", "resale", "flat", "lease", "option", "purchase",
+         "EIP", "quota", "SPR", "loan", "valuation", "MOP", "HFE", "letter", "singles", "parents"]
+
+
+class SimEncoder:
+    def __init__(self, fixed_s=0.008, per_text_s=0.0005):
+        self.fixed_s, self.per_text_s, self.calls = fixed_s, per_text_s, 0
+
+    def encode(self, texts, normalize_embeddings=True, **kwargs):
+        self.calls += 1
+        time.sleep(self.fixed_s + self.per_text_s * len(texts))
+        out = np.array([np.random.default_rng(zlib.crc32(t.encode())).standard_normal(DIM) for t in texts],
+                       dtype="float32")
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+def _encoder():
+    try:
+        from rag.embed import load_encoder
+        enc = load_encoder()
+        enc.encode(["warm up"], normalize_embeddings=True)
+        return enc, "model"
+    except ImportError:
+        return SimEncoder(), "simulated"
+
+
+def _index(d, n):
+    rng = np.random.default_rng(0)
+    emb = rng.standard_normal((n, DIM)).astype("float32")
+    emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+    chunks = [{"doc_id": f"c{i}", "title": f"Page {i // 20}", "url": f"https://example.gov.sg/{i // 20}",
+               "retrieved_at": "2025-01-01", "text": " ".join(rng.choice(WORDS, 40))} for i in range(n)]
+    write_index(d, chunks, emb, "bench", ann=False)
+
+
+def _run(r, users, tag):
+    def user(u):
+        lat = []
+        for j in range(QUERIES_PER_USER):
+            t = time.perf_counter()
+            r.search(f"{tag} user {u} question {j}: {WORDS[(u + j) % len(WORDS)]} rules")
+            lat.append(time.perf_counter() - t)
+        return lat
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(users) as pool:
+        lat = [x for xs in pool.map(user, range(users)) for x in xs]
+    wall = time.perf_counter() - t0
+    return len(lat) / wall, np.percentile(lat, 50) * 1e3, np.percentile(lat, 95) * 1e3
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    batch_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    enc, kind = _encoder()
+    with tempfile.TemporaryDirectory() as tmp:
+        d = pathlib.Path(tmp) / "index_rules"
+        _index(d, n)
+        retrieve.IDX_DIR = d
+        print(f"{n} chunks, encoder: {kind}, {QUERIES_PER_USER} distinct queries per user")
+        print(f"{'users':>5} {'mode':<12} {'queries/s':>9} {'p50 ms':>7} {'p95 ms':>7} {'encodes':>7}")
+        for users in USERS:
+            for ms in (0, batch_ms):
+                calls = getattr(enc, "calls", None)
+                r = retrieve.RuleRetriever(top_k=6, encoder=enc, batch_ms=ms)
+                qps, p50, p95 = _run(r, users, f"{users}/{ms}")
+                encodes = enc.calls - calls if calls is not None else "-"
+                mode = f"batch {ms:g}ms" if ms else "per query"
+                print(f"{users:>5} {mode:<12} {qps:9.1f} {p50:7.1f} {p95:7.1f} {encodes:>7}")
+
+
+if __name__ == "__main__":
+    main()
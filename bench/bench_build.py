@@ -0,0 +1,100 @@
+"""
+Index build: the streaming pipeline (batched embed + append-write) vs the old one-shot
+build (every chunk in a list, one encode, one write), over synthetic pages replayed
+offline from a snapshot store. A hashed bag-of-words projection stands in for MiniLM,
+so only the pipeline is measured, not the model.
+
+    python bench/bench_build.py [n_pages] [procs]     # default 400 pages, 1 process
+
+Each build runs in a fresh subprocess (peak RSS via VmHWM).
+"""
+import sys, json, time, zlib, pathlib, subprocess, tempfile
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+DIM = 384
+
+
+class _HashEncoder:
+    """CPU-bound stand-in: hashed token counts through a fixed random projection."""
+    def __init__(self):
+        self.proj = np.random.default_rng(0).standard_normal((4096, DIM)).astype("float32")
+
+    def encode(self, texts, normalize_embeddings=True, batch_size=32, **kwargs):
+        out = []
+        for k in range(0, len(texts), batch_size):  # like SentenceTransformer, 32 texts per pass
+            batch = texts[k:k + batch_size]
+            x = np.zeros((len(batch), 4096), dtype="float32")
+            for i, t in enumerate(batch):
+                for w in t.split():
+                    x[i, zlib.crc32(w.encode()) & 4095] += 1
+            v = x @ self.proj
+            out.append(v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12))
+        return np.concatenate(out)
+
+
+def _page(i: int) -> str:
+    rng = np.random.default_rng(i)
+    words = ["grant", "income", "ceiling", "flat", "resale", "lease", "loan", "quota", "household",
+             "eligibility", "citizen", "applicant", "conditions", "amount", "scheme", "parents"]
+    sections = []
+    for j in range(12):
+        body = " ".join(rng.choice(words, 350))
+        sections.append(f"<h2>Section {j} of policy {i}</h2><p>{body}.</p>")
+    return f"<html><body><article><h1>Policy {i}</h1>{''.join(sections)}</article></body></html>"
+
+
+def child(mode: str, snap: str, out: str, n: int, procs: int):
+    from rag import index_rules
+    from rag.embed import EncoderPool
+    from rag.fetch import Fetcher
+    from rag.index_store import write_index
+    fetcher = Fetcher(snap, mode="offline")
+    sources = [{"title": f"Policy {i}", "url": f"https://example.gov.sg/p/{i}"} for i in range(n)]
+    enc = EncoderPool(procs, _HashEncoder) if procs > 1 else _HashEncoder()
+    t = time.perf_counter()
+    if mode == "one-shot":
+        chunks = [c for _, cs in index_rules.source_chunks(sources, fetcher, [], {}, {"changed": 0})
+                  for c in cs]
+        header = write_index(pathlib.Path(out), chunks, enc.encode([c["text"] for c in chunks]), "bench")
+    else:
+        header, _ = index_rules.build_index(sources, pathlib.Path(out), encoder=enc, fetcher=fetcher,
+                                            full=True, procs=procs)
+    secs = time.perf_counter() - t
+    if procs > 1:
+        enc.close()
+    print(json.dumps({"s": round(secs, 2), "chunks": header["count"], "digest": header["digest"],
+                      "peak_rss_mb": round(_vm_hwm_kb() / 1024, 1)}))
+
+
+def _vm_hwm_kb():
+    for line in pathlib.Path("/proc/self/status").read_text().splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1])
+    return 0
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        mode, snap, out, n, procs = sys.argv[2:]
+        return child(mode, snap, out, int(n), int(procs))
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    procs = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    from rag.fetch import Fetcher
+    with tempfile.TemporaryDirectory() as tmp:
+        snap = pathlib.Path(tmp) / "snapshots.sqlite"
+        f = Fetcher(snap, mode="offline")
+        for i in range(n):
+            f.put(f"https://example.gov.sg/p/{i}", _page(i), fetched_at=1.7e9)
+        for mode in ("one-shot", "streaming"):
+            res = subprocess.run([sys.executable, __file__, "--child", mode, str(snap),
+                                  str(pathlib.Path(tmp) / mode), str(n), str(procs)],
+                                 cwd=ROOT, capture_output=True, text=True, check=True)
+            r = json.loads(res.stdout.strip().splitlines()[-1])
+            print(f"{n} pages {mode:>9} (procs={procs}): {r['chunks']} chunks in {r['s']:6.2f} s  "
+                  f"peak RSS {r['peak_rss_mb']:7.1f} MB  digest {r['digest']}")
+
+
+if __name__ == "__main__":
+    main()
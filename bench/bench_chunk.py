@@ -0,0 +1,105 @@
+"""
+Chunking and extraction throughput on large synthetic policy pages (~200 KB of HTML).
+
+    python bench/bench_chunk.py [n_pages] [procs]     # default 24 pages, one worker per core
+
+1. chunker: the previous split_into_chunks() (re-split of the buffer on every overlap,
+   a regex per line, md5 + utcnow per chunk) vs rag.extract.split_into_chunks()
+2. extraction: extract_text() on every page serially vs on the process pool that
+   rag/index_rules.page_texts() uses
+"""
+import os, re, sys, time, pathlib, hashlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from rag.extract import extract_text, extract_timed, split_into_chunks
+
+WORDS = ["household", "income", "ceiling", "Enhanced", "CPF", "Housing", "Grant", "(EHG)", "of", "up",
+         "to", "$120,000", "for", "first-timer", "families", "buying", "a", "resale", "flat", "lease"]
+
+
+def _page(i: int, size=200_000) -> str:
+    rng = np.random.default_rng(i)
+    parts, n = [f"<html><body><article><h1>Policy {i}</h1>"], 0
+    while n < size:
+        # long sections under headings, with table rows and list items mixed in
+        sec = [f"<h2>Conditions {len(parts)}</h2>"]
+        for _ in range(rng.integers(3, 12)):
+            sec.append(f"<p>{' '.join(rng.choice(WORDS, rng.integers(20, 400)))}.</p>")
+        sec.append("<ul>" + "".join(f"<li>{' '.join(rng.choice(WORDS, 12))}</li>" for _ in range(5)) + "</ul>")
+        sec.append("<table>" + "".join(f"<tr><td>Up to ${k * 1000}</td><td>${k * 5000}</td></tr>"
+                                       for k in range(1, 8)) + "</table>")
+        block = "".join(sec)
+        parts.append(block)
+        n += len(block)
+    return "".join(parts) + "</article></body></html>"
+
+
+def _old_split_into_chunks(text, title, url, max_tokens=800, overlap=80):
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    chunks, buf, tokens = [], [], 0
+    def tok_count(s): return max(1, len(s.split()))
+    for line in lines:
+        if re.match(r"^[A-Z].{0,80}$", line) and len(line.split()) <= 12:
+            if buf:
+                chunks.append("\n".join(buf))
+                buf, tokens = [], 0
+        if tokens + tok_count(line) > max_tokens and buf:
+            chunks.append("\n".join(buf))
+            keep = " ".join(" ".join(buf).split()[-overlap:])
+            buf = [keep, line]
+            tokens = tok_count(keep) + tok_count(line)
+        else:
+            buf.append(line)
+            tokens += tok_count(line)
+    if buf:
+        chunks.append("\n".join(buf))
+    return [{"doc_id": hashlib.md5((url + str(i)).encode()).hexdigest(), "title": title, "url": url,
+             "retrieved_at": datetime.utcnow().strftime("%Y-%m-%d"), "text": c} for i, c in enumerate(chunks)]
+
+
+def _rate(fn, items, mb):
+    t = time.perf_counter()
+    out = [fn(*x) for x in items]
+    s = time.perf_counter() - t
+    return out, s, mb / s
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    procs = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    pages = [(_page(i), f"https://example.gov.sg/p/{i}") for i in range(n)]
+    html_mb = sum(len(h) for h, _ in pages) / 1e6
+    print(f"{n} pages, {html_mb / n * 1000:.0f} KB HTML each, {os.cpu_count()} cores")
+
+    extract_text("<p>warm up</p>", "u")  # first-call set-up, as the pool workers get below
+    texts, ser_s, ser_rate = _rate(extract_text, pages, html_mb)
+    with ProcessPoolExecutor(procs, mp_context=get_context("spawn")) as pool:
+        list(pool.map(extract_timed, ["<p>warm up</p>"] * procs, ["u"] * procs))  # worker start-up
+        t = time.perf_counter()
+        pooled = [txt for txt, _ in pool.map(extract_timed, *zip(*pages))]
+        pool_s = time.perf_counter() - t
+    assert pooled == texts
+    print(f"extract  serial         {ser_s:6.2f} s  {ser_rate:6.2f} MB/s")
+    print(f"extract  pool x{procs:<2}       {pool_s:6.2f} s  {html_mb / pool_s:6.2f} MB/s")
+
+    text_mb = sum(len(t) for t in texts) / 1e6
+    items = [(t, "Policy", u) for t, (_, u) in zip(texts, pages)]
+    best = [float("inf"), float("inf")]
+    for _ in range(3):  # best of 3 for each
+        old, old_s, _ = _rate(_old_split_into_chunks, items, text_mb)
+        new, new_s, _ = _rate(split_into_chunks, items, text_mb)
+        best = [min(old_s, best[0]), min(new_s, best[1])]
+    assert [[c["text"] for c in p] for p in old] == [[c["text"] for c in p] for p in new]
+    print(f"chunk    previous       {best[0] * 1e3:6.1f} ms  {text_mb / best[0]:6.1f} MB/s"
+          f"  ({sum(map(len, new))} chunks from {text_mb:.1f} MB text)")
+    print(f"chunk    linear         {best[1] * 1e3:6.1f} ms  {text_mb / best[1]:6.1f} MB/s"
+          f"  ({best[0] / best[1]:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
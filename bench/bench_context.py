@@ -0,0 +1,82 @@
+"""
+Prompt size with and without rag/context.pack_context().
+
+    python bench/bench_context.py [budget]
+
+1. the committed rule index: top 6 chunks (BM25) for a few typical questions
+2. long pages chunked at the production size (800 words, 80 overlap): 6 neighbouring
+   chunks of one page, the case overlap dedupe is for
+Prints prompt tokens (tiktoken if its encoding is available, else the estimate) and
+the time to pack.
+"""
+import sys, time, pathlib
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from rag.answer import build_prompt
+from rag.bm25 import BM25_FILE, bm25_scores, load_bm25
+from rag.context import count_tokens, pack_context, tokenizer_name
+from rag.extract import split_into_chunks
+from rag.index_store import open_index
+
+QUESTIONS = [
+    "What is the income ceiling for the Enhanced CPF Housing Grant?",
+    "How long is the option to purchase valid?",
+    "What is the EIP quota for Malay buyers?",
+    "Can SPR households buy a resale flat?",
+    "When can I sell my flat after the minimum occupation period?",
+]
+WORDS = ["household", "income", "ceiling", "Enhanced", "CPF", "Housing", "Grant", "option", "purchase",
+         "valid", "for", "first-timer", "families", "buying", "a", "resale", "flat", "lease", "the", "of"]
+
+
+def _old_prompt(query, hits):
+    # the prompt before packing: every hit's full text
+    context = "".join(f"[{i}] {h['title']} | {h['url']}\n{h['text']}\n\n" for i, h in enumerate(hits, 1))
+    return build_prompt(query, hits, context)
+
+
+def _long_page(seed, n=600):
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(n):
+        s = " ".join(rng.choice(WORDS, rng.integers(8, 30)))
+        lines.append(s[0].upper() + s[1:] + ".")
+    return "\n".join(" ".join(lines[i:i + 4]) for i in range(0, n, 4))  # paragraphs
+
+
+def _row(label, cases, budget):
+    old = new = 0
+    ms = []
+    for q, hits in cases:
+        old += count_tokens(_old_prompt(q, hits))
+        t = time.perf_counter()
+        context, _ = pack_context(q, hits, budget)
+        ms.append((time.perf_counter() - t) * 1e3)
+        new += count_tokens(build_prompt(q, hits, context))
+    n = len(cases)
+    print(f"{label:<24} {old / n:7.0f} -> {new / n:6.0f} tokens/prompt ({1 - new / old:4.0%} less)"
+          f"  pack {np.median(ms):5.1f} ms")
+
+
+def main():
+    budget = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    idx = ROOT / "rag" / "index_rules"
+    _, chunks, _ = open_index(idx)
+    chunks, bm = list(chunks), load_bm25(idx / BM25_FILE)
+    count_tokens("warm up")  # tokenizer load
+    print(f"tokenizer: {tokenizer_name()}, budget {budget or 'default'}")
+
+    cases = [(q, [chunks[i] for i in np.argsort(-bm25_scores(bm, q))[:6]]) for q in QUESTIONS]
+    _row("committed index, top 6", cases, budget)
+
+    cases = []
+    for i, q in enumerate(QUESTIONS):
+        page = split_into_chunks(_long_page(i), "Policy", f"https://example.gov.sg/{i}")
+        cases.append((q, page[:6]))
+    _row("800-word chunks, 6", cases, budget)
+
+
+if __name__ == "__main__":
+    main()
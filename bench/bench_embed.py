@@ -0,0 +1,58 @@
+"""
+Query-embedding benchmark per backend (torch / onnx / onnx-int8):
+
+    python bench/bench_embed.py [backend ...]
+
+Each backend runs in a fresh subprocess: model load time, single-query latency
+(p50/p95 over 200 queries, as RuleRetriever.search does) and peak RSS. Needs
+sentence_transformers, plus optimum[onnxruntime] for the ONNX backends.
+"""
+import sys, json, time, pathlib, resource, statistics, subprocess
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+QUERIES = [
+    "How long is the OTP valid?",
+    "Which grants can a first-timer family get for a resale flat?",
+    "What is the EIP quota for SPR buyers?",
+    "Can I use CPF if the lease does not cover me to 95?",
+    "What happens if the valuation is lower than the price?",
+]
+
+
+def child(backend):
+    sys.path.insert(0, str(ROOT))
+    from rag.embed import load_encoder
+    t = time.perf_counter()
+    model = load_encoder(backend)
+    load_s = time.perf_counter() - t
+    model.encode(QUERIES[:1], normalize_embeddings=True)  # first call pays graph setup
+    lat = []
+    for i in range(200):
+        t = time.perf_counter()
+        model.encode([QUERIES[i % len(QUERIES)]], normalize_embeddings=True)
+        lat.append((time.perf_counter() - t) * 1e3)
+    lat.sort()
+    print(json.dumps({
+        "backend": backend, "load_s": round(load_s, 2),
+        "p50_ms": round(statistics.median(lat), 2), "p95_ms": round(lat[int(len(lat) * 0.95)], 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child(sys.argv[2])
+    for backend in sys.argv[1:] or ["torch", "onnx", "onnx-int8"]:
+        res = subprocess.run([sys.executable, __file__, "--child", backend], cwd=ROOT,
+                             capture_output=True, text=True)
+        if res.returncode:
+            print(f"{backend:>9}: failed ({res.stderr.strip().splitlines()[-1]})")
+            continue
+        r = json.loads(res.stdout.strip().splitlines()[-1])
+        print(f"{backend:>9}: load {r['load_s']:5.2f}s  p50 {r['p50_ms']:6.2f} ms  "
+              f"p95 {r['p95_ms']:6.2f} ms  peak RSS {r['peak_rss_mb']:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
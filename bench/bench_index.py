@@ -0,0 +1,78 @@
+"""
+Rule-index open cost vs size: legacy rules.json + rules.npy vs the compact format
+(float32 / float16), with synthetic chunks of realistic size.
+
+    python bench/bench_index.py [n_chunks ...]     # default 1000 10000 50000
+
+Each open + one top-6 search runs in a fresh subprocess (peak RSS via VmHWM, which,
+unlike ru_maxrss, does not inherit the parent's high-water mark).
+"""
+import sys, json, time, pathlib, subprocess, tempfile
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+DIM = 384
+
+
+def build(d: pathlib.Path, n: int, fmt: str):
+    from rag.index_store import write_index
+    rng = np.random.default_rng(0)
+    emb = rng.standard_normal((n, DIM)).astype("float32")
+    emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+    chunks = [{"doc_id": f"{i:08x}", "title": f"Source {i % 300}", "url": f"https://example.gov.sg/p/{i % 300}",
+               "retrieved_at": "2025-01-01", "text": ("Eligibility conditions and amounts apply. " * 90)[:3500]}
+              for i in range(n)]
+    d.mkdir(parents=True)
+    if fmt == "legacy":
+        np.save(d / "rules.npy", emb)
+        (d / "rules.json").write_text(json.dumps(chunks, ensure_ascii=False, indent=2), encoding="utf-8")
+    else:
+        write_index(d, chunks, emb, "bench", float16=(fmt == "float16"))
+
+
+def child(d):
+    from rag import retrieve
+    retrieve.IDX_DIR = pathlib.Path(d)
+    t = time.perf_counter()
+    r = retrieve.RuleRetriever(top_k=6, encoder=_Encoder())
+    open_s = time.perf_counter() - t
+    t = time.perf_counter()
+    r.search("grant eligibility")
+    search_s = time.perf_counter() - t
+    print(json.dumps({"open_ms": round(open_s * 1e3, 1), "search_ms": round(search_s * 1e3, 1),
+                      "peak_rss_mb": round(_vm_hwm_kb() / 1024, 1)}))
+
+
+def _vm_hwm_kb():
+    for line in pathlib.Path("/proc/self/status").read_text().splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1])
+    return 0
+
+
+class _Encoder:
+    def encode(self, texts, normalize_embeddings=True):
+        v = np.ones((len(texts), DIM), dtype="float32")
+        return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child(sys.argv[2])
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 50000]
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            for fmt in ("legacy", "float32", "float16"):
+                d = pathlib.Path(tmp) / f"{fmt}_{n}"
+                build(d, n, fmt)
+                res = subprocess.run([sys.executable, __file__, "--child", str(d)], cwd=ROOT,
+                                     capture_output=True, text=True, check=True)
+                r = json.loads(res.stdout.strip().splitlines()[-1])
+                size = sum(f.stat().st_size for f in d.iterdir()) / 1e6
+                print(f"{n:>6} {fmt:>8}: open {r['open_ms']:8.1f} ms  search {r['search_ms']:6.1f} ms  "
+                      f"peak RSS {r['peak_rss_mb']:7.1f} MB  on disk {size:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Ingest benchmark: legacy pandas loader vs DuckDB's streaming read_csv path.
+
+    python bench/bench_ingest.py                 # synthetic 900k-row CSV
+    python bench/bench_ingest.py data/foo.csv    # a real data.gov.sg file
+
+Each path runs in a fresh subprocess so peak RSS (ru_maxrss) is measured per path.
+"""
+import sys, csv, json, time, random, pathlib, resource, subprocess, tempfile
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+HEADER = ["month", "town", "flat_type", "block", "street_name", "storey_range", "floor_area_sqm",
+          "flat_model", "lease_commence_date", "remaining_lease", "resale_price"]
+
+
+def make_csv(path: pathlib.Path, n: int):
+    rnd = random.Random(0)
+    towns = ["ANG MO KIO", "BEDOK", "BISHAN", "CLEMENTI", "JURONG WEST", "PUNGGOL", "TAMPINES", "WOODLANDS"]
+    types = ["2 ROOM", "3 ROOM", "4 ROOM", "5 ROOM", "EXECUTIVE"]
+    with path.open("w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(HEADER)
+        for i in range(n):
+            y, m = 1990 + i * 35 // n, rnd.randint(1, 12)
+            lease = rnd.randint(1970, 2020)
+            w.writerow([f"{y}-{m:02d}", rnd.choice(towns), rnd.choice(types), str(rnd.randint(1, 999)),
+                        f"STREET {rnd.randint(1, 60)}", f"{rnd.randrange(1, 40, 3):02d} TO {rnd.randrange(3, 42, 3):02d}",
+                        rnd.randint(35, 160), "Model A", lease, f"{lease + 99 - 2024} years {rnd.randint(0, 11):02d} months",
+                        rnd.randint(150, 1500) * 1000])
+
+
+def run_pandas(csv_path, db_path):
+    # The loader db/init_duckdb.py used before the streaming path
+    import duckdb
+    import pandas as pd
+    df = pd.read_csv(csv_path)
+    df["month"] = pd.to_datetime(df["month"].astype(str) + "-01")
+    df["resale_price"] = pd.to_numeric(df["resale_price"], errors="coerce")
+    df["floor_area_sqm"] = pd.to_numeric(df["floor_area_sqm"], errors="coerce")
+    con = duckdb.connect(db_path)
+    con.register("df_in", df)
+    con.execute("""
+        CREATE TABLE resale_txn AS
+        SELECT month, town, block, street_name, flat_type, storey_range,
+               floor_area_sqm, lease_commence_date, remaining_lease, resale_price
+        FROM df_in
+    """)
+    con.close()
+
+
+def run_duckdb(csv_path, db_path):
+    import duckdb
+    from db.init_duckdb import resale_csv_select
+    sql, params = resale_csv_select(pathlib.Path(csv_path))
+    con = duckdb.connect(db_path)
+    con.execute(f"CREATE TABLE resale_txn AS {sql}", params)
+    con.close()
+
+
+def child(mode, csv_path, db_path):
+    t = time.perf_counter()
+    {"pandas": run_pandas, "duckdb": run_duckdb}[mode](csv_path, db_path)
+    wall = time.perf_counter() - t
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    print(json.dumps({"mode": mode, "wall_s": round(wall, 3), "peak_rss_mb": round(rss_mb, 1)}))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child(*sys.argv[2:5])
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        if len(sys.argv) > 1:
+            csv_path = pathlib.Path(sys.argv[1])
+        else:
+            csv_path = tmp / "synthetic.csv"
+            make_csv(csv_path, 900_000)
+        size_mb = csv_path.stat().st_size / 1e6
+        print(f"CSV: {csv_path} ({size_mb:.1f} MB)")
+        for mode in ("pandas", "duckdb"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", mode, str(csv_path), str(tmp / f"{mode}.duckdb")],
+                capture_output=True, text=True, check=True,
+            )
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{mode:>7}: {r['wall_s']:7.2f}s  peak RSS {r['peak_rss_mb']:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
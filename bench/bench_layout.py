@@ -0,0 +1,88 @@
+"""
+Storage layout benchmark: legacy resale_txn (TEXT columns, CSV row order) vs the typed,
+clustered layout db/init_duckdb.py now writes (ENUMs, lease in months, sorted by
+town/flat_type/month). Reports file size and comps-style filter latency.
+
+    python bench/bench_layout.py                 # synthetic 900k-row CSV
+    python bench/bench_layout.py data/foo.csv
+"""
+import sys, time, pathlib, tempfile, statistics
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import duckdb
+from bench.bench_ingest import make_csv
+from db import init_duckdb
+from tools import sql_utils
+from tools.comps import PSF_SQL, _catalog, _eq
+
+def queries(meta):
+    # filters and PSF exactly as tools/comps.py writes them for this layout
+    # (TRY_CAST to the ENUM type on the typed DB)
+    town, ft = _eq("town", meta), _eq("flat_type", meta)
+    return {
+        "town+type 12m": (f"""
+            SELECT COUNT(*), MEDIAN(resale_price), MEDIAN({PSF_SQL})
+            FROM resale_txn WHERE {town} AND {ft} AND month >= DATE '2024-01-01'
+        """, ["TAMPINES", "4 ROOM"]),
+        "town+type all": (f"""
+            SELECT COUNT(*), MEDIAN(resale_price)
+            FROM resale_txn WHERE {town} AND {ft}
+        """, ["BEDOK", "5 ROOM"]),
+        "recent 20": (f"""
+            SELECT month, town, block, street_name, flat_type, storey_range,
+                   floor_area_sqm, resale_price, {PSF_SQL} AS psf
+            FROM resale_txn WHERE {town} AND {ft}
+            ORDER BY month DESC LIMIT 20
+        """, ["PUNGGOL", "4 ROOM"]),
+    }
+
+
+def timeit(con, sql, params, n=30):
+    con.execute(sql, params).fetchall()
+    ts = []
+    for _ in range(n):
+        t = time.perf_counter()
+        con.execute(sql, params).fetchall()
+        ts.append(time.perf_counter() - t)
+    return statistics.median(ts) * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        if len(sys.argv) > 1:
+            csv_path = pathlib.Path(sys.argv[1])
+        else:
+            csv_path = tmp / "synthetic.csv"
+            make_csv(csv_path, 900_000)
+
+        legacy = tmp / "legacy.duckdb"
+        sql, params = init_duckdb.resale_csv_select(csv_path)
+        con = duckdb.connect(legacy.as_posix())
+        con.execute(f"CREATE TABLE resale_txn AS {sql}", params)
+        con.close()
+
+        loaded = tmp / "loaded.duckdb"
+        sql_utils.DB_PATH = loaded
+        init_duckdb.main([str(csv_path)])
+        # Copy resale_txn alone into a fresh file so sizes compare like for like
+        typed = tmp / "typed.duckdb"
+        con = duckdb.connect(loaded.as_posix())
+        con.execute("DROP TABLE IF EXISTS comps_monthly")
+        con.execute(f"ATTACH '{typed.as_posix()}' AS typed")
+        con.execute("COPY FROM DATABASE loaded TO typed")
+        con.close()
+
+        print(f"{'':16}{'legacy':>12}{'typed':>12}")
+        print(f"{'file size (MB)':16}{legacy.stat().st_size / 1e6:12.1f}{typed.stat().st_size / 1e6:12.1f}")
+        cons = [duckdb.connect(p.as_posix(), read_only=True) for p in (legacy, typed)]
+        legacy_q, typed_q = (queries(_catalog(c)) for c in cons)
+        for name in legacy_q:
+            a, b = timeit(cons[0], *legacy_q[name]), timeit(cons[1], *typed_q[name])
+            print(f"{name + ' (ms)':16}{a:12.2f}{b:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Cold-start benchmark for the app's Python side (no Streamlit server):
+
+    python bench/bench_startup.py
+
+In a fresh interpreter: time to import the modules streamlit_app.py imports, to build
+RuleRetriever (index only), then model import/load and the first/second query latency.
+The last two need sentence_transformers and the MiniLM weights (cached or downloadable).
+"""
+import sys, json, time, pathlib, subprocess
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+APP_IMPORTS = [
+    "tools.comps", "tools.discovery", "tools.calc_afford", "rag.retrieve", "rag.answer",
+    "tools.readiness", "tools.timeline", "tools.formatting", "tools.grants_prompt",
+    "tools.eip_spr_prompt", "tools.block_checklist",
+]
+
+
+def child():
+    import importlib
+    sys.path.insert(0, str(ROOT))
+    out = {}
+    t = time.perf_counter()
+    for m in APP_IMPORTS:
+        importlib.import_module(m)
+    out["app_imports_s"] = time.perf_counter() - t
+    out["torch_imported"] = "torch" in sys.modules
+
+    from rag.retrieve import RuleRetriever
+    t = time.perf_counter()
+    r = RuleRetriever(top_k=6)
+    out["retriever_init_s"] = time.perf_counter() - t
+    try:
+        r.search("How long is the OTP valid?")
+        r.search("Which grants can first-timer families get?")
+        out.update(r.timings)
+    except Exception as e:  # no sentence_transformers / weights offline
+        out["search_error"] = f"{type(e).__name__}: {e}"[:200]
+    print(json.dumps(out))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child()
+    res = subprocess.run([sys.executable, __file__, "--child"], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    r = json.loads(res.stdout.strip().splitlines()[-1])
+    for k, v in r.items():
+        print(f"{k:>18}: {v:.3f}s" if isinstance(v, float) else f"{k:>18}: {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,389 @@
-import duckdb, sys, pathlib
-import pandas as pd
-
-DATA_CSV = pathlib.Path("data/resale-flat-prices.csv")
-DB_PATH  = pathlib.Path("db/resale.duckdb")
-
-def main():
-    if len(sys.argv) > 1:
-        csv_path = pathlib.Path(sys.argv[1])
-    else:
-        csv_path = DATA_CSV
-    if not csv_path.exists():
-        raise SystemExit(f"CSV not found: {csv_path}. Place the dataset under data/.")
-
-    # Load CSV with pandas for light cleanup
-    df = pd.read_csv(csv_path)
-
-    # Basic normalization
-    # - Convert 'month' like '2024-06' into first-day-of-month date
-    # - Coerce numeric types
-    df["month"] = pd.to_datetime(df["month"].astype(str) + "-01")
-    df["resale_price"] = pd.to_numeric(df["resale_price"], errors="coerce")
-    df["floor_area_sqm"] = pd.to_numeric(df["floor_area_sqm"], errors="coerce")
-
-    # Create DB and load table
-    con = duckdb.connect(DB_PATH.as_posix())
+import sys, csv, json, shutil, pathlib, hashlib, argparse, datetime
+
+# Allow `python db/init_duckdb.py` from the repo root to import tools/
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from tools.sql_utils import DB_PATH, ENUM_TYPES, SNAPSHOT_DIR, SNAPSHOT_MANIFEST, duckdb_conn
+from tools.comps import PSF_SQL
+from tools.discovery import SUMMARY_TABLE, block_summary_sql
+
+DATA_DIR = pathlib.Path("data")
+DATA_CSV = DATA_DIR / "resale-flat-prices.csv"
+
+# Columns as published by data.gov.sg (after normalisation), with their plain SQL types
+RAW_TYPES = {
+    "month": "DATE",
+    "town": "VARCHAR",
+    "block": "VARCHAR",
+    "street_name": "VARCHAR",
+    "flat_type": "VARCHAR",
+    "storey_range": "VARCHAR",
+    "floor_area_sqm": "DOUBLE",
+    "lease_commence_date": "INTEGER",
+    "remaining_lease": "VARCHAR",
+    "resale_price": "DOUBLE",
+}
+TXN_COLS = list(RAW_TYPES)
+
+# Identity of a transaction for de-duplication across overlapping/refreshed files.
+# data.gov.sg has no txn id; together with an occurrence number (identical sales in the
+# same month are legitimate) this lets us append only rows we have not seen before.
+KEY_SQL = ("hash(month, town::VARCHAR, block, street_name, flat_type::VARCHAR, "
+           "storey_range::VARCHAR, floor_area_sqm, resale_price)")
+
+# Low-cardinality text columns stored as ENUMs (1-byte codes, cheap comparisons)
+ENUM_COLS = ENUM_TYPES
+# Rows are kept sorted on the comps filter columns so zone maps skip row groups
+CLUSTER_BY = "town, flat_type, month"
+ROW_GROUP_SIZE = 122_880  # DuckDB default; smaller appends are left as an unsorted tail
+
+# remaining_lease comes as "61 years 04 months" (2017+), "70" (2015-2016) or is absent
+LEASE_YEARS_SQL  = r"""COALESCE(TRY_CAST(regexp_extract(remaining_lease, '(\d+)\s*year', 1) AS INTEGER),
+                                TRY_CAST(regexp_extract(remaining_lease, '^\s*(\d+)\s*$', 1) AS INTEGER))"""
+LEASE_MONTHS_SQL = r"""COALESCE(TRY_CAST(regexp_extract(remaining_lease, '(\d+)\s*month', 1) AS INTEGER), 0)"""
+# Only the months are stored; the display text is rebuilt from them when needed
+REMAINING_LEASE_SQL = "format('{:d} years {:02d} months', remaining_lease_months // 12, remaining_lease_months % 12)"
+
+def _table_exists(con, name: str) -> bool:
+    return con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ? AND NOT temporary", [name]
+    ).fetchone()[0] > 0
+
+def create_schema(con):
+    # resale_txn itself is created by relayout() on the first load (its ENUMs need values)
+    # One row per file per load; load_id doubles as the data version stamp
     con.execute("""
-        CREATE TABLE IF NOT EXISTS resale_txn (
-          month DATE,
-          town TEXT,
-          block TEXT,
-          street_name TEXT,
-          flat_type TEXT,
-          storey_range TEXT,
-          floor_area_sqm DOUBLE,
-          lease_commence_date INTEGER,
-          remaining_lease TEXT,
-          resale_price DOUBLE
+        CREATE TABLE IF NOT EXISTS load_manifest (
+          load_id INTEGER,
+          file TEXT,
+          sha256 TEXT,
+          rows_in_file BIGINT,
+          rows_added BIGINT,
+          min_month DATE,
+          max_month DATE,
+          loaded_at TIMESTAMP DEFAULT current_timestamp
         );
     """)
-    con.execute("DELETE FROM resale_txn;")  # full refresh
-    con.register("df_in", df)
-    con.execute("""
-        INSERT INTO resale_txn
-        SELECT month, town, block, street_name, flat_type, storey_range,
-               floor_area_sqm, lease_commence_date, remaining_lease, resale_price
-        FROM df_in;
+
+def file_sha256(path: pathlib.Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def csv_header(path: pathlib.Path) -> list:
+    with path.open(newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+def resale_csv_select(path: pathlib.Path) -> tuple:
+    """
+    SELECT over DuckDB's streaming CSV reader that yields resale_txn rows: every column is
+    read as VARCHAR and normalised in SQL (month -> DATE, numeric coercion, lease text),
+    so nothing is materialised in pandas. Columns an older file lacks come back NULL.
+    """
+    present = [c for c in csv_header(path) if c]
+    columns = "{" + ", ".join(f"'{c}': 'VARCHAR'" for c in present) + "}"
+    missing = "".join(f", NULL::VARCHAR AS {c}" for c in TXN_COLS if c not in present)
+    sql = f"""
+        SELECT
+          CAST(month || '-01' AS DATE)                     AS month,
+          town, block, street_name, flat_type, storey_range,
+          TRY_CAST(floor_area_sqm AS DOUBLE)               AS floor_area_sqm,
+          TRY_CAST(lease_commence_date AS INTEGER)         AS lease_commence_date,
+          CASE WHEN {LEASE_YEARS_SQL} IS NOT NULL
+               THEN format('{{:d}} years {{:02d}} months', {LEASE_YEARS_SQL}, {LEASE_MONTHS_SQL})
+          END                                              AS remaining_lease,
+          TRY_CAST(resale_price AS DOUBLE)                 AS resale_price
+        FROM (
+          SELECT *{missing}
+          FROM read_csv(?, header = true, columns = {columns})
+        )
+    """
+    return sql, [path.as_posix()]
+
+def _columns(con, table: str) -> set:
+    return {c for (c,) in con.execute(
+        "SELECT column_name FROM duckdb_columns() WHERE table_name = ?", [table]
+    ).fetchall()}
+
+def _is_typed(con) -> bool:
+    # the baseline loader's TEXT table (lease_commence_year, no derived columns) isn't
+    return "remaining_lease_months" in _columns(con, "resale_txn")
+
+def raw_select(src: str, cols: set = None) -> str:
+    """
+    Plain-typed TXN_COLS from `src` (ENUM columns come back as VARCHAR). `cols` are the
+    columns `src` has, when it may be resale_txn itself: the typed layout keeps only
+    remaining_lease_months, and a baseline-schema table names the lease start
+    lease_commence_year.
+    """
+    exprs = {}
+    if cols and "remaining_lease" not in cols and "remaining_lease_months" in cols:
+        exprs["remaining_lease"] = REMAINING_LEASE_SQL
+    if cols and "lease_commence_date" not in cols and "lease_commence_year" in cols:
+        exprs["lease_commence_date"] = "lease_commence_year"
+    select = ", ".join(f"({exprs.get(c, c)})::{t} AS {c}" for c, t in RAW_TYPES.items())
+    return f"SELECT {select} FROM {src}"
+
+def typed_select(src: str) -> str:
+    """
+    resale_txn's physical layout from a plain-typed source: ENUM categoricals and the
+    remaining lease in months (from the 99-year lease start when the file has no
+    remaining_lease), computed once at load time. Nothing derivable is stored twice: the
+    lease text comes back via REMAINING_LEASE_SQL, PSF is tools/comps.PSF_SQL.
+    """
+    return f"""
+        SELECT
+          month,
+          town::{ENUM_COLS["town"]}                                         AS town,
+          block,
+          street_name,
+          flat_type::{ENUM_COLS["flat_type"]}                               AS flat_type,
+          storey_range::{ENUM_COLS["storey_range"]}                         AS storey_range,
+          floor_area_sqm,
+          lease_commence_date,
+          CAST(COALESCE({LEASE_YEARS_SQL} * 12 + {LEASE_MONTHS_SQL},
+                        (lease_commence_date + 99 - year(month)) * 12 - (month(month) - 1))
+               AS SMALLINT)                                                 AS remaining_lease_months,
+          resale_price
+        FROM {src}
+    """
+
+def _fits_enums(con, src: str) -> bool:
+    # A table from before the typed layout has no ENUM types yet -> relayout converts it
+    n_types = con.execute(
+        f"SELECT COUNT(*) FROM duckdb_types() WHERE type_name IN ({', '.join('?' * len(ENUM_COLS))})",
+        list(ENUM_COLS.values()),
+    ).fetchone()[0]
+    if n_types < len(ENUM_COLS):
+        return False
+    cond = " OR ".join(f"({c} IS NOT NULL AND TRY_CAST({c} AS {t}) IS NULL)" for c, t in ENUM_COLS.items())
+    return con.execute(f"SELECT COUNT(*) FROM {src} WHERE {cond}").fetchone()[0] == 0
+
+def relayout(con, extra: str = None):
+    """
+    (Re)write resale_txn from its current rows plus `extra` (a plain-typed table): ENUM
+    types are recreated from the distinct values and rows are written sorted by
+    CLUSTER_BY. Creates the table on the first load, and runs again when a load brings a
+    value an ENUM lacks (a new town) or after appends too large to leave unsorted.
+    """
+    parts = []
+    if _table_exists(con, "resale_txn"):
+        parts.append(raw_select("resale_txn", _columns(con, "resale_txn")))
+    if extra:
+        parts.append(raw_select(extra))
+    if not parts:
+        return
+    src = " UNION ALL ".join(parts)
+    con.execute(f"CREATE OR REPLACE TEMP TABLE relayout_src AS {src}")
+    # the cube shares the ENUM types; build_aggregates() recreates it in full
+    con.execute("DROP TABLE IF EXISTS comps_monthly")
+    con.execute("DROP TABLE IF EXISTS resale_txn")
+    for c, t in ENUM_COLS.items():
+        con.execute(f"DROP TYPE IF EXISTS {t}")
+        con.execute(f"CREATE TYPE {t} AS ENUM (SELECT DISTINCT {c} FROM relayout_src WHERE {c} IS NOT NULL ORDER BY 1)")
+    con.execute(f"CREATE TABLE resale_txn AS {typed_select('relayout_src')} ORDER BY {CLUSTER_BY}")
+    con.execute("DROP TABLE relayout_src")
+
+def _keyed(src: str) -> str:
+    return f"""
+        SELECT *, {KEY_SQL} AS row_key,
+               row_number() OVER (PARTITION BY {KEY_SQL}) AS occ
+        FROM {src}
+    """
+
+def ingest_file(con, path: pathlib.Path, load_id: int, full: bool = False) -> dict:
+    """
+    Append the rows of `path` not already in resale_txn, in one transaction, and record
+    the file in load_manifest. Files whose checksum was already loaded are skipped.
+    """
+    sha = file_sha256(path)
+    seen = con.execute(
+        "SELECT COUNT(*) FROM load_manifest WHERE sha256 = ?", [sha]
+    ).fetchone()[0]
+    if seen and not full:
+        return {"file": path.name, "skipped": True, "rows_added": 0}
+
+    cols = ", ".join(TXN_COLS)
+    src_sql, src_params = resale_csv_select(path)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE staging AS {src_sql}", src_params)
+        lo, hi, n_file = con.execute(
+            "SELECT MIN(month), MAX(month), COUNT(*) FROM staging"
+        ).fetchone()
+        # Only months present in the file can hold duplicates of its rows
+        has_txn = _table_exists(con, "resale_txn")
+        existing = f"(SELECT * FROM resale_txn WHERE month BETWEEN DATE '{lo}' AND DATE '{hi}')" \
+            if has_txn and lo is not None else "(SELECT * FROM staging WHERE false)"
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE delta AS
+            SELECT {cols}
+            FROM ({_keyed("staging")}) s
+            ANTI JOIN ({_keyed(existing)}) t
+              USING (row_key, occ)
+        """)
+        added = con.execute("SELECT COUNT(*) FROM delta").fetchone()[0]
+        if added and has_txn and _is_typed(con) and _fits_enums(con, "delta"):
+            con.execute(f"INSERT INTO resale_txn BY NAME {typed_select('delta')} ORDER BY {CLUSTER_BY}")
+        elif added:
+            relayout(con, extra="delta")
+        con.execute(
+            "INSERT INTO load_manifest (load_id, file, sha256, rows_in_file, rows_added, min_month, max_month) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [load_id, path.name, sha, n_file, added, lo, hi],
+        )
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.execute("DROP TABLE IF EXISTS staging")
+        con.execute("DROP TABLE IF EXISTS delta")
+    return {"file": path.name, "skipped": False, "rows_in_file": n_file,
+            "rows_added": added, "min_month": lo}
+
+def build_aggregates(con, since=None):
+    """
+    Monthly comps cube: one row per month x town x block x flat_type with the deal count,
+    sorted price/PSF arrays (enough for exact P25/P50/P75 after merging) and summed sqm.
+    tools/comps.py answers summary + series from here instead of raw transactions.
+    With `since`, only months from that date on are rebuilt (after an incremental load).
+    block_summary (tools/discovery.py) is always rebuilt in full.
+    """
+    if since is None or not _table_exists(con, "comps_monthly"):
+        since = None
+        con.execute("DROP TABLE IF EXISTS comps_monthly")
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS comps_monthly (
+          month DATE, town {ENUM_COLS["town"]}, block TEXT, flat_type {ENUM_COLS["flat_type"]},
+          deals BIGINT, prices DOUBLE[], psfs DOUBLE[], sum_sqm DOUBLE
+        );
     """)
-    con.unregister("df_in")
+    con.execute("DELETE FROM comps_monthly WHERE month >= COALESCE(?::DATE, DATE '0001-01-01')", [since])
+    con.execute(f"""
+        INSERT INTO comps_monthly
+        SELECT month, town, block, flat_type,
+               COUNT(*)                                  AS deals,
+               LIST(resale_price ORDER BY resale_price)  AS prices,
+               LIST({PSF_SQL} ORDER BY {PSF_SQL})        AS psfs,
+               SUM(floor_area_sqm)                       AS sum_sqm
+        FROM resale_txn
+        WHERE month >= COALESCE(?::DATE, DATE '0001-01-01')
+        GROUP BY month, town, block, flat_type
+        ORDER BY town, flat_type, month;
+    """, [since])
+    # Discovery tab's per-block screen: small, and relative to the newest month -> full rebuild
+    con.execute(f"CREATE OR REPLACE TABLE {SUMMARY_TABLE} AS {block_summary_sql(con)}")
+
+# Snapshot tables and their hive partition columns (with the types readers should use)
+SNAPSHOT_TABLES = {
+    "resale_txn": {"year": "INTEGER", "town": "VARCHAR"},
+    "comps_monthly": {"year": "INTEGER", "town": "VARCHAR"},
+    SUMMARY_TABLE: {},
+    "load_manifest": {},
+}
+
+def export_snapshot(con, out_dir: pathlib.Path = SNAPSHOT_DIR) -> dict:
+    """
+    Write the loaded tables as Parquet under `out_dir`: resale_txn and comps_monthly
+    hive-partitioned by year/town (one small zstd file per partition, so a refresh only
+    rewrites the partitions that changed), load_manifest as a single file, then a
+    manifest.json with row counts and the load id. tools/sql_utils can serve straight
+    from this directory instead of db/resale.duckdb.
+    """
+    tmp = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    tables = {}
+    for name, parts in SNAPSHOT_TABLES.items():
+        if not _table_exists(con, name):
+            continue
+        if parts:
+            con.execute(f"""
+                COPY (SELECT *, year(month)::INTEGER AS year FROM {name} ORDER BY {CLUSTER_BY})
+                TO '{(tmp / name).as_posix()}'
+                (FORMAT parquet, COMPRESSION zstd, PARTITION_BY ({", ".join(parts)}))
+            """)
+            files = list((tmp / name).rglob("*.parquet"))
+        else:
+            con.execute(f"COPY {name} TO '{(tmp / name).as_posix()}.parquet' (FORMAT parquet, COMPRESSION zstd)")
+            files = [tmp / f"{name}.parquet"]
+        tables[name] = {
+            "rows": con.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0],
+            "files": len(files),
+            "bytes": sum(f.stat().st_size for f in files),
+            "partition_by": parts,
+        }
+    lo, hi = con.execute("SELECT MIN(month), MAX(month) FROM resale_txn").fetchone()
+    manifest = {
+        "format": 1,
+        "load_id": con.execute("SELECT MAX(load_id) FROM load_manifest").fetchone()[0]
+                   if "load_manifest" in tables else None,
+        "min_month": str(lo),
+        "max_month": str(hi),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "tables": tables,
+    }
+    # swap in the finished directory; the manifest is written last since readers key on it
+    shutil.rmtree(out_dir, ignore_errors=True)
+    tmp.rename(out_dir)
+    (out_dir / SNAPSHOT_MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load data.gov.sg resale CSVs into DuckDB.")
+    ap.add_argument("csv", nargs="*", type=pathlib.Path,
+                    help="CSV files (default: data/resale-flat-prices.csv, else every data/*.csv)")
+    ap.add_argument("--full", action="store_true", help="drop existing rows and reload everything")
+    ap.add_argument("--optimize", action="store_true", help="re-sort resale_txn even after a small append")
+    ap.add_argument("--snapshot", nargs="?", type=pathlib.Path, const=SNAPSHOT_DIR, metavar="DIR",
+                    help=f"also write a partitioned Parquet snapshot (default dir: {SNAPSHOT_DIR})")
+    args = ap.parse_args(argv)
+
+    csv_paths = args.csv or ([DATA_CSV] if DATA_CSV.exists() else sorted(DATA_DIR.glob("*.csv")))
+    missing = [p for p in csv_paths if not p.exists()]
+    if not csv_paths or missing:
+        raise SystemExit(f"CSV not found: {missing or DATA_CSV}. Place the dataset under data/.")
+
+    con = duckdb_conn(write=True)
+    create_schema(con)
+    if args.full:
+        con.execute("DROP TABLE IF EXISTS resale_txn;")
+        con.execute("DELETE FROM load_manifest;")
+    load_id = con.execute("SELECT COALESCE(MAX(load_id), 0) + 1 FROM load_manifest").fetchone()[0]
+
+    results = []
+    for p in csv_paths:
+        r = ingest_file(con, p, load_id, full=args.full)
+        results.append(r)
+        if r["skipped"]:
+            print(f"[SKIP] {r['file']} unchanged since last load")
+        else:
+            print(f"[OK] {r['file']}: {r['rows_added']} new of {r['rows_in_file']} rows")
+
+    # Each append is sorted, but a multi-file or large load leaves several sorted runs;
+    # re-cluster so (town, flat_type, month) filters skip whole row groups again.
+    added = sum(r["rows_added"] for r in results)
+    # a baseline-schema table (the committed db/resale.duckdb) is converted on the first run
+    relaid = args.full or args.optimize or added >= ROW_GROUP_SIZE or not _is_typed(con)
+    if relaid:
+        relayout(con)
+        con.execute("CHECKPOINT")
 
-    # Helpful indices (DuckDB uses zone maps; these are pragmas)
-    # But we can add projections and views if needed later.
+    # relayout() drops the cube (it shares the ENUM types), so rebuild it in full then
+    changed = [r["min_month"] for r in results if r["rows_added"]]
+    if relaid:
+        build_aggregates(con)
+    elif changed:
+        build_aggregates(con, since=min(changed))
 
-    print(f"Loaded {con.execute('SELECT COUNT(*) FROM resale_txn').fetchone()[0]} rows into {DB_PATH}")
+    print(f"Loaded {con.execute('SELECT COUNT(*) FROM resale_txn').fetchone()[0]} rows into {DB_PATH} (load {load_id})")
+    if args.snapshot:
+        m = export_snapshot(con, args.snapshot)
+        t = m["tables"]["resale_txn"]
+        print(f"Snapshot: {t['files']} Parquet files ({t['bytes'] / 1e6:.1f} MB) in {args.snapshot}")
+    con.close()
 
 if __name__ == "__main__":
     main()
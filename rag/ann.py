@@ -0,0 +1,62 @@
+"""
+IVF (inverted file) approximate search for large rule indexes, in NumPy + scikit-learn.
+
+Chunks are clustered by k-means on their (normalised) embeddings; a query scores the
+centroids, then only the rows of the `nprobe` closest clusters. Built next to the index
+by rag/index_store.write_index() once it has ANN_MIN_CHUNKS chunks; below that a dense
+dot product over everything is faster and exact.
+"""
+import os, pathlib
+import numpy as np
+
+ANN_FILE = "rules.ivf.npz"
+# below this a dense dot product is ~5 ms or less anyway (bench/bench_ann.py)
+ANN_MIN_CHUNKS = int(os.getenv("RAG_ANN_MIN_CHUNKS", "50000"))
+TRAIN_SAMPLE = 100_000
+
+
+def default_nlist(n: int) -> int:
+    return max(1, int(4 * np.sqrt(n)))
+
+
+def default_nprobe(nlist: int) -> int:
+    # ~0.97+ recall@6 on clustered data (bench/bench_ann.py)
+    return max(8, nlist // 8)
+
+
+def build_ivf(emb, nlist: int = None, seed: int = 0) -> dict:
+    """Cluster rows of `emb` -> {"centroids" [C, D], "offsets" [C+1], "rows" [N] by cluster}."""
+    from sklearn.cluster import MiniBatchKMeans  # only index builds pay this import
+    x = np.asarray(emb, dtype="float32")
+    nlist = min(nlist or default_nlist(len(x)), len(x))
+    rng = np.random.default_rng(seed)
+    train = x[rng.choice(len(x), TRAIN_SAMPLE, replace=False)] if len(x) > TRAIN_SAMPLE else x
+    km = MiniBatchKMeans(n_clusters=nlist, random_state=seed, batch_size=4096, n_init=1).fit(train)
+    centroids = km.cluster_centers_.astype("float32")
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    # assign every row to its best centroid (cosine), in blocks to bound memory
+    assign = np.concatenate([np.argmax(x[i:i + 8192] @ centroids.T, axis=1) for i in range(0, len(x), 8192)])
+    rows = np.argsort(assign, kind="stable").astype("int32")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype("int64")
+    return {"centroids": centroids, "offsets": offsets, "rows": rows}
+
+
+def load_ivf(path: pathlib.Path) -> dict:
+    with np.load(path.as_posix()) as z:
+        return {k: z[k] for k in z.files}
+
+
+def ivf_search(emb, ivf: dict, q, k: int, nprobe: int = None):
+    """(row ids, scores) of the approximate top-k for normalised query `q` [D]."""
+    centroids, offsets, rows = ivf["centroids"], ivf["offsets"], ivf["rows"]
+    nprobe = nprobe or default_nprobe(len(centroids))
+    order = np.argsort(centroids @ q)[::-1]
+    # probe at least nprobe lists, and more if they hold fewer than k rows
+    sizes = offsets[order + 1] - offsets[order]
+    n = max(nprobe, int(np.searchsorted(np.cumsum(sizes), k)) + 1)
+    cand = np.concatenate([rows[offsets[c]:offsets[c + 1]] for c in order[:n]])
+    cand.sort()  # sequential reads from the memory-mapped embeddings
+    scores = np.asarray(emb[cand], dtype="float32") @ q
+    top = np.argpartition(scores, -k)[-k:] if len(cand) > k else np.arange(len(cand))
+    top = top[np.argsort(scores[top])[::-1]]
+    return cand[top], scores[top]
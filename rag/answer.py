@@ -1,21 +1,44 @@
-import os
+import os, time, threading
 from typing import List, Dict
 from textwrap import shorten
-from openai import OpenAI
+from rag.context import count_tokens, pack_context
 
-def synthesize_answer(query: str, hits: List[Dict]) -> Dict:
+ANSWER_MODEL = "gpt-4o-mini"
+# seconds to connect / between streamed tokens, and for the whole answer
+ANSWER_TIMEOUT_S = float(os.getenv("ANSWER_TIMEOUT_S", "20"))
+ANSWER_DEADLINE_S = float(os.getenv("ANSWER_DEADLINE_S", "60"))
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+def answer_mode() -> str:
+    """Which synthesizer synthesize_answer() will use right now (part of cache keys)."""
+    return f"openai:{ANSWER_MODEL}" if os.getenv("OPENAI_API_KEY") else "extractive"
+
+def get_client():
     """
-    If OPENAI_API_KEY set, ask model to write a concise, stepwise answer using only provided chunks.
-    Else, return an extractive bulleted answer.
+    One OpenAI client per process (and per key / base URL), so every answer reuses its
+    pooled HTTP connections instead of a new TLS handshake. OPENAI_BASE_URL points it at
+    a local stub (tests/openai_stub.py).
     """
-    citations = [{"title": h["title"], "url": h["url"]} for h in hits[:4]]  # show top 4 sources
-
-    if os.getenv("OPENAI_API_KEY"):
-        client = OpenAI()
-        context = ""
-        for i, h in enumerate(hits, 1):
-            context += f"[{i}] {h['title']} | {h['url']}\n{h['text']}\n\n"
-        prompt = f"""You are a Singapore HDB resale assistant. Answer the user's question using ONLY the context below.
+    global _client, _client_key
+    key = (os.getenv("OPENAI_API_KEY"), os.getenv("OPENAI_BASE_URL"))
+    with _client_lock:
+        if _client is None or _client_key != key:
+            from openai import OpenAI  # ~0.7s import; only pay it when answering with the API
+            _client = OpenAI(timeout=ANSWER_TIMEOUT_S, max_retries=1)
+            _client_key = key
+        return _client
+
+def _citations(hits):
+    return [{"title": h["title"], "url": h["url"]} for h in hits[:4]]  # show top 4 sources
+
+def build_prompt(query: str, hits: List[Dict], context: str = None) -> str:
+    """The answer prompt; `context` defaults to pack_context() of the hits."""
+    if context is None:
+        context, _ = pack_context(query, hits)
+    return f"""You are a Singapore HDB resale assistant. Answer the user's question using ONLY the context below.
 Be concise, use bullet points or steps, and include short in-text citations like [1], [2] referring to the numbered sources.
 
 Question: {query}
@@ -23,21 +46,123 @@ Question: {query}
 Context:
 {context}
 """
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role":"user","content":prompt}],
-            temperature=0.2
-        )
-        answer_md = resp.choices[0].message.content
-        # Convert [n] to markdown links using our citations
-        for i, c in enumerate(citations, 1):
-            answer_md = answer_md.replace(f"[{i}]", f"[{i}]({c['url']})")
-        return {"answer_markdown": answer_md, "citations": citations}
 
+def link_citations(answer_md: str, citations) -> str:
+    # Convert [n] to markdown links using our citations
+    for i, c in enumerate(citations, 1):
+        answer_md = answer_md.replace(f"[{i}]", f"[{i}]({c['url']})")
+    return answer_md
+
+def extractive_answer(hits: List[Dict]) -> Dict:
     # Fallback extractive: show top snippets
     bullets = []
     for i, h in enumerate(hits, 1):
         snippet = shorten(h["text"].replace("\n"," "), width=260, placeholder="…")
         bullets.append(f"- [{i}] [{h['title']}]({h['url']}): {snippet}")
     answer_md = "**Top relevant guidance (extractive fallback):**\n" + "\n".join(bullets)
-    return {"answer_markdown": answer_md, "citations": citations}
+    return {"answer_markdown": answer_md, "citations": _citations(hits)}
+
+
+class AnswerStream:
+    """
+    Iterate for the answer's markdown as it arrives (st.write_stream() takes it as is);
+    afterwards .result is the synthesize_answer() dict, with [n] citations linked.
+
+    Without OPENAI_API_KEY the extractive answer comes as one piece. An API error or a
+    timeout before the first token falls back to it too; after that the partial answer
+    is kept with a note. Either way .result["partial"] is set. cancel() (or closing the
+    iterator, as Streamlit does on a rerun) stops reading and closes the connection.
+    timings: first_token_s, total_s. on_done(result) is called once .result is set.
+    usage: prompt_tokens (counted here) with the pack_context() stats, plus
+    api_prompt_tokens / completion_tokens when the API reports them.
+    """
+    def __init__(self, query: str, hits: List[Dict], on_done=None):
+        self.query, self.hits, self.on_done = query, hits, on_done
+        self.result = None
+        self.timings = {}
+        self.usage = {}
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _fallback(self, reason: str):
+        self.result = extractive_answer(self.hits)
+        self.result["answer_markdown"] = f"_{reason}_\n\n" + self.result["answer_markdown"]
+        self.result["partial"] = True  # not the model's answer: don't cache it as one
+        return self.result["answer_markdown"]
+
+    def __iter__(self):
+        yield from self._stream()
+        if self.on_done and self.result is not None:
+            self.on_done(self.result)
+
+    def _stream(self):
+        t0 = time.perf_counter()
+        citations = _citations(self.hits)
+        if not os.getenv("OPENAI_API_KEY"):
+            self.result = extractive_answer(self.hits)
+            yield self.result["answer_markdown"]
+            return
+        import httpx, openai
+        # reads during iteration raise httpx errors directly (e.g. ReadTimeout between tokens)
+        errors = (openai.OpenAIError, httpx.HTTPError)
+        context, self.usage = pack_context(self.query, self.hits)
+        prompt = build_prompt(self.query, self.hits, context)
+        self.usage["prompt_tokens"] = count_tokens(prompt)
+        try:
+            stream = get_client().chat.completions.create(
+                model=ANSWER_MODEL,
+                messages=[{"role":"user","content":prompt}],
+                temperature=0.2,
+                stream=True,
+                stream_options={"include_usage": True},  # a last chunk with token counts
+            )
+        except errors as e:
+            yield self._fallback(f"Answer service unavailable ({type(e).__name__}); showing the sources instead.")
+            return
+        parts, note = [], None
+        try:
+            for event in stream:
+                if self._cancel.is_set():
+                    note = "Stopped."
+                    break
+                if time.perf_counter() - t0 > ANSWER_DEADLINE_S:
+                    note = f"Answer cut off after {ANSWER_DEADLINE_S:.0f}s."
+                    break
+                if getattr(event, "usage", None):
+                    self.usage["api_prompt_tokens"] = event.usage.prompt_tokens
+                    self.usage["completion_tokens"] = event.usage.completion_tokens
+                delta = event.choices[0].delta.content if event.choices else None
+                if delta:
+                    self.timings.setdefault("first_token_s", time.perf_counter() - t0)
+                    parts.append(delta)
+                    yield delta
+        except errors as e:
+            if not parts:
+                yield self._fallback(f"Answer service unavailable ({type(e).__name__}); showing the sources instead.")
+                return
+            note = f"Answer cut off ({type(e).__name__})."
+        finally:
+            stream.close()  # also runs when the consumer stops iterating early
+            self.timings["total_s"] = time.perf_counter() - t0
+        answer_md = link_citations("".join(parts), citations)
+        if note:
+            answer_md += f"\n\n_{note}_"
+        self.result = {"answer_markdown": answer_md, "citations": citations}
+        if note:
+            self.result["partial"] = True
+
+
+def stream_answer(query: str, hits: List[Dict], on_done=None) -> AnswerStream:
+    return AnswerStream(query, hits, on_done)
+
+def synthesize_answer(query: str, hits: List[Dict]) -> Dict:
+    """
+    If OPENAI_API_KEY set, ask model to write a concise, stepwise answer using only provided chunks.
+    Else, return an extractive bulleted answer. stream_answer() is the incremental version.
+    """
+    s = AnswerStream(query, hits)
+    for _ in s:
+        pass
+    return s.result
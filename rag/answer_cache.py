@@ -0,0 +1,125 @@
+"""
+Semantic cache of synthesized answers for free-text questions.
+
+An answer is reusable when it would be built from the same prompt context: same rule
+index (content digest), same answer mode (model) and the same retrieved chunks (sorted
+doc_ids). Within that, a question hits on its normalised text, or on a near-duplicate:
+query-embedding cosine >= ANSWER_CACHE_SIM with the same numbers in it ("$3,500" and
+"$4,000" embed almost alike but need different answers).
+
+Bounded to `maxsize` entries with LRU eviction, in memory and in the sqlite file.
+"""
+import os, re, json, time, hashlib, pathlib, sqlite3, threading
+import numpy as np
+from cachetools import LRUCache
+from rag.answer import answer_mode
+from rag.query_cache import normalise_query
+
+ANSWER_CACHE = pathlib.Path("data/answer_cache.sqlite")
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_SIM = float(os.getenv("ANSWER_CACHE_SIM", "0.95"))
+
+_NUMBER = re.compile(r"\d[\d,.]*")
+
+
+def _numbers(text: str) -> str:
+    return " ".join(sorted(n.replace(",", "").rstrip(".") for n in _NUMBER.findall(text)))
+
+
+def context_key(digest: str, hits, mode: str = None) -> str:
+    ids = ",".join(sorted(h["doc_id"] for h in hits))
+    return hashlib.sha1(f"{digest}\n{mode or answer_mode()}\n{ids}".encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, path=None, maxsize: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_SIM):
+        self.maxsize, self.threshold = maxsize, threshold
+        self._lru = LRUCache(maxsize)  # (context key, text) -> (numbers, vec, answer)
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0}
+        if path:
+            path = pathlib.Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path.as_posix(), check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                  ctx TEXT, query TEXT, numbers TEXT, vec BLOB, answer TEXT, used_at REAL,
+                  PRIMARY KEY (ctx, query)
+                )
+            """)
+            # most recently used last, so they are the last to be evicted
+            rows = self._db.execute(
+                "SELECT * FROM (SELECT ctx, query, numbers, vec, answer, used_at FROM answers "
+                "ORDER BY used_at DESC LIMIT ?) ORDER BY used_at", [maxsize]).fetchall()
+            for ctx, q, nums, vec, ans, _ in rows:
+                self._lru[(ctx, q)] = (nums, np.frombuffer(vec, dtype="float32"), json.loads(ans))
+
+    def get(self, query: str, vec, digest: str, hits):
+        """Cached answer dict for this question + retrieved context, or None."""
+        ctx, text = context_key(digest, hits), normalise_query(query)
+        with self._lock:
+            hit = self._lru.get((ctx, text))
+            if hit is not None:
+                self.stats["hits"] += 1
+                self._touch(ctx, text)
+                return hit[2]
+            nums = _numbers(text)
+            cands = [(k, v) for k, v in self._lru.items() if k[0] == ctx and v[0] == nums]
+            if cands and vec is not None:
+                sims = np.stack([v[1] for _, v in cands]) @ np.asarray(vec, dtype="float32")
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    key = cands[best][0]
+                    self._lru[key] = self._lru[key]  # mark as recently used
+                    self.stats["near_hits"] += 1
+                    self._touch(*key)
+                    return cands[best][1][2]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, query: str, vec, digest: str, hits, answer: dict):
+        ctx, text = context_key(digest, hits), normalise_query(query)
+        vec = np.asarray(vec, dtype="float32")
+        with self._lock:
+            self._lru[(ctx, text)] = (_numbers(text), vec, answer)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                                 [ctx, text, _numbers(text), vec.tobytes(), json.dumps(answer), time.time()])
+                # keep the file to maxsize too: drop the least recently used rows
+                self._db.execute("DELETE FROM answers WHERE rowid NOT IN "
+                                 "(SELECT rowid FROM answers ORDER BY used_at DESC LIMIT ?)", [self.maxsize])
+                self._db.commit()
+
+    def _touch(self, ctx, text):
+        if self._db is not None:
+            self._db.execute("UPDATE answers SET used_at = ? WHERE ctx = ? AND query = ?", [time.time(), ctx, text])
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def cached_answer(cache: AnswerCache, retriever, question: str, stream: bool = False):
+    """
+    Retrieve, then serve a cached answer ("source": "cache") or synthesize one live and
+    cache it once complete (as a dict, or an AnswerStream with stream=True).
+    """
+    from rag.answer import stream_answer
+    hits = retriever.search(question)
+    vec = retriever.embed_query(question)  # cached by the search above
+    ans = cache.get(question, vec, retriever.digest, hits)
+    if ans is not None:
+        return {**ans, "source": "cache"}
+    def store(result):
+        if not result.get("partial"):
+            cache.put(question, vec, retriever.digest, hits, result)
+    s = stream_answer(question, hits, on_done=store)
+    if stream:
+        return s
+    for _ in s:
+        pass
+    return {**s.result, "source": "live"}
@@ -0,0 +1,64 @@
+"""
+Micro-batching for the shared retriever: concurrent callers (one per Streamlit session)
+hand their item to a single worker thread, which waits up to `window_s` for others to
+arrive and runs them through `fn` in one call. Each caller gets its own result back. If
+the call fails, the batch's items are retried one at a time, so an item that breaks `fn`
+fails only its own caller.
+"""
+import queue, threading, time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, fn, window_s: float = 0.003, max_batch: int = 64, name: str = "micro-batcher"):
+        self.fn, self.window_s, self.max_batch, self.name = fn, window_s, max_batch, name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "items": 0, "largest": 0, "split": 0}
+
+    def submit(self, item):
+        """fn([item, ...])[i] for this caller's item; blocks until its batch has run."""
+        fut = Future()
+        self._queue.put((item, fut))
+        self._start()
+        return fut.result()
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window_s
+            while len(batch) < self.max_batch:
+                try:  # whatever queued up during the last batch, then the window
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+            except BaseException as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self.stats["split"] += 1
+                    for item, fut in batch:
+                        self._run_one(item, fut)
+            else:
+                for (_, fut), res in zip(batch, results):
+                    fut.set_result(res)
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+            self.stats["largest"] = max(self.stats["largest"], len(batch))
+
+    def _run_one(self, item, fut):
+        try:
+            fut.set_result(self.fn([item])[0])
+        except BaseException as e:
+            fut.set_exception(e)
@@ -0,0 +1,110 @@
+"""
+Sparse BM25 index over the rule chunks, for exact policy terms (EHG, PHG, MSR, COV, HFE)
+that MiniLM embeddings blur together.
+
+Stored as rules.bm25.npz next to the embeddings: the sorted vocabulary, CSR postings
+(term -> chunk ids) and one precomputed BM25 weight per posting, so scoring a query is
+a few array slices and adds, with nothing to rebuild at startup. On disk the vocabulary
+is one UTF-8 blob plus term offsets (a fixed-width numpy str array pads every term to
+the longest, 4 bytes per char); in memory it is an object array of str.
+"""
+import re, pathlib
+from array import array
+import numpy as np
+
+BM25_FILE = "rules.bm25.npz"
+K1, B = 1.2, 0.75
+RRF_K = 60  # reciprocal-rank fusion constant (Cormack et al.)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i if in is it its my "
+    "of on or our that the their this to was we what when which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def chunk_text(c: dict) -> str:
+    return f"{c.get('title', '')}\n{c.get('text', '')}"
+
+
+def build_bm25(chunks) -> dict:
+    """{"terms" [V] sorted str, "offsets" [V+1] int32, "docs" [P] int32, "weights" [P] float32}."""
+    # typed arrays, not (doc, tf) tuples: 8 bytes per posting however large the corpus
+    ids, tfs = {}, {}
+    lengths = array("i")
+    for i, c in enumerate(chunks):
+        toks = tokenize(chunk_text(c))
+        lengths.append(len(toks))
+        tf = {}
+        for t in toks:
+            tf[t] = tf.get(t, 0) + 1
+        for t, n in tf.items():
+            if t not in ids:
+                ids[t], tfs[t] = array("i"), array("f")
+            ids[t].append(i)
+            tfs[t].append(n)
+    n_docs = len(lengths)
+    dl = np.frombuffer(lengths, dtype="int32").astype("float32")
+    avgdl = float(dl.mean()) if n_docs else 1.0
+    terms = sorted(ids)
+    offsets, docs, weights = [0], [], []
+    for t in terms:
+        d = np.frombuffer(ids.pop(t), dtype="int32")
+        tf = np.frombuffer(tfs.pop(t), dtype="float32")
+        idf = np.log(1 + (n_docs - len(d) + 0.5) / (len(d) + 0.5))
+        weights.append(idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl[d] / max(avgdl, 1e-9))))
+        docs.append(d)
+        offsets.append(offsets[-1] + len(d))
+    return {
+        "terms": np.array(terms, dtype=object),
+        "offsets": np.array(offsets, dtype="int32"),
+        "docs": np.concatenate(docs) if docs else np.zeros(0, dtype="int32"),
+        "weights": (np.concatenate(weights) if weights else np.zeros(0)).astype("float32"),
+        "n_docs": np.array(n_docs),
+    }
+
+
+def save_bm25(path: pathlib.Path, bm: dict):
+    words = [t.encode("utf-8") for t in bm["terms"]]
+    ends = np.cumsum([len(w) for w in words], dtype="int64")
+    np.savez(path.as_posix(),
+             vocab=np.frombuffer(b"".join(words), dtype="uint8"),
+             vocab_offsets=np.concatenate([[0], ends]).astype("int32"),
+             **{k: v for k, v in bm.items() if k != "terms"})
+
+
+def load_bm25(path: pathlib.Path) -> dict:
+    with np.load(path.as_posix()) as z:
+        bm = {k: z[k] for k in z.files}
+    if "vocab" in bm:
+        blob, ends = bm.pop("vocab").tobytes(), bm.pop("vocab_offsets")
+        terms = [blob[a:b].decode("utf-8") for a, b in zip(ends[:-1], ends[1:])]
+    else:  # written before the blob layout: fixed-width str array
+        terms = bm.pop("terms").tolist()
+    bm["terms"] = np.array(terms, dtype=object)
+    return bm
+
+
+def bm25_scores(bm: dict, query: str) -> np.ndarray:
+    """BM25 score of every chunk for `query` ([N], zero where no term matches)."""
+    terms, offsets = bm["terms"], bm["offsets"]
+    scores = np.zeros(int(bm["n_docs"]), dtype="float32")
+    for t in set(tokenize(query)):
+        j = int(np.searchsorted(terms, t))
+        if j < len(terms) and terms[j] == t:
+            lo, hi = offsets[j], offsets[j + 1]
+            scores[bm["docs"][lo:hi]] += bm["weights"][lo:hi]  # ids are unique per term
+    return scores
+
+
+def rrf(rankings, k: int = RRF_K) -> dict:
+    """Reciprocal-rank fusion of several best-first id lists -> {id: fused score}."""
+    fused = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking):
+            fused[int(i)] = fused.get(int(i), 0.0) + 1.0 / (k + rank + 1)
+    return fused
@@ -0,0 +1,136 @@
+"""
+Token-budgeted prompt context for answer synthesis (rag/answer.py).
+
+Retrieved chunks are up to 800 words each and neighbouring chunks of a page share 80
+words of overlap, so top_k hits pasted whole make a large, repetitive prompt. pack_context():
+
+1. splits each hit into sentences and drops those already present for the same URL
+   (overlap between chunks, repeated boilerplate);
+2. scores the rest by the query terms they contain (idf over the candidate sentences);
+3. keeps the best-scoring sentences that fit within `budget` tokens, filling what is
+   left in rank order, and prints the kept ones back in their hits' original order.
+
+Hits keep their numbers ([1], [2] ... as in the citations) even if one is dropped.
+Tokens are counted with tiktoken for ANSWER_MODEL; when its encoding can't be loaded
+(the BPE file is downloaded on first use) a word/punctuation estimate stands in.
+"""
+import os, re, math, threading
+from rag.bm25 import tokenize
+
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "1800"))  # budget for the numbered sources
+GAP = " … "  # between kept sentences that weren't adjacent
+MIN_FRAGMENT = 30  # chars; shorter sentences are only dropped when repeated exactly
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[$0-9A-Z])")
+_ROUGH = re.compile(r"\w+|[^\w\s]")
+
+_enc = None
+_enc_lock = threading.Lock()
+
+
+def _encoding():
+    global _enc
+    with _enc_lock:
+        if _enc is None:
+            from rag.answer import ANSWER_MODEL
+            try:
+                import tiktoken
+                _enc = tiktoken.encoding_for_model(ANSWER_MODEL)
+            except Exception:  # offline and not cached yet: estimate instead
+                _enc = False
+        return _enc
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc:
+        return len(enc.encode_ordinary(text))
+    # roughly one token per word or punctuation mark (o200k splits long words a little more)
+    return len(_ROUGH.findall(text))
+
+
+def tokenizer_name() -> str:
+    enc = _encoding()
+    return enc.name if enc else "estimate"
+
+
+def _norm(s: str) -> str:
+    return " ".join(s.lower().split())
+
+
+def sentences(text: str) -> list:
+    """[(sentence, starts a line)] of a chunk's text."""
+    out = []
+    for line in text.splitlines():
+        parts = [s for s in _SENTENCE.split(line.strip()) if s]
+        out.extend((s, n == 0) for n, s in enumerate(parts))
+    return out
+
+
+def _header(i: int, h) -> str:
+    return f"[{i}] {h['title']} | {h['url']}\n"
+
+
+def pack_context(query: str, hits, budget: int = None):
+    """
+    (context, stats): the numbered sources for build_prompt(), at most `budget` tokens.
+    stats: context_tokens, budget, hits_used, sentences, dropped_duplicate, dropped_budget.
+    """
+    budget = CONTEXT_TOKENS if budget is None else budget
+    # candidates: (hit number, position, text, starts a line); per URL, the longest first so a full
+    # sentence wins over the fragment of it an overlapping chunk starts with
+    cands, by_url = [], {}
+    for i, h in enumerate(hits, 1):
+        for j, (s, nl) in enumerate(sentences(h["text"])):
+            cands.append((i, j, s, nl))
+            by_url.setdefault(h["url"], []).append(len(cands) - 1)
+    dup = set()
+    for idx in by_url.values():
+        kept, seen = "", set()
+        for k in sorted(idx, key=lambda k: -len(cands[k][2])):
+            n = _norm(cands[k][2])
+            # short lines (table cells, "Yes.") only as exact repeats, not inside longer text
+            if n in seen or (len(n) >= MIN_FRAGMENT and n in kept):
+                dup.add(k)
+            else:
+                kept += n + "\n"
+                seen.add(n)
+    live = [k for k in range(len(cands)) if k not in dup]
+
+    # query-term relevance, rarer terms weighing more
+    q = set(tokenize(query))
+    terms = {k: q.intersection(tokenize(cands[k][2])) for k in live}
+    df = {}
+    for ts in terms.values():
+        for t in ts:
+            df[t] = df.get(t, 0) + 1
+    score = {k: sum(math.log(1 + len(live) / df[t]) for t in terms[k]) for k in live}
+
+    chosen, used, headers = set(), 0, set()
+    order = sorted((k for k in live if score[k] > 0), key=lambda k: (-score[k], cands[k][0], cands[k][1]))
+    order += [k for k in live if score[k] <= 0]  # then fill in rank order
+    for k in order:
+        i = cands[k][0]
+        cost = count_tokens(cands[k][2]) + 2  # and a separator
+        if i not in headers:
+            cost += count_tokens(_header(i, hits[i - 1]))
+        if used + cost > budget:
+            continue
+        chosen.add(k)
+        headers.add(i)
+        used += cost
+
+    context, prev = "", None
+    for k in sorted(chosen, key=lambda k: cands[k][:2]):
+        i, j, s, nl = cands[k]
+        if prev is None or prev[0] != i:
+            context += ("\n\n" if prev else "") + _header(i, hits[i - 1]) + s
+        elif j != prev[1] + 1:
+            context += GAP + s
+        else:
+            context += ("\n" if nl else " ") + s
+        prev = (i, j)
+    stats = {"context_tokens": count_tokens(context), "budget": budget, "hits_used": len(headers),
+             "sentences": len(chosen), "dropped_duplicate": len(dup),
+             "dropped_budget": len(live) - len(chosen)}
+    return context, stats
@@ -0,0 +1,77 @@
+import os, math, platform
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+
+EMB_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# "torch" (default), "onnx" (ONNX Runtime, fp32) or "onnx-int8" (dynamically quantised)
+# The ONNX backends need `pip install "optimum[onnxruntime]"`; the exported files ship
+# in the model repo, so nothing has to be converted locally.
+BACKENDS = ("torch", "onnx", "onnx-int8")
+EMB_BACKEND = os.getenv("EMB_BACKEND", "torch")
+
+
+def _int8_file() -> str:
+    # quantised exports published with all-MiniLM-L6-v2, per CPU family
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+
+def load_encoder(backend: str = None, model_name: str = EMB_MODEL):
+    """
+    SentenceTransformer on the chosen backend. All of them expose the same
+    .encode(texts, normalize_embeddings=True) and produce interchangeable vectors
+    (cosine >= 0.99 vs torch), so an index built with one can be queried with another.
+    """
+    backend = backend or EMB_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {BACKENDS}")
+    from sentence_transformers import SentenceTransformer  # heavy import, keep it lazy
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    kwargs = {"file_name": _int8_file()} if backend == "onnx-int8" else {"file_name": "onnx/model.onnx"}
+    return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=kwargs)
+
+
+_worker_model = None
+
+def _worker_init(factory, args, threads):
+    global _worker_model
+    # split the cores between workers instead of every worker's torch grabbing all of them
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = factory(*args)
+
+def _worker_encode(texts):
+    return np.asarray(_worker_model.encode(texts, normalize_embeddings=True), dtype="float32")
+
+
+class EncoderPool:
+    """
+    Same .encode() as a single encoder, spread over `procs` processes that each load
+    their own copy of the model (factory(*args), load_encoder by default) once.
+    For index builds: queries are one text at a time and stay in-process.
+    """
+    def __init__(self, procs: int, factory=load_encoder, args=(), chunk_size: int = 64):
+        self.procs, self.chunk_size = procs, chunk_size
+        threads = max(1, (os.cpu_count() or 1) // procs)
+        self._pool = ProcessPoolExecutor(procs, mp_context=get_context("spawn"),
+                                         initializer=_worker_init, initargs=(factory, args, threads))
+
+    def encode(self, texts, normalize_embeddings=True, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        # chunk_size-sized pieces keep every worker busy; map() returns them in order
+        step = min(self.chunk_size, math.ceil(len(texts) / self.procs))
+        parts = [texts[i:i + step] for i in range(0, len(texts), step)]
+        return np.concatenate(list(self._pool.map(_worker_encode, parts)))
+
+    def close(self):
+        self._pool.shutdown()
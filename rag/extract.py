@@ -0,0 +1,118 @@
+"""
+Page text extraction and chunking for the rule index (used by rag/index_rules.py).
+
+Kept apart from the crawler so extraction workers (a process pool: trafilatura and
+readability are CPU-bound and hold the GIL) only import what they need.
+"""
+import time, hashlib
+from datetime import datetime, timezone
+import trafilatura
+from bs4 import BeautifulSoup
+from readability import Document
+
+HEADING_MAX_CHARS = 81  # a capitalised line this short ...
+HEADING_MAX_WORDS = 12  # ... with this few words starts a new chunk
+
+
+def extract_text(html: str, url: str) -> str:
+    """
+    Clean text from downloaded HTML: trafilatura.extract, then a readability fallback.
+    May be an empty string if both fail.
+    """
+    # 1) trafilatura on the page
+    try:
+        txt = trafilatura.extract(
+            html, include_comments=False, include_tables=True, favor_recall=True, url=url
+        )
+        if txt and txt.strip():
+            return txt
+    except Exception:
+        pass
+
+    # 2) Final fallback: readability -> cleaned HTML -> plain text via BS4
+    try:
+        doc = Document(html)
+        summary_html = doc.summary(html_partial=True)
+        soup = BeautifulSoup(summary_html, "html5lib")
+        # Keep headings, paragraphs, list items, and table text
+        parts = []
+        for el in soup.find_all(["h1","h2","h3","h4","p","li","th","td","caption"]):
+            text = el.get_text(" ", strip=True)
+            if text:
+                parts.append(text)
+        return "\n".join(parts)
+    except Exception:
+        return ""
+
+
+def extract_timed(html: str, url: str):
+    """(text, seconds): what the extraction pool runs per page."""
+    t0 = time.perf_counter()
+    return extract_text(html, url), time.perf_counter() - t0
+
+
+def chunk_id(url: str, text: str, seen: dict) -> str:
+    """
+    Content-addressed: the same text from the same page keeps its id when sections
+    above it are added or removed. Repeats of a text within a page get a counter.
+    """
+    key = f"{url}\n{text}"
+    n = seen.get(key, 0)
+    seen[key] = n + 1
+    return hashlib.blake2b(f"{key}\n{n}".encode("utf-8") if n else key.encode("utf-8"),
+                           digest_size=16).hexdigest()
+
+
+def _tail(words: list, k: int) -> list:
+    # last k words across the buffered lines, walking back only as far as needed
+    parts = []
+    for w in reversed(words):
+        if k <= 0:
+            break
+        parts.append(w[-k:] if k < len(w) else w)
+        k -= len(w)
+    return [x for p in reversed(parts) for x in p]
+
+
+def split_text(text: str, max_tokens=800, overlap=80) -> list:
+    """
+    Split on heading-like lines, and at max_tokens words with the last `overlap` words
+    carried into the next chunk. Each line is split into words once, so the cost is
+    linear in the page size.
+    """
+    chunks = []
+    buf, words, tokens = [], [], 0  # lines of the current chunk, their words, word count
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        w = line.split()
+        n = max(1, len(w))
+        # heading (short, starts with a capital): flush the current chunk
+        if buf and n <= HEADING_MAX_WORDS and len(line) <= HEADING_MAX_CHARS and "A" <= line[0] <= "Z":
+            chunks.append("\n".join(buf))
+            buf, words, tokens = [], [], 0
+        if tokens + n > max_tokens and buf:
+            chunks.append("\n".join(buf))
+            keep = _tail(words, overlap)
+            if keep:
+                buf, words = [" ".join(keep), line], [keep, w]
+                tokens = len(keep) + n
+            else:
+                buf, words, tokens = [line], [w], n
+        else:
+            buf.append(line)
+            words.append(w)
+            tokens += n
+    if buf:
+        chunks.append("\n".join(buf))
+    return chunks
+
+
+def split_into_chunks(text: str, title: str, url: str, max_tokens=800, overlap=80, retrieved_at=None):
+    """split_text() with the chunk metadata the index stores."""
+    retrieved_at = retrieved_at or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    seen = {}
+    return [{"doc_id": chunk_id(url, c, seen), "title": title, "url": url,
+             "retrieved_at": retrieved_at, "text": c}
+            for c in split_text(text, max_tokens, overlap)]
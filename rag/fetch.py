@@ -0,0 +1,150 @@
+"""
+Single fetch layer for the rule crawler: every page goes through one snapshot store.
+
+data/snapshots.sqlite keeps the last response per URL (status, final URL, fetch time)
+with the HTML stored once per content hash. Modes (FETCH_MODE or Fetcher(mode=...)):
+
+    cache     use a snapshot younger than max_age_s, else download and store (default)
+    refresh   always download; fall back to the snapshot if the site is down
+    offline   replay from the snapshot only, never touch the network
+
+A rebuild in offline mode sees byte-identical pages, so it is deterministic and can be
+benchmarked without network. Per-URL timings land in Fetcher.timings.
+"""
+import os, time, zlib, sqlite3, hashlib, pathlib, threading
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+import requests
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+SNAPSHOT_DB = pathlib.Path("data/snapshots.sqlite")
+MODES = ("cache", "refresh", "offline")
+FETCH_MODE = os.getenv("FETCH_MODE", "cache")
+MAX_AGE_S = 60 * 60 * 6  # same 6h the old requests_cache used
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                  "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+}
+
+
+class FetchError(Exception): pass
+
+
+def content_hash(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+@retry(
+    reraise=True,
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=0.7, min=1, max=6),
+    retry=retry_if_exception_type(FetchError),
+)
+def _download(session, url: str):
+    try:
+        resp = session.get(url, timeout=20, allow_redirects=True)
+    except requests.RequestException as e:
+        raise FetchError(str(e))
+    if resp.status_code >= 400 or not resp.text.strip():
+        raise FetchError(f"HTTP {resp.status_code}")
+    return resp.status_code, resp.url, resp.text
+
+
+class Fetcher:
+    def __init__(self, path=None, mode=None, max_age_s=MAX_AGE_S, session=None):
+        self.path = pathlib.Path(path or SNAPSHOT_DB)
+        self.mode = mode or FETCH_MODE
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown fetch mode {self.mode!r}; expected one of {MODES}")
+        self.max_age_s = max_age_s
+        self._session = session  # one given by the caller is used by every thread
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self.timings = {}  # url -> {"source", "fetch_s", "bytes", ...}
+
+    @property
+    def session(self):
+        # requests.Session isn't thread-safe: each fetch_all() worker gets its own
+        if self._session is not None:
+            return self._session
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = requests.Session()
+            s.headers.update(HEADERS)
+        return s
+
+    @contextmanager
+    def _con(self):
+        # one transaction, then closed (`with sqlite3.connect()` alone only commits);
+        # the tables are created once, or again if the file was deleted meanwhile
+        new = not self._schema_ready or not self.path.exists()
+        if new:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(self.path.as_posix(), timeout=30)) as con, con:
+            if new:
+                con.executescript("""
+                    CREATE TABLE IF NOT EXISTS pages (
+                      url TEXT PRIMARY KEY, final_url TEXT, status INTEGER, sha TEXT, fetched_at REAL
+                    );
+                    CREATE TABLE IF NOT EXISTS bodies (sha TEXT PRIMARY KEY, body BLOB);
+                """)
+                self._schema_ready = True
+            yield con
+
+    def lookup(self, url: str):
+        """(html, fetched_at) of the stored snapshot, or None."""
+        if not self.path.exists():
+            return None
+        with self._con() as con:
+            row = con.execute(
+                "SELECT b.body, p.fetched_at FROM pages p JOIN bodies b USING (sha) WHERE p.url = ?", [url]
+            ).fetchone()
+        return None if row is None else (zlib.decompress(row[0]).decode("utf-8"), row[1])
+
+    def put(self, url: str, html: str, status: int = 200, final_url: str = None, fetched_at: float = None):
+        body = html.encode("utf-8")
+        sha = content_hash(body)
+        with self._con() as con:
+            con.execute("INSERT OR IGNORE INTO bodies VALUES (?, ?)", [sha, zlib.compress(body)])
+            con.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                        [url, final_url or url, status, sha, time.time() if fetched_at is None else fetched_at])
+        return sha
+
+    def fetched_on(self, url: str):
+        """UTC date of the snapshot served for `url` ("YYYY-MM-DD"), or None."""
+        t = self.timings.get(url, {}).get("fetched_at")
+        return None if t is None else datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%d")
+
+    def record(self, url, **kw):
+        with self._lock:
+            self.timings.setdefault(url, {}).update(kw)
+
+    def get(self, url: str) -> str:
+        """HTML for `url` per the mode; raises FetchError when there is none."""
+        t0 = time.perf_counter()
+        snap = self.lookup(url)
+        fresh = snap is not None and time.time() - snap[1] < self.max_age_s
+        if snap is not None and (self.mode == "offline" or (self.mode == "cache" and fresh)):
+            self.record(url, source="snapshot", fetch_s=time.perf_counter() - t0,
+                        bytes=len(snap[0]), fetched_at=snap[1])
+            return snap[0]
+        if self.mode == "offline":
+            self.record(url, source="miss", fetch_s=time.perf_counter() - t0, bytes=0)
+            raise FetchError(f"{url} is not in the snapshot {self.path}")
+        try:
+            status, final_url, html = _download(self.session, url)
+        except FetchError:
+            if snap is None:
+                self.record(url, source="error", fetch_s=time.perf_counter() - t0, bytes=0)
+                raise
+            # site down: a stale snapshot beats dropping the page
+            self.record(url, source="stale", fetch_s=time.perf_counter() - t0,
+                        bytes=len(snap[0]), fetched_at=snap[1])
+            return snap[0]
+        now = time.time()
+        sha = self.put(url, html, status, final_url, now)
+        self.record(url, source="network", fetch_s=time.perf_counter() - t0, bytes=len(html),
+                    fetched_at=now, sha=sha[:16])
+        return html
@@ -1,13 +1,16 @@
-import os, re, json, hashlib, pathlib, yaml
-from datetime import datetime
+import os, sys, json, time, hashlib, pathlib, argparse, threading, yaml
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
 from urllib.parse import urlparse
-import trafilatura
-from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer
 import numpy as np
-import requests, requests_cache
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from readability import Document
+
+# Allow `python rag/index_rules.py` from the repo root to import rag/
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from rag.embed import EMB_MODEL, EncoderPool, load_encoder
+from rag.extract import extract_text, extract_timed, split_into_chunks
+from rag.fetch import MODES, FetchError, Fetcher
+from rag.index_store import IndexWriter, open_index
 
 
 BASE = pathlib.Path(".")
@@ -17,142 +20,246 @@ IDX_DIR  = RAG_DIR / "index_rules"
 IDX_DIR.mkdir(parents=True, exist_ok=True)
 
 SOURCES_YAML = RAG_DIR / "sources.yaml"
-EMB_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
-
-requests_cache.install_cache("data/http_cache", expire_after=60*60*6)  # 6h cache
-SESSION = requests.Session()
-SESSION.headers.update({
-    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                  "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-})
-
-class FetchError(Exception): pass
-
-@retry(
-    reraise=True,
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=0.7, min=1, max=6),
-    retry=retry_if_exception_type(FetchError),
-)
-def _get_html(url: str) -> str:
-    try:
-        resp = SESSION.get(url, timeout=20, allow_redirects=True)
-    except requests.RequestException as e:
-        raise FetchError(str(e))
-    if resp.status_code >= 400 or not resp.text.strip():
-        raise FetchError(f"HTTP {resp.status_code}")
-    return resp.text
-
-def fetch_clean(url: str) -> str:
-    """
-    Resilient fetch: requests → trafilatura.extract → readability fallback.
-    Returns cleaned text; may be empty string if everything fails.
-    """
-    # 1) Try trafilatura.fetch_url first (works on many sites)
-    try:
-        raw = trafilatura.fetch_url(url)
-        if raw:
-            txt = trafilatura.extract(
-                raw, include_comments=False, include_tables=True, favor_recall=True, url=url
-            )
-            if txt and txt.strip():
-                return txt
-    except Exception:
-        pass
-
-    # 2) Robust GET with browser-like headers
+
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+HOST_LIMIT = int(os.getenv("FETCH_HOST_LIMIT", "4"))  # concurrent requests per host, to stay polite
+EMB_BATCH = int(os.getenv("EMB_BATCH", "256"))  # chunks embedded + written (and checkpointed) at a time
+EMB_PROCS = int(os.getenv("EMB_PROCS", "1"))  # >1: embed on an EncoderPool of that many processes
+# HTML -> text runs on a process pool of this many workers (0: one per core), but only
+# for builds of EXTRACT_MIN_PAGES+ pages; below that starting the workers costs more
+EXTRACT_PROCS = int(os.getenv("EXTRACT_PROCS", "0"))
+EXTRACT_MIN_PAGES = 16
+
+
+def fetch_clean(url: str, fetcher: Fetcher = None) -> str:
+    """Page through the snapshot store (rag/fetch.py), then extract_text(); "" on failure."""
+    fetcher = fetcher or Fetcher()
     try:
-        html = _get_html(url)
+        html = fetcher.get(url)
     except FetchError:
         return ""
+    t0 = time.perf_counter()
+    txt = extract_text(html, url)
+    fetcher.record(url, extract_s=time.perf_counter() - t0)
+    return txt
 
-    # 3) Try trafilatura on downloaded HTML
-    try:
-        txt = trafilatura.extract(
-            html, include_comments=False, include_tables=True, favor_recall=True, url=url
-        )
-        if txt and txt.strip():
-            return txt
-    except Exception:
-        pass
-
-    # 4) Final fallback: readability -> cleaned HTML -> plain text via BS4
-    try:
-        doc = Document(html)
-        summary_html = doc.summary(html_partial=True)
-        soup = BeautifulSoup(summary_html, "html5lib")
-        # Keep headings, paragraphs, list items, and table text
-        parts = []
-        for el in soup.find_all(["h1","h2","h3","h4","p","li","th","td","caption"]):
-            text = el.get_text(" ", strip=True)
-            if text:
-                parts.append(text)
-        return "\n".join(parts)
-    except Exception:
-        return ""
 
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+def _host_slot(url: str):
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        return _host_slots.setdefault(host, threading.BoundedSemaphore(HOST_LIMIT))
+
+def fetch_all(sources, fetch, workers=None):
+    """
+    Yield (source, text, seconds) for each source, in order. Pages are fetched on a
+    thread pool, at most HOST_LIMIT at a time per host (most sources are hdb.gov.sg),
+    and at most 2 x workers pages run ahead of the consumer.
+    """
+    workers = workers or FETCH_WORKERS
+    def one(s):
+        with _host_slot(s["url"]):
+            t0 = time.perf_counter()
+            return s, fetch(s["url"]), time.perf_counter() - t0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ahead = deque()
+        for s in sources:
+            ahead.append(pool.submit(one, s))
+            if len(ahead) >= 2 * workers:
+                yield ahead.popleft().result()
+        while ahead:
+            yield ahead.popleft().result()
 
-def split_into_chunks(text: str, title: str, url: str, max_tokens=800, overlap=80):
-    # crude split by headings / paragraphs
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
-    chunks = []
-    buf = []
-    tokens = 0
-    def tok_count(s): return max(1, len(s.split()))
-    for line in lines:
-        if re.match(r"^[A-Z].{0,80}$", line) and len(line.split()) <= 12:
-            # heading — flush current buffer
-            if buf:
-                chunks.append("\n".join(buf))
-                buf = []
-                tokens = 0
-        if tokens + tok_count(line) > max_tokens and buf:
-            chunks.append("\n".join(buf))
-            # overlap: keep last ~overlap tokens
-            keep = " ".join(" ".join(buf).split()[-overlap:])
-            buf = [keep, line]
-            tokens = tok_count(keep) + tok_count(line)
-        else:
-            buf.append(line)
-            tokens += tok_count(line)
-    if buf:
-        chunks.append("\n".join(buf))
-    # attach metadata
-    out = []
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def _previous(idx_dir: pathlib.Path, model: str):
+    """(embeddings, chunks, chunk ids by url, row by chunk-text hash) of the current index."""
+    try:
+        emb, chunks, header = open_index(idx_dir)
+    except (FileNotFoundError, ValueError):
+        return None, [], {}, {}
+    if header.get("model", model) != model:  # vectors from another model can't be reused
+        return None, [], {}, {}
+    by_url, by_text = {}, {}
     for i, c in enumerate(chunks):
-        out.append({
-            "doc_id": hashlib.md5((url+str(i)).encode()).hexdigest(),
-            "title": title,
-            "url": url,
-            "retrieved_at": datetime.utcnow().strftime("%Y-%m-%d"),
-            "text": c
-        })
-    return out
-
-def main():
-    sources = yaml.safe_load(SOURCES_YAML.read_text(encoding="utf-8"))
-    all_chunks = []
-    for s in sources:
+        by_url.setdefault(c["url"], []).append(i)
+        by_text.setdefault(_sha(c["text"]), i)
+    return emb, chunks, by_url, by_text
+
+def _timing(fetcher: Fetcher, url: str) -> str:
+    t = fetcher.timings.get(url, {})
+    return f"{t.get('source', '?')} {t.get('fetch_s', 0):.2f}s, extract {t.get('extract_s', 0):.2f}s"
+
+def page_texts(sources, fetcher, procs=None):
+    """
+    Yield (source, text) in order; text is "" when the page could not be fetched.
+    Pages download on threads (fetch_all); for large builds the CPU-bound HTML -> text
+    step runs on a process pool, since on the fetch threads it would hold the GIL.
+    """
+    sources = list(sources)
+    procs = procs or EXTRACT_PROCS or os.cpu_count() or 1
+    if procs <= 1 or len(sources) < EXTRACT_MIN_PAGES:
+        for s, txt, _ in fetch_all(sources, lambda u: fetch_clean(u, fetcher)):
+            yield s, txt
+        return
+
+    def get(url):
+        try:
+            return fetcher.get(url)
+        except FetchError:
+            return None
+    def result(s, fut):
+        if fut is None:
+            return s, ""
+        txt, secs = fut.result()
+        fetcher.record(s["url"], extract_s=secs)
+        return s, txt
+    with ProcessPoolExecutor(procs, mp_context=get_context("spawn")) as pool:
+        ahead = deque()
+        for s, html, _ in fetch_all(sources, get):
+            ahead.append((s, pool.submit(extract_timed, html, s["url"]) if html else None))
+            if len(ahead) >= 2 * procs:
+                yield result(*ahead.popleft())
+        while ahead:
+            yield result(*ahead.popleft())
+
+def source_chunks(sources, fetcher, prev_chunks, by_url, stats):
+    """
+    Yield (url, chunks) per source, in order. A page whose text hashes the same as last
+    build keeps its chunks; a page that fails to fetch keeps its previous chunks.
+    """
+    for s, txt in page_texts(sources, fetcher):
         t, u = s["title"], s["url"]
-        txt = fetch_clean(u)
+        old = [prev_chunks[i] for i in by_url.get(u, [])]
         if not txt:
-            print(f"[WARN] Could not fetch {u}")
+            stats["failed"] += 1
+            print(f"[WARN] Could not fetch {u}" + (f", keeping {len(old)} old chunks" if old else ""))
+            yield u, old
+            continue
+        h = _sha(txt)
+        if old and all(c.get("source_hash") == h and c["title"] == t for c in old):
+            stats["unchanged"] += 1
+            print(f"[SAME] {t} ({_timing(fetcher, u)})")
+            yield u, old
             continue
-        chunks = split_into_chunks(txt, t, u)
-        all_chunks.extend(chunks)
-        print(f"[OK] {t} -> {len(chunks)} chunks")
-
-    # embed
-    model = SentenceTransformer(EMB_MODEL)
-    embeddings = model.encode([c["text"] for c in all_chunks], show_progress_bar=True, normalize_embeddings=True)
-    embeddings = embeddings.astype("float32")
-    # Save artifacts
-    np.save((IDX_DIR / "rules.npy").as_posix(), embeddings)
-    (IDX_DIR / "rules.json").write_text(
-        json.dumps(all_chunks, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
-    print(f"[DONE] {len(all_chunks)} chunks indexed (NumPy).")
+        # the snapshot's date, so an offline replay rebuilds byte-identical chunks
+        chunks = split_into_chunks(txt, t, u, retrieved_at=fetcher.fetched_on(u))
+        for c in chunks:
+            c["source_hash"] = h  # hash of the page text the chunk came from
+        stats["changed"] += 1
+        print(f"[OK] {t} -> {len(chunks)} chunks ({_timing(fetcher, u)})")
+        yield u, chunks
+
+def build_index(sources, idx_dir=IDX_DIR, encoder=None, full=False, fetcher=None,
+                batch_size=None, procs=None, resume=False):
+    """
+    Streaming build: fetch -> extract -> chunk -> embed in batches -> append to an
+    IndexWriter (rag/index_store.py), so memory is one batch, not the whole corpus.
+
+    Incremental unless `full`: unchanged pages keep their chunks and any chunk whose
+    text is already in the index keeps its embedding, so only new or edited chunks are
+    encoded. The build checkpoints after every batch; resume=True skips the sources an
+    interrupted build already wrote. procs > 1 encodes on an EncoderPool.
+    fetcher: rag.fetch.Fetcher (snapshot store + mode); its .timings has per-URL timings.
+    Returns (header, stats).
+    """
+    fetcher = fetcher or Fetcher()
+    batch_size = batch_size or EMB_BATCH
+    procs = procs or EMB_PROCS
+    prev_emb, prev_chunks, by_url, by_text = (None, [], {}, {}) if full else _previous(idx_dir, EMB_MODEL)
+    stats = {"unchanged": 0, "changed": 0, "failed": 0, "embedded": 0, "reused": 0}
+    writer = IndexWriter(idx_dir, EMB_MODEL, float16=os.getenv("INDEX_FLOAT16") == "1", resume=resume)
+    done = list(writer.state.get("done", []))
+    if done:
+        print(f"[RESUME] {len(done)} sources / {writer.count} chunks already written")
+    todo_sources = [s for s in sources if s["url"] not in set(done)]
+    # stays True while every chunk written matches the current index, in order
+    same = not done and len(todo_sources) == len(sources)
+    model = encoder
+    pending, pending_urls = [], []
+
+    def flush():
+        nonlocal model, same
+        rows = [by_text.get(_sha(c["text"])) for c in pending]
+        new = [i for i, r in enumerate(rows) if r is None]
+        vecs = None
+        if new:
+            if model is None:
+                # EMB_BACKEND=onnx / onnx-int8 for a faster CPU build
+                model = EncoderPool(procs, load_encoder, (None,)) if procs > 1 else load_encoder()
+            fresh = np.asarray(model.encode([pending[i]["text"] for i in new], normalize_embeddings=True),
+                               dtype="float32")
+            vecs = np.empty((len(pending), fresh.shape[1]), dtype="float32")
+            vecs[new] = fresh
+        kept = [i for i, r in enumerate(rows) if r is not None]
+        if kept:
+            old = np.asarray(prev_emb[[rows[i] for i in kept]], dtype="float32")
+            if vecs is None:
+                vecs = np.empty((len(pending), old.shape[1]), dtype="float32")
+            vecs[kept] = old
+        start = writer.count
+        if same:
+            same = all(start + j < len(prev_chunks) and prev_chunks[start + j] == c
+                       for j, c in enumerate(pending))
+        if pending:
+            writer.add(pending, vecs)
+        done.extend(pending_urls)
+        writer.checkpoint(done=done)
+        stats["embedded"] += len(new)
+        stats["reused"] += len(kept)
+        print(f"[EMB] {writer.count} chunks written ({len(new)} embedded, {len(kept)} reused)")
+        pending.clear()
+        pending_urls.clear()
+
+    try:
+        # flush on source boundaries, so a checkpoint never holds half a page
+        for u, chunks in source_chunks(todo_sources, fetcher, prev_chunks, by_url, stats):
+            pending.extend(chunks)
+            pending_urls.append(u)
+            if len(pending) >= batch_size:
+                flush()
+        if pending or pending_urls:
+            flush()
+        if writer.count == 0:
+            writer.abort()
+            raise RuntimeError("No sources could be fetched; index left as it was.")
+        if same and writer.count == len(prev_chunks):
+            writer.abort()
+            print("[DONE] No changes; index left as it was.")
+            return open_index(idx_dir)[2], stats
+        header = writer.finish()
+    finally:
+        if isinstance(model, EncoderPool):
+            model.close()
+    (idx_dir / "rules.json").unlink(missing_ok=True)  # legacy layout
+    return header, stats
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Crawl rag/sources.yaml and (re)build the rule index.")
+    ap.add_argument("--full", action="store_true", help="re-chunk and re-embed everything")
+    ap.add_argument("--mode", choices=MODES, help="snapshot mode (default FETCH_MODE or cache)")
+    ap.add_argument("--offline", dest="mode", action="store_const", const="offline",
+                    help="replay pages from data/snapshots.sqlite, no network")
+    ap.add_argument("--timings", type=pathlib.Path, help="write per-URL timings as JSON")
+    ap.add_argument("--batch-size", type=int, default=EMB_BATCH, help="chunks per embed/write batch")
+    ap.add_argument("--procs", type=int, default=EMB_PROCS, help="embedding processes")
+    ap.add_argument("--resume", action="store_true", help="continue an interrupted build from its checkpoint")
+    args = ap.parse_args(argv)
+    sources = yaml.safe_load(SOURCES_YAML.read_text(encoding="utf-8"))
+    fetcher = Fetcher(mode=args.mode)
+    t0 = time.perf_counter()
+    header, stats = build_index(sources, full=args.full, fetcher=fetcher, batch_size=args.batch_size,
+                                procs=args.procs, resume=args.resume)
+    if args.timings:
+        args.timings.write_text(json.dumps(fetcher.timings, indent=2), encoding="utf-8")
+    print(f"[DONE] {header['count']} chunks indexed ({header['dtype']}, digest {header['digest']}) "
+          f"in {time.perf_counter() - t0:.1f}s: {stats['changed']} pages changed, "
+          f"{stats['unchanged']} unchanged, {stats['failed']} failed; "
+          f"{stats['embedded']} chunks embedded, {stats['reused']} reused.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,240 @@
+"""
+On-disk format of the rule index (rag/index_rules/):
+
+    index.json          header: format version, count, dim, dtype, model, content digest, ann
+    rules.npy           [N, D] normalised embeddings (float32, or float16 to halve it)
+    rules.chunks.jsonl  one compact JSON chunk per line
+    rules.offsets.npy   int64 byte offset of each line (N + 1 entries)
+    rules.ivf.npz       optional IVF clustering for approximate search (rag/ann.py)
+    rules.bm25.npz      BM25 postings for hybrid (sparse + dense) retrieval (rag/bm25.py)
+
+Embeddings are memory-mapped and a chunk is only parsed when it is a hit, so opening
+the index costs the same for 100 or 100k chunks. Indexes from before the header (a
+pretty-printed rules.json next to rules.npy) are still read, fully, as before.
+
+    python rag/index_store.py [--float16]   # convert a legacy index in place
+"""
+import os, sys, json, mmap, shutil, hashlib, pathlib, argparse
+from datetime import datetime, timezone
+import numpy as np
+
+# Allow `python rag/index_store.py` from the repo root to import rag/
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from rag.ann import ANN_FILE, ANN_MIN_CHUNKS, build_ivf
+from rag.bm25 import BM25_FILE, build_bm25, save_bm25
+
+FORMAT = "sg-hdb-rules"
+FORMAT_VERSION = 2
+HEADER, EMB, CHUNKS, OFFSETS, LEGACY_CHUNKS = (
+    "index.json", "rules.npy", "rules.chunks.jsonl", "rules.offsets.npy", "rules.json")
+# in-progress build (IndexWriter): raw appends + resume state, moved into place by finish()
+BUILD_DIR, CHECKPOINT, EMB_RAW, OFFSETS_RAW = ".build", "checkpoint.json", "rules.npy.part", "rules.offsets.part"
+
+
+class ChunkStore:
+    """Sequence of chunk dicts backed by the offset-indexed JSONL file."""
+    def __init__(self, idx_dir: pathlib.Path):
+        self.offsets = np.load((idx_dir / OFFSETS).as_posix(), mmap_mode="r")
+        self._f = (idx_dir / CHUNKS).open("rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) \
+            if self.offsets[-1] else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> dict:
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        return json.loads(self._mm[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def close(self):
+        if self._mm:
+            self._mm.close()
+        self._f.close()
+
+
+def _file_digest(h, path: pathlib.Path):
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+
+def read_header(idx_dir: pathlib.Path):
+    p = idx_dir / HEADER
+    if not p.exists():
+        return None
+    header = json.loads(p.read_text(encoding="utf-8"))
+    if header.get("format") != FORMAT or header.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported rule index in {idx_dir}: {header.get('format')} v{header.get('version')}")
+    return header
+
+
+def open_index(idx_dir: pathlib.Path):
+    """(embeddings [N, D] memmap or array, chunks sequence, header dict)."""
+    header = read_header(idx_dir)
+    if header is None:
+        # legacy: rules.json + rules.npy, everything in memory
+        emb = np.load((idx_dir / EMB).as_posix()).astype("float32")
+        chunks = json.loads((idx_dir / LEGACY_CHUNKS).read_text(encoding="utf-8"))
+        h = hashlib.sha256()
+        for name in (EMB, LEGACY_CHUNKS):
+            _file_digest(h, idx_dir / name)
+        return emb, chunks, {"version": 1, "count": len(chunks), "dim": emb.shape[1],
+                             "dtype": "float32", "digest": h.hexdigest()[:16]}
+    emb = np.load((idx_dir / EMB).as_posix(), mmap_mode="r")
+    return emb, ChunkStore(idx_dir), header
+
+
+def _replace(path: pathlib.Path, write):
+    # write beside, then rename: processes that still map the old file keep a valid copy
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _npy_from_raw(raw: pathlib.Path, path: pathlib.Path, dtype, shape):
+    # .npy header + the raw rows, copied in blocks: never holds the array in memory
+    with path.open("wb") as f, raw.open("rb") as src:
+        np.lib.format.write_array_header_1_0(
+            f, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape})
+        for block in iter(lambda: src.read(1 << 20), b""):
+            f.write(block)
+    raw.unlink()
+
+
+class IndexWriter:
+    """
+    Append-only build of the compact format in idx_dir/.build: add() batches of chunks
+    and their embeddings, checkpoint() after each, finish() swaps the files into idx_dir
+    (header last). resume=True continues from the last checkpoint of an interrupted build;
+    anything appended after it is cut off. Memory stays at one batch however big the index.
+    """
+    def __init__(self, idx_dir: pathlib.Path, model: str, float16: bool = False, resume: bool = False):
+        self.idx_dir = pathlib.Path(idx_dir)
+        self.build = self.idx_dir / BUILD_DIR
+        self.dtype = np.dtype("float16" if float16 else "float32")
+        state = self._load_checkpoint() if resume else None
+        if state is None or state["model"] != model or state["dtype"] != self.dtype.name:
+            shutil.rmtree(self.build, ignore_errors=True)
+            self.build.mkdir(parents=True)
+            (self.build / OFFSETS_RAW).write_bytes(np.zeros(1, dtype="int64").tobytes())
+            state = {"model": model, "dtype": self.dtype.name, "dim": None, "count": 0, "chunk_bytes": 0}
+        self.state = state
+        self.model, self.dim = model, state["dim"]
+        self.count, self.chunk_bytes = state["count"], state["chunk_bytes"]
+        itemsize = self.dtype.itemsize * (self.dim or 0)
+        self._files = {}
+        for name, size in ((CHUNKS, self.chunk_bytes), (EMB_RAW, self.count * itemsize),
+                           (OFFSETS_RAW, (self.count + 1) * 8)):
+            f = (self.build / name).open("ab")
+            f.truncate(size)
+            self._files[name] = f
+
+    def _load_checkpoint(self):
+        p = self.build / CHECKPOINT
+        return json.loads(p.read_text(encoding="utf-8")) if p.exists() else None
+
+    def add(self, chunks, embeddings):
+        emb = np.asarray(embeddings, dtype=self.dtype)
+        if len(chunks) != len(emb):
+            raise ValueError(f"{len(chunks)} chunks but {len(emb)} embeddings")
+        if not len(chunks):
+            return
+        if self.dim is None:
+            self.dim = int(emb.shape[1])
+        elif emb.shape[1] != self.dim:
+            raise ValueError(f"embedding dim {emb.shape[1]} != {self.dim}")
+        ends = []
+        for c in chunks:
+            line = json.dumps(c, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            self._files[CHUNKS].write(line)
+            self.chunk_bytes += len(line)
+            ends.append(self.chunk_bytes)
+        self._files[OFFSETS_RAW].write(np.array(ends, dtype="int64").tobytes())
+        self._files[EMB_RAW].write(np.ascontiguousarray(emb).tobytes())
+        self.count += len(chunks)
+
+    def checkpoint(self, **extra) -> dict:
+        """Make everything added so far durable; `extra` (e.g. sources done) is saved with it."""
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self.state = {**self.state, **extra, "dim": self.dim, "count": self.count, "chunk_bytes": self.chunk_bytes}
+        _replace(self.build / CHECKPOINT, lambda f: f.write(json.dumps(self.state).encode("utf-8")))
+        return self.state
+
+    def abort(self):
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self.build, ignore_errors=True)
+
+    def finish(self, ann: bool = None) -> dict:
+        """Build the side indexes, move the files into idx_dir and write the header."""
+        for f in self._files.values():
+            f.close()
+        b, n, dim = self.build, self.count, self.dim or 0
+        _npy_from_raw(b / EMB_RAW, b / EMB, self.dtype, (n, dim))
+        _npy_from_raw(b / OFFSETS_RAW, b / OFFSETS, "int64", (n + 1,))
+        h = hashlib.sha256()
+        for name in (EMB, CHUNKS):
+            _file_digest(h, b / name)
+        if ann is None:
+            ann = n >= ANN_MIN_CHUNKS
+        ann_meta = None
+        if ann and n:
+            ivf = build_ivf(np.load((b / EMB).as_posix(), mmap_mode="r"))
+            np.savez((b / ANN_FILE).as_posix(), **ivf)
+            ann_meta = {"type": "ivf", "file": ANN_FILE, "nlist": len(ivf["centroids"])}
+        store = ChunkStore(b)
+        bm = build_bm25(store)
+        store.close()
+        save_bm25(b / BM25_FILE, bm)
+        # same directory, so each rename is atomic: readers see old or new files, never partial
+        for name in (CHUNKS, OFFSETS, EMB, BM25_FILE) + ((ANN_FILE,) if ann_meta else ()):
+            os.replace(b / name, self.idx_dir / name)
+        if not ann_meta:
+            (self.idx_dir / ANN_FILE).unlink(missing_ok=True)
+        header = {
+            "format": FORMAT, "version": FORMAT_VERSION,
+            "count": n, "dim": dim,
+            "dtype": self.dtype.name, "model": self.model, "digest": h.hexdigest()[:16],
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "ann": ann_meta,
+            "bm25": {"file": BM25_FILE, "terms": len(bm["terms"])},
+        }
+        _replace(self.idx_dir / HEADER, lambda f: f.write(json.dumps(header, indent=2).encode("utf-8")))
+        shutil.rmtree(b, ignore_errors=True)
+        return header
+
+
+def write_index(idx_dir: pathlib.Path, chunks, embeddings, model: str, float16: bool = False,
+                ann: bool = None) -> dict:
+    """
+    Write chunks + embeddings in the compact format in one go (see IndexWriter).
+    ann: build the IVF index (rag/ann.py); default only from ANN_MIN_CHUNKS chunks on.
+    """
+    w = IndexWriter(idx_dir, model, float16=float16)
+    w.add(list(chunks), np.asarray(embeddings).reshape(len(embeddings), -1))
+    return w.finish(ann=ann)
+
+
+def main(argv=None):
+    from rag.embed import EMB_MODEL
+    from rag.retrieve import IDX_DIR
+    ap = argparse.ArgumentParser(description="Convert a legacy rules.json/rules.npy index to the compact format.")
+    ap.add_argument("idx_dir", nargs="?", type=pathlib.Path, default=IDX_DIR)
+    ap.add_argument("--float16", action="store_true", help="store embeddings as float16")
+    args = ap.parse_args(argv)
+    emb, chunks, _ = open_index(args.idx_dir)
+    header = write_index(args.idx_dir, list(chunks), np.array(emb), EMB_MODEL, float16=args.float16)
+    (args.idx_dir / LEGACY_CHUNKS).unlink(missing_ok=True)
+    print(f"[DONE] {header['count']} chunks, {header['dtype']}, digest {header['digest']}")
+
+
+if __name__ == "__main__":
+    main()
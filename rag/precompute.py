@@ -0,0 +1,188 @@
+"""
+Offline answers for the templated Grants and EIP/SPR questions.
+
+    python rag/precompute.py            # both spaces, for the current index + answer mode
+    python rag/precompute.py --only eip
+
+The Grants tab's inputs (first-timer x scheme x citizenship x flat type x 4km flag x
+income band) and the EIP/SPR tab's (ethnicity x profile x town, no block) are small and
+finite, so every question is built, retrieved and synthesized once and stored in
+rag/index_rules/answers.sqlite under (index digest, answer mode, question key). The key
+is the question itself, except that EIP/SPR questions are keyed on the upper-case town
+(eip_key()). At runtime answer_question() serves a stored answer or falls back to live
+retrieval + synthesis.
+"""
+import sys, json, math, pathlib, sqlite3, argparse, itertools, time
+from contextlib import closing, contextmanager
+
+# Allow `python rag/precompute.py` from the repo root to import rag/ and tools/
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from rag import retrieve
+from rag.answer import answer_mode, stream_answer, synthesize_answer
+from tools.grants_prompt import build_grants_prompt
+from tools.eip_spr_prompt import build_eip_spr_prompt
+
+ANSWERS_DB = retrieve.IDX_DIR / "answers.sqlite"
+
+# Grant income tiers step in $500 for families and $250 for singles (EHG); above the
+# highest ceiling the answer no longer changes with income.
+INCOME_STEP = {"Family": 500, "Singles": 250}
+INCOME_CAP = {"Family": 14000, "Singles": 7000}
+
+SCHEMES = ["Family", "Singles"]
+CITIZENSHIPS = ["SC", "SC+SPR", "SPR"]
+FLAT_TYPES = ["3 ROOM", "4 ROOM", "5 ROOM", "EXECUTIVE"]
+NEAR_PARENTS = [None, True, False]
+ETHNICITIES = ["Chinese", "Malay", "Indian/Others"]
+
+
+def income_bucket(income, scheme: str) -> int:
+    """
+    Upper edge of the income band: tiers read "income up to $X", so rounding up keeps
+    every income in the same tier as its bucket. Incomes past the cap share one bucket.
+    """
+    step, cap = INCOME_STEP.get(scheme, 500), INCOME_CAP.get(scheme, 14000)
+    income = max(0, int(income or 0))
+    return cap + step if income > cap else math.ceil(income / step) * step
+
+
+def grants_question(is_first_timer, scheme, citizenship, household_income, flat_type, within_4km_of_parents):
+    """build_grants_prompt() on the bucketed income: the form both precompute and the app use."""
+    return build_grants_prompt(
+        is_first_timer=is_first_timer, scheme=scheme, citizenship=citizenship,
+        household_income=income_bucket(household_income, scheme), flat_type=flat_type,
+        within_4km_of_parents=within_4km_of_parents,
+    )
+
+
+def eip_question(ethnicity, profile, town, block=None):
+    """build_eip_spr_prompt() with the town as entered (whitespace trimmed)."""
+    return build_eip_spr_prompt(ethnicity=ethnicity, profile=profile,
+                                town=" ".join((town or "").split()), block=block)
+
+
+def eip_key(ethnicity, profile, town, block=None):
+    # data.gov.sg town names are upper-case; keying stored answers on that form lets
+    # "Tampines" and "TAMPINES" share one, while the prompt keeps the town as typed
+    return eip_question(ethnicity, profile, (town or "").upper(), block)
+
+
+def grant_questions():
+    for scheme in SCHEMES:
+        step, cap = INCOME_STEP[scheme], INCOME_CAP[scheme]
+        incomes = range(0, cap + 2 * step, step)
+        for ft, cit, flat, near, inc in itertools.product([True, False], CITIZENSHIPS, FLAT_TYPES, NEAR_PARENTS, incomes):
+            yield grants_question(ft, scheme, cit, inc, flat, near)
+
+
+def eip_questions(towns):
+    """(key, question) pairs; the data's upper-case towns are asked in title case."""
+    for eth, prof, town in itertools.product(ETHNICITIES, CITIZENSHIPS, towns):
+        yield eip_key(eth, prof, town), eip_question(eth, prof, town.title())
+
+
+class AnswerStore:
+    def __init__(self, path=None):
+        self.path = pathlib.Path(path or ANSWERS_DB)
+        self._schema_ready = False
+
+    @contextmanager
+    def _con(self):
+        # one transaction, then closed; the table is created once (again if the file went)
+        new = not self._schema_ready or not self.path.exists()
+        with closing(sqlite3.connect(self.path.as_posix())) as con, con:
+            if new:
+                con.execute("""
+                    CREATE TABLE IF NOT EXISTS answers (
+                      index_digest TEXT, mode TEXT, question TEXT, hits TEXT, answer TEXT, created_at REAL,
+                      PRIMARY KEY (index_digest, mode, question)
+                    )
+                """)
+                self._schema_ready = True
+            yield con
+
+    def get(self, digest: str, mode: str, question: str):
+        if not self.path.exists():
+            return None
+        with self._con() as con:
+            row = con.execute(
+                "SELECT hits, answer FROM answers WHERE index_digest = ? AND mode = ? AND question = ?",
+                [digest, mode, question],
+            ).fetchone()
+        return None if row is None else (json.loads(row[0]), json.loads(row[1]))
+
+    def put_many(self, digest: str, mode: str, rows):
+        with self._con() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                [(digest, mode, q, json.dumps(hits), json.dumps(ans), time.time()) for q, hits, ans in rows],
+            )
+
+    def prune(self, digest: str) -> int:
+        """Drop answers built against other index versions."""
+        with self._con() as con:
+            return con.execute("DELETE FROM answers WHERE index_digest != ?", [digest]).rowcount
+
+
+def answer_question(retriever, question: str, store: AnswerStore = None, stream: bool = False, key: str = None):
+    """
+    Stored answer for (index, mode, key) if precomputed, else live. Adds "source".
+    key: what the answer is stored under (eip_key()); default the question itself.
+    stream=True returns a live answer as an AnswerStream (rag/answer.py) to render as it arrives.
+    """
+    store = store or AnswerStore()
+    hit = store.get(retriever.digest, answer_mode(), key or question)
+    if hit is not None:
+        return {**hit[1], "source": "precomputed"}
+    if stream:
+        return stream_answer(question, retriever.search(question))
+    ans = synthesize_answer(question, retriever.search(question))
+    return {**ans, "source": "live"}
+
+
+def precompute(retriever, questions, store: AnswerStore = None, batch=50) -> int:
+    """questions: question strings, or (key, question) pairs as eip_questions() yields."""
+    store = store or AnswerStore()
+    digest, mode = retriever.digest, answer_mode()
+    rows, n = [], 0
+    pairs = ((q, q) if isinstance(q, str) else q for q in questions)
+    for key, q in dict(pairs).items():  # de-duplicate by key, keep order
+        if store.get(digest, mode, key) is not None:
+            continue
+        hits = retriever.search(q)
+        ans = synthesize_answer(q, hits)
+        if ans.get("partial"):  # API error / timeout: leave it for the next run
+            print(f"  [WARN] no complete answer for: {q[:60]}")
+            continue
+        rows.append((key, hits, ans))
+        if len(rows) >= batch:
+            store.put_many(digest, mode, rows)
+            n, rows = n + len(rows), []
+            print(f"  {n} answers stored")
+    if rows:
+        store.put_many(digest, mode, rows)
+        n += len(rows)
+    return n
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Precompute answers for the templated Grants / EIP-SPR questions.")
+    ap.add_argument("--only", choices=["grants", "eip"])
+    ap.add_argument("--db", type=pathlib.Path, default=ANSWERS_DB)
+    args = ap.parse_args(argv)
+
+    retriever = retrieve.RuleRetriever(top_k=6)
+    store = AnswerStore(args.db)
+    questions = []
+    if args.only in (None, "grants"):
+        questions += list(grant_questions())
+    if args.only in (None, "eip"):
+        from tools.discovery import discovery_towns  # needs db/resale.duckdb
+        questions += list(eip_questions(discovery_towns()))
+    print(f"{len(questions)} questions, index {retriever.digest}, mode {answer_mode()}")
+    n = precompute(retriever, questions, store)
+    print(f"[DONE] {n} new answers; pruned {store.prune(retriever.digest)} from older indexes")
+
+
+if __name__ == "__main__":
+    main()
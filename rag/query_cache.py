@@ -0,0 +1,63 @@
+import hashlib, pathlib, sqlite3, threading
+import numpy as np
+from cachetools import LRUCache
+
+
+def normalise_query(text: str) -> str:
+    # whitespace never changes the tokens, so "  OTP\nvalidity " == "OTP validity"
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    LRU of query embeddings keyed by (model id, normalised text). With `path`, entries are
+    also written to a small sqlite file, so templated questions (Grants, EIP/SPR tabs)
+    skip the encoder across restarts too. Embeddings do not depend on the rule index, so
+    a rebuilt rules.npy leaves this cache valid.
+    """
+    def __init__(self, model_id: str, maxsize: int = 2048, path=None):
+        self.model_id = model_id
+        self._lru = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+        if path:
+            path = pathlib.Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path.as_posix(), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS query_emb (key TEXT PRIMARY KEY, vec BLOB)")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_id}\n{text}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str):
+        key = self._key(text)
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self.stats["hits"] += 1
+                return vec
+            row = self._db.execute("SELECT vec FROM query_emb WHERE key = ?", [key]).fetchone() \
+                if self._db is not None else None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            vec = np.frombuffer(row[0], dtype="float32")
+            self._lru[key] = vec
+            self.stats["disk_hits"] += 1
+            return vec
+
+    def put(self, text: str, vec):
+        key = self._key(text)
+        vec = np.asarray(vec, dtype="float32")
+        with self._lock:
+            self._lru[key] = vec
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO query_emb VALUES (?, ?)", [key, vec.tobytes()])
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
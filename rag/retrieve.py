@@ -1,27 +1,271 @@
-import json, pathlib
+import os, pathlib, threading, time
+from dataclasses import dataclass
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from cachetools import LRUCache
+from rag.embed import EMB_MODEL, EMB_BACKEND, load_encoder
+from rag.ann import ivf_search, load_ivf
+from rag.batch import MicroBatcher
+from rag.bm25 import bm25_scores, load_bm25, rrf
+from rag.index_store import EMB, HEADER, open_index
+from rag.query_cache import EmbeddingCache, normalise_query
 
 IDX_DIR = pathlib.Path("rag/index_rules")
-EMB_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+RESULT_CACHE_SIZE = 1024
+SCORE_BLOCK = 8192  # rows converted to float32 at a time for a float16 index
+# "auto": use the IVF index when the build wrote one (large indexes); "off": always exact
+RAG_ANN = os.getenv("RAG_ANN", "auto")
+# "auto": fuse BM25 with the dense ranking when the index has postings; "off": dense only
+RAG_HYBRID = os.getenv("RAG_HYBRID", "auto")
+FUSION_DEPTH = 50  # candidates taken from each ranking before fusion
+# "1": load the embedding model at app start (in the background) instead of on the first search
+RAG_WARM_UP = os.getenv("RAG_WARM_UP", "0") == "1"
+# window (ms) for coalescing concurrent searches in the shared app retriever; 0 turns it off
+RAG_BATCH_MS = float(os.getenv("RAG_BATCH_MS", "3"))
+BATCH_MAX = 64  # queries per coalesced encode / matmul
+
+def index_version(idx_dir: pathlib.Path = None) -> tuple:
+    """Changes whenever rag/index_rules.py rewrites the index (cheap: two stat calls)."""
+    out = []
+    for name in (EMB, HEADER):
+        p = (idx_dir or IDX_DIR) / name
+        if p.exists():
+            st = p.stat()
+            out.append((st.st_size, st.st_mtime_ns))
+    return tuple(out)
+
+def _scores(emb, q):
+    if emb.dtype == np.float32:
+        return emb @ q
+    return np.concatenate([emb[i:i + SCORE_BLOCK].astype("float32") @ q
+                           for i in range(0, len(emb), SCORE_BLOCK)])
+
+@dataclass(frozen=True)
+class _Index:
+    """One loaded index. A reload swaps in a new one whole, so a search never mixes two."""
+    version: tuple
+    emb: np.ndarray  # [N, D] normalized, memory-mapped
+    chunks: object  # parsed only when they are hits
+    header: dict
+    ivf: object = None
+    bm25: object = None
+
+    @property
+    def digest(self) -> str:
+        return self.header["digest"]  # content hash, stable across copies/deploys
 
 class RuleRetriever:
-    def __init__(self, top_k=6):
-        self.model = SentenceTransformer(EMB_MODEL)
-        self.emb = np.load((IDX_DIR / "rules.npy").as_posix()).astype("float32")  # [N, D], normalized
-        self.chunks = json.loads((IDX_DIR / "rules.json").read_text(encoding="utf-8"))
+    """
+    Cosine search over the prebuilt rule index. The embedding model (sentence_transformers
+    -> torch/transformers, seconds to import) is only loaded on the first search, or
+    ahead of it by warm_up(); `timings` records how long each stage took.
+    backend: "torch" / "onnx" / "onnx-int8" (see rag/embed.py; default EMB_BACKEND).
+    encoder: any object with .encode(texts, normalize_embeddings=True) to use instead.
+    Query embeddings and top-k results are cached (see cache_stats()); cache_path adds an
+    on-disk copy of the embeddings. A rebuilt rules.npy is picked up on the next search.
+    batch_ms: for a retriever shared across sessions, concurrent searches that miss the
+    caches within this window are answered together, one encode and one matrix multiply
+    for all (rag/batch.py); 0 searches on the calling thread.
+    """
+    def __init__(self, top_k=6, warm=False, backend=None, encoder=None, cache_path=None, batch_ms=0):
         self.top_k = top_k
+        self.backend = backend
+        self.timings = {}
+        self._model = encoder
+        self._model_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._searching = 0  # _search_many() calls in flight
+        self._retired = []  # chunk stores of replaced indexes, closed once no search reads them
+        self._index = self._load_index()
+        self.emb_cache = EmbeddingCache(f"{EMB_MODEL}:{backend or EMB_BACKEND}", path=cache_path)
+        self._results = LRUCache(RESULT_CACHE_SIZE)
+        self._result_stats = {"hits": 0, "misses": 0}
+        self._batcher = MicroBatcher(self._search_many, batch_ms / 1e3, BATCH_MAX,
+                                     name="retriever-batch") if batch_ms else None
+        if warm:
+            self.warm_up()
+
+    def _load_index(self) -> _Index:
+        t0 = time.perf_counter()
+        version = index_version()
+        emb, chunks, header = open_index(IDX_DIR)
+        ann, bm = header.get("ann"), header.get("bm25")
+        idx = _Index(
+            version, emb, chunks, header,
+            ivf=load_ivf(IDX_DIR / ann["file"]) if ann and RAG_ANN != "off" else None,
+            bm25=load_bm25(IDX_DIR / bm["file"]) if bm and RAG_HYBRID != "off" else None,
+        )
+        self.timings["index_load_s"] = time.perf_counter() - t0
+        return idx
+
+    # the current index's parts, for callers outside a search
+    version = property(lambda self: self._index.version)
+    emb = property(lambda self: self._index.emb)
+    chunks = property(lambda self: self._index.chunks)
+    header = property(lambda self: self._index.header)
+    digest = property(lambda self: self._index.digest)
+    ivf = property(lambda self: self._index.ivf)
+    bm25 = property(lambda self: self._index.bm25)
+
+    def _check_index(self):
+        # reload after a rebuild; cached results belong to the old index
+        if index_version() != self._index.version:
+            with self._index_lock:
+                if index_version() != self._index.version:
+                    old = self._index.chunks
+                    self._index = self._load_index()
+                    self._results.clear()
+                    if hasattr(old, "close"):  # legacy indexes load a plain list
+                        self._retired.append(old)
+                    self._close_retired()
+
+    def _close_retired(self):
+        # caller holds _index_lock; the mmap and file of an old index go once nothing reads them
+        if not self._searching:
+            for store in self._retired:
+                store.close()
+            self._retired.clear()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    t0 = time.perf_counter()
+                    model = load_encoder(self.backend)  # imports sentence_transformers
+                    self.timings["model_load_s"] = time.perf_counter() - t0
+                    self._model = model
+        return self._model
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self, background=True):
+        """Load the model and run one encode; in a daemon thread unless background=False."""
+        def run():
+            t0 = time.perf_counter()
+            self.model.encode(["warm up"], normalize_embeddings=True)
+            self.timings["warm_up_s"] = time.perf_counter() - t0
+        if not background:
+            run()
+            return None
+        th = threading.Thread(target=run, name="retriever-warm-up", daemon=True)
+        th.start()
+        return th
+
+    def embed_query(self, query: str):
+        text = normalise_query(query)
+        q = self.emb_cache.get(text)
+        if q is None:
+            q = self.model.encode([text], normalize_embeddings=True).astype("float32")[0]  # [D]
+            self.emb_cache.put(text, q)
+        return q
 
     def search(self, query: str):
-        q = self.model.encode([query], normalize_embeddings=True).astype("float32")  # [1, D]
-        # cosine since both normalized -> dot product
-        scores = (q @ self.emb.T)[0]  # [N]
-        idxs = np.argpartition(scores, -self.top_k)[-self.top_k:]
-        # sort top-k by score desc
-        idxs = idxs[np.argsort(scores[idxs])[::-1]]
+        t0 = time.perf_counter()
+        self._check_index()
+        text = normalise_query(query)
+        with self._index_lock:
+            hit = self._results.get((self._index.version, text, self.top_k))
+            self._result_stats["hits" if hit is not None else "misses"] += 1
+        if hit is not None:
+            return [c.copy() for c in hit]
+
+        if self._batcher is not None:
+            version, out = self._batcher.submit(query)
+        else:
+            version, out = self._search_many([query])[0]
+        with self._index_lock:
+            # under the index that ranked them: results from one replaced meanwhile never hit
+            self._results[(version, text, self.top_k)] = out
+        self.timings.setdefault("first_query_s", time.perf_counter() - t0)
+        self.timings["last_query_s"] = time.perf_counter() - t0
+        return [c.copy() for c in out]
+
+    def _embed_many(self, texts):
+        # cached embeddings, and one encode for all the misses (repeats encoded once)
+        vecs = {t: self.emb_cache.get(t) for t in dict.fromkeys(texts)}
+        miss = [t for t, v in vecs.items() if v is None]
+        if miss:
+            for t, v in zip(miss, self.model.encode(miss, normalize_embeddings=True).astype("float32")):
+                self.emb_cache.put(t, v)
+                vecs[t] = v
+        return np.stack([vecs[t] for t in texts])  # [B, D]
+
+    def _search_many(self, queries):
+        """[(index version, uncached top-k results)] for several queries at once."""
+        with self._index_lock:
+            idx = self._index  # one index for the whole batch, even if a reload swaps it
+            self._searching += 1
+        try:
+            return [(idx.version, hits) for hits in self._rank_many(idx, queries)]
+        finally:
+            with self._index_lock:
+                self._searching -= 1
+                self._close_retired()
+
+    def _rank_many(self, idx: _Index, queries):
+        Q = self._embed_many([normalise_query(q) for q in queries])
+        k = self.top_k if idx.bm25 is None else FUSION_DEPTH
+        out = []
+        for query, q, (ids, top_scores) in zip(queries, Q, self._dense_topk_many(idx, Q, k)):
+            if idx.bm25 is not None:
+                out.append(self._hybrid(idx, query, q, (ids, top_scores)))
+                continue
+            hits = []
+            for i, score in zip(ids, top_scores):
+                c = idx.chunks[int(i)].copy()
+                c["score"] = float(score)
+                hits.append(c)
+            out.append(hits)
+        return out
+
+    def _dense_topk(self, idx: _Index, q, k):
+        return self._dense_topk_many(idx, q[None, :], k)[0]
+
+    def _dense_topk_many(self, idx: _Index, Q, k):
+        k = min(k, len(idx.emb))
+        if idx.ivf is not None:
+            # approximate: only the rows of the closest clusters are scored
+            return [ivf_search(idx.emb, idx.ivf, q, k) for q in Q]
+        # cosine since both normalized -> dot product; one pass over the index for all
+        scores = _scores(idx.emb, Q.T) if len(Q) > 1 else _scores(idx.emb, Q[0])[:, None]  # [N, B]
+        out = []
+        for s in np.ascontiguousarray(scores.T):  # [B, N]: each query's scores in one row
+            idxs = np.argpartition(s, -k)[-k:]
+            # sort top-k by score desc
+            idxs = idxs[np.argsort(s[idxs])[::-1]]
+            out.append((idxs, s[idxs]))
+        return out
+
+    def _hybrid(self, idx: _Index, query: str, q, dense=None):
+        # Reciprocal-rank fusion of the dense and BM25 rankings: exact acronyms (EHG, COV)
+        # lift chunks the embedding missed, and agreement between both ranks first.
+        dense_ids, dense_scores = dense if dense is not None else self._dense_topk(idx, q, FUSION_DEPTH)
+        sparse = bm25_scores(idx.bm25, query)
+        hit = np.flatnonzero(sparse)
+        sparse_ids = hit[np.argsort(sparse[hit])[::-1][:FUSION_DEPTH]]
+        fused = rrf([dense_ids, sparse_ids])
+        dense = dict(zip(map(int, dense_ids), map(float, dense_scores)))
         out = []
-        for i in idxs:
-            c = self.chunks[int(i)].copy()
-            c["score"] = float(scores[i])
+        for i in sorted(fused, key=fused.get, reverse=True)[:self.top_k]:
+            c = idx.chunks[i].copy()
+            c["score"] = fused[i]
+            c["dense_score"] = dense.get(i)
+            c["bm25_score"] = float(sparse[i])
             out.append(c)
         return out
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the query-embedding and result caches, with hit rates."""
+        emb = dict(self.emb_cache.stats)
+        with self._index_lock:
+            res = dict(self._result_stats)
+        def rate(hits, total):
+            return round(hits / total, 3) if total else None
+        emb["hit_rate"] = rate(emb["hits"] + emb["disk_hits"], emb["hits"] + emb["disk_hits"] + emb["misses"])
+        res["hit_rate"] = rate(res["hits"], res["hits"] + res["misses"])
+        out = {"embeddings": emb, "results": res}
+        if self._batcher is not None:
+            out["batches"] = dict(self._batcher.stats)
+        return out
@@ -1,17 +1,20 @@
 import pandas as pd
 from tools.comps import sql_comps
+from tools.discovery import discover_blocks, discovery_towns, BUDGET_BASIS
 from tools.calc_afford import AffordInputs, calc_afford
 import streamlit as st
-from rag.retrieve import RuleRetriever
-from rag.answer import synthesize_answer
+from rag.retrieve import RAG_BATCH_MS, RAG_WARM_UP, RuleRetriever
+from rag.answer import AnswerStream
+from rag.answer_cache import ANSWER_CACHE, AnswerCache, cached_answer
 from tools.readiness import ReadinessInputs, readiness_score
 from tools.timeline import TimelineInputs, build_timeline
 from datetime import date
 from tools.formatting import fmt_money, fmt_psf
-from tools.grants_prompt import build_grants_prompt
-from tools.eip_spr_prompt import build_eip_spr_prompt
+from rag.precompute import grants_question, eip_question, eip_key, answer_question
 from tools.block_checklist import build_block_checklist
+from tools.sql_utils import data_available
 import os, pathlib, time
+import duckdb
 
 st.set_page_config(page_title="SG HDB Resale Assistant", layout="wide")
 st.title("🇸🇬 SG HDB Resale Assistant")
@@ -26,10 +29,42 @@ else:
 
 @st.cache_resource
 def get_retriever():
-    return RuleRetriever(top_k=6)
+    # The embedding model loads lazily, on the first search that misses the caches;
+    # RAG_WARM_UP=1 loads it in the background at start instead.
+    # Query embeddings persist in data/ so templated tab questions skip the encoder.
+    # One retriever serves every session: concurrent searches share one encode + matmul
+    return RuleRetriever(top_k=6, warm=RAG_WARM_UP, cache_path="data/query_cache.sqlite",
+                         batch_ms=RAG_BATCH_MS)
+
+@st.cache_resource
+def get_answer_cache():
+    # free-text answers, shared across sessions and kept in data/ across restarts
+    return AnswerCache(ANSWER_CACHE)
 
 retriever = get_retriever()
 
+def show_answer(ans):
+    """Render an answer dict, or stream an AnswerStream token by token, then its sources."""
+    if isinstance(ans, AnswerStream):
+        box = st.empty()
+        with box.container():
+            st.write_stream(ans)  # time to first token, not the whole completion
+        usage = ans.usage
+        ans = ans.result
+        box.markdown(ans["answer_markdown"])  # final version, with linked citations
+        if usage.get("prompt_tokens"):
+            # the context budget at work (rag/context.py)
+            st.caption(f"Prompt: {usage['prompt_tokens']} tokens · sources {usage['context_tokens']}"
+                       f"/{usage['budget']} tokens from {usage['hits_used']} chunks"
+                       + (f" · API: {usage['api_prompt_tokens']} in, {usage['completion_tokens']} out"
+                          if "api_prompt_tokens" in usage else ""))
+    else:
+        st.markdown(ans["answer_markdown"])
+    if ans.get("citations"):
+        st.caption("Sources:")
+        for i, c in enumerate(ans["citations"], 1):
+            st.markdown(f"- [{i}] {c['title']} — {c['url']}")
+
 
 with st.sidebar:
     st.header("Buyer Profile")
@@ -120,7 +155,8 @@ with tabs[1]:
 
     if st.button("Explain my grant options"):
         # Compose the RAG question and ask the retriever/LLM
-        q = build_grants_prompt(
+        # Income is bucketed into grant tiers so most questions hit the precomputed answers
+        q = grants_question(
             is_first_timer=is_first_timer,
             scheme=scheme,
             citizenship=citizenship,
@@ -128,15 +164,8 @@ with tabs[1]:
             flat_type=flat_type,
             within_4km_of_parents=within_4km_bool
         )
-        hits = retriever.search(q)
-        ans = synthesize_answer(q, hits)
-
         # Render answer + sources
-        st.markdown(ans["answer_markdown"])
-        if ans.get("citations"):
-            st.caption("Sources:")
-            for i, c in enumerate(ans["citations"], 1):
-                st.markdown(f"- [{i}] {c['title']} — {c['url']}")
+        show_answer(answer_question(retriever, q, stream=True))
 
     st.info(
         "Grant amounts and eligibility change over time. Use this as guidance and confirm on the official HDB/CPF pages "
@@ -241,14 +270,8 @@ with tabs[4]:
 
     # 1) RAG explainer (concise, cited)
     if st.button("Explain how EIP/SPR affects me"):
-        q = build_eip_spr_prompt(ethnicity=ethnicity, profile=profile, town=town, block=block if block.strip() else None)
-        hits = retriever.search(q)
-        ans = synthesize_answer(q, hits)
-        st.markdown(ans["answer_markdown"])
-        if ans.get("citations"):
-            st.caption("Sources:")
-            for i, c in enumerate(ans["citations"], 1):
-                st.markdown(f"- [{i}] {c['title']} — {c['url']}")
+        eip_args = dict(ethnicity=ethnicity, profile=profile, town=town, block=block if block.strip() else None)
+        show_answer(answer_question(retriever, eip_question(**eip_args), stream=True, key=eip_key(**eip_args)))
     st.warning(
     "Key timing risk: you submit Request for Value **after** OTP. If the HDB valuation is below your agreed price, "
     "the difference (COV) must be paid in **cash**. Consider block-level comps before offering."
@@ -297,17 +320,40 @@ with tabs[5]:
 with tabs[6]:
     st.subheader("Discovery")
     st.write("Filters to find candidate blocks by budget/lease/flat type.")
+    st.caption(
+        f"Uses sidebar flat type (**{flat_type}**) and budget. Value score compares PSF per remaining "
+        "lease year with the town's median for the flat type (100 = typical, higher = more lease per dollar)."
+    )
+
+    # runs on every rerun: only query when there is data to open
+    if not data_available():
+        st.info("No resale data loaded yet — run `python db/init_duckdb.py` to enable Discovery.")
+    else:
+        try:
+            d1, d2, d3 = st.columns(3)
+            with d1:
+                basis = st.selectbox("Budget must cover", list(BUDGET_BASIS), index=1,
+                                     help="Which recent price of the block your budget is compared with.")
+            with d2:
+                min_lease = st.slider("Min remaining lease (years)", 0, 95, 60)
+            with d3:
+                min_deals = st.slider("Min deals (last 12 months)", 1, 20, 3, help="Liquidity floor.")
+            pick_towns = st.multiselect("Towns (optional)", discovery_towns())
+
+            found = discover_blocks(flat_type, budget=budget or None, budget_basis=basis,
+                                    min_lease_years=min_lease, towns=pick_towns, min_deals=min_deals)
+            if found.empty:
+                st.warning("No blocks match these filters.")
+            else:
+                st.write(f"**{len(found)} candidate blocks** (best value first)")
+                st.dataframe(found, use_container_width=True, hide_index=True)
+        except duckdb.Error as e:
+            st.info(f"Discovery is unavailable right now ({type(e).__name__}); try again after the data load finishes.")
 
 st.divider()
 question = st.text_input("Ask a question about HDB resale")
 if question:
-    hits = retriever.search(question)
-    ans = synthesize_answer(question, hits)
-    st.markdown(ans["answer_markdown"])
-    if ans.get("citations"):
-        st.caption("Sources:")
-        for i, c in enumerate(ans["citations"], 1):
-            st.markdown(f"- [{i}] {c['title']} — {c['url']}")
+    show_answer(cached_answer(get_answer_cache(), retriever, question, stream=True))
 
 
 st.write("")
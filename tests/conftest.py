@@ -0,0 +1,120 @@
+import sys, zlib, shutil, sqlite3, pathlib
+import duckdb
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from tools import sql_utils
+from db import init_duckdb
+from rag import retrieve
+
+IDX = pathlib.Path(__file__).resolve().parents[1] / "rag" / "index_rules"
+
+# Small synthetic resale history: 2 towns x 2 blocks x 2 flat types, 24 months
+TOWNS = {"TAMPINES": ["101", "102"], "BEDOK": ["201", "202"]}
+FLAT_TYPES = {"4 ROOM": 92.0, "5 ROOM": 110.0}
+
+
+def sample_rows():
+    rows = []
+    for y, m in [(2023 + (i // 12), i % 12 + 1) for i in range(24)]:
+        for town, blocks in TOWNS.items():
+            for bi, blk in enumerate(blocks):
+                for ft, sqm in FLAT_TYPES.items():
+                    for k in range(2):
+                        price = 400000 + 20000 * bi + 1000 * (m + 12 * (y - 2023)) + 5000 * k + (100000 if ft == "5 ROOM" else 0)
+                        rows.append((
+                            f"{y}-{m:02d}-01", town, blk, f"{town} ST {bi + 1}", ft,
+                            f"{k * 3 + 1:02d} TO {k * 3 + 3:02d}", sqm, 1990 + bi,
+                            f"{65 - bi} years 0{k + 1} months", float(price),
+                        ))
+    return rows
+
+
+@pytest.fixture
+def resale_db(tmp_path, monkeypatch):
+    path = tmp_path / "resale.duckdb"
+    con = duckdb.connect(path.as_posix())
+    con.execute("""
+        CREATE TEMP TABLE fixture_rows (
+          month DATE, town TEXT, block TEXT, street_name TEXT, flat_type TEXT,
+          storey_range TEXT, floor_area_sqm DOUBLE, lease_commence_date INTEGER,
+          remaining_lease TEXT, resale_price DOUBLE
+        )
+    """)
+    con.executemany("INSERT INTO fixture_rows VALUES (?,?,?,?,?,?,?,?,?,?)", sample_rows())
+    # Same physical layout as db/init_duckdb.py produces
+    init_duckdb.relayout(con, extra="fixture_rows")
+    init_duckdb.create_schema(con)
+    con.close()
+    sql_utils.close_all()
+    monkeypatch.setattr(sql_utils, "DB_PATH", path)
+    yield path
+    sql_utils.close_all()
+
+
+class CountingEncoder:
+    """Deterministic stand-in for the MiniLM encoder: one unit vector per text."""
+    def __init__(self, dim):
+        self.dim, self.calls = dim, 0
+
+    def encode(self, texts, normalize_embeddings=True, **kwargs):
+        self.calls += 1
+        self.texts = list(texts)
+        out = []
+        for t in texts:
+            # crc32, not hash(): the same vector in every process (EncoderPool workers)
+            v = np.random.default_rng(zlib.crc32(t.encode())).standard_normal(self.dim)
+            out.append(v / np.linalg.norm(v))
+        return np.array(out, dtype="float32")
+
+
+class ConnectionSpy:
+    """Stand-in for sqlite3.connect: keeps every connection and counts CREATE TABLEs run."""
+    def __init__(self):
+        self.cons, self.creates = [], 0
+        spy, self._connect = self, sqlite3.connect
+        class Connection(sqlite3.Connection):
+            def execute(self, sql, *args):
+                spy.creates += sql.count("CREATE TABLE")
+                return super().execute(sql, *args)
+            def executescript(self, sql):
+                spy.creates += sql.count("CREATE TABLE")
+                return super().executescript(sql)
+        self._factory = Connection
+
+    def __call__(self, *args, **kwargs):
+        con = self._connect(*args, factory=self._factory, **kwargs)
+        self.cons.append(con)
+        return con
+
+    def open(self) -> int:
+        n = 0
+        for con in self.cons:
+            try:
+                con.cursor()
+                n += 1
+            except sqlite3.ProgrammingError:  # closed
+                pass
+        return n
+
+
+@pytest.fixture
+def idx_dir(tmp_path, monkeypatch):
+    # a private copy of the committed rule index
+    d = tmp_path / "index_rules"
+    shutil.copytree(IDX, d)
+    monkeypatch.setattr(retrieve, "IDX_DIR", d)
+    return d
+
+
+@pytest.fixture
+def openai_stub(monkeypatch):
+    # the answer layer pointed at a local fake API (tests/openai_stub.py)
+    from openai_stub import StubOpenAI
+    srv = StubOpenAI().start()
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    monkeypatch.setenv("OPENAI_BASE_URL", srv.base_url)
+    yield srv
+    srv.stop()
@@ -0,0 +1,106 @@
+"""
+Local stand-in for the OpenAI chat completions API, for tests and offline demos.
+
+    python tests/openai_stub.py [port]
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run streamlit_app.py
+
+Answers are canned: `reply` split into `pieces` streamed chunks, `delay_s` apart (SSE
+over chunked HTTP/1.1 keep-alive, like the real API), then a usage chunk if asked for.
+Every request is recorded in `requests`, with the client's address so connection
+reuse is visible.
+"""
+import sys, json, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "- Check the income ceiling [1].\n- Apply for the HFE letter first [2]."
+
+
+class StubOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, reply=REPLY, pieces=8, delay_s=0.0, first_delay_s=0.0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.reply, self.pieces, self.delay_s, self.first_delay_s = reply, pieces, delay_s, first_delay_s
+        self.requests = []
+        self.disconnects = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so a pooled client reuses the connection
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body: bytes, ctype="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        srv = self.server
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        srv.requests.append({"path": self.path, "client": self.client_address, "body": req})
+        if not self.path.endswith("/chat/completions"):
+            return self._send(404, b'{"error": {"message": "not found"}}')
+        reply, model = srv.reply, req.get("model", "stub")
+        if not req.get("stream"):
+            time.sleep(srv.first_delay_s)
+            body = {"id": "stub", "object": "chat.completion", "created": 0, "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": reply}}]}
+            return self._send(200, json.dumps(body).encode())
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(1, -(-len(reply) // srv.pieces))
+        pieces = [reply[i:i + step] for i in range(0, len(reply), step)]
+        try:
+            time.sleep(srv.first_delay_s)
+            for i, p in enumerate(pieces):
+                if i:
+                    time.sleep(srv.delay_s)
+                event = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": p}, "finish_reason": None}]}
+                self._chunk(b"data: " + json.dumps(event).encode() + b"\n\n")
+            done = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            self._chunk(b"data: " + json.dumps(done).encode() + b"\n\n")
+            if (req.get("stream_options") or {}).get("include_usage"):
+                # rough prompt count (words); enough to see it reported
+                prompt = sum(len(m["content"].split()) for m in req.get("messages", []))
+                usage = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+                         "choices": [], "usage": {"prompt_tokens": prompt, "completion_tokens": len(pieces),
+                                                  "total_tokens": prompt + len(pieces)}}
+                self._chunk(b"data: " + json.dumps(usage).encode() + b"\n\n")
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            srv.disconnects += 1  # the client cancelled mid-stream
+            self.close_connection = True
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    srv = StubOpenAI(port, delay_s=0.05)
+    print(f"OpenAI stub on {srv.base_url}")
+    srv.serve_forever()
@@ -0,0 +1,44 @@
+import numpy as np
+from rag import retrieve
+from rag.ann import ANN_FILE, build_ivf, ivf_search
+from rag.index_store import open_index, write_index
+from conftest import CountingEncoder
+
+DIM = 32
+
+
+def _clustered(n, seed=0, topics=60):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, DIM))
+    x = centers[rng.integers(0, topics, n)] + 0.5 * rng.standard_normal((n, DIM))
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype("float32")
+
+
+def test_ivf_recall_and_exact_when_probing_everything():
+    emb = _clustered(3000)
+    ivf = build_ivf(emb, nlist=40)
+    assert ivf["offsets"][-1] == len(emb) and sorted(ivf["rows"]) == list(range(len(emb)))
+    recall = 0
+    for q in _clustered(50, seed=1):
+        exact = np.argsort(emb @ q)[::-1][:6]
+        ids, scores = ivf_search(emb, ivf, q, 6)
+        assert list(scores) == sorted(scores, reverse=True)
+        recall += len(set(exact) & set(ids))
+        all_ids, _ = ivf_search(emb, ivf, q, 6, nprobe=40)
+        assert list(all_ids) == list(exact)
+    assert recall / (6 * 50) >= 0.9
+
+
+def test_retriever_uses_ann_when_index_has_it(idx_dir):
+    emb, chunks, _ = open_index(idx_dir)
+    header = write_index(idx_dir, list(chunks), np.array(emb), "test", ann=True)
+    assert header["ann"]["file"] == ANN_FILE and (idx_dir / ANN_FILE).exists()
+    enc = CountingEncoder(emb.shape[1])
+    r = retrieve.RuleRetriever(top_k=4, encoder=enc)
+    assert r.ivf is not None
+    hits = r.search("EHG income ceiling")
+    assert len(hits) == 4 and [h["score"] for h in hits] == sorted((h["score"] for h in hits), reverse=True)
+
+    # small indexes are written without it (below ANN_MIN_CHUNKS)
+    assert write_index(idx_dir, list(chunks), np.array(emb), "test")["ann"] is None
+    assert not (idx_dir / ANN_FILE).exists()
@@ -0,0 +1,68 @@
+import time
+from rag import answer
+from rag.answer import get_client, stream_answer, synthesize_answer
+
+HITS = [{"title": f"Doc {i}", "url": f"https://www.hdb.gov.sg/{i}", "text": f"Rule text {i}. " * 20}
+        for i in range(1, 5)]
+
+
+def test_streams_pieces_and_links_citations(openai_stub):
+    s = stream_answer("How do grants work?", HITS)
+    pieces = list(s)
+    assert len(pieces) == 8 and "".join(pieces) == openai_stub.reply
+    assert "[1](https://www.hdb.gov.sg/1)" in s.result["answer_markdown"] and "partial" not in s.result
+    assert 0 < s.timings["first_token_s"] <= s.timings["total_s"]
+    body = openai_stub.requests[-1]["body"]
+    assert body["stream"] and "Rule text 2." in body["messages"][0]["content"]
+
+
+def test_one_pooled_client_reuses_its_connection(openai_stub):
+    client = get_client()
+    synthesize_answer("q1", HITS)
+    synthesize_answer("q2", HITS)
+    assert get_client() is client
+    assert len({r["client"] for r in openai_stub.requests}) == 1  # same TCP connection
+
+
+def test_time_to_first_token_beats_full_completion(openai_stub):
+    list(stream_answer("q", HITS))  # client, connection and tokenizer set up, untimed
+    openai_stub.delay_s = 0.1
+    s = stream_answer("q", HITS)
+    list(s)
+    # 8 pieces 0.1 s apart: the first arrives before the 0.7 s of gaps, not after them
+    assert s.timings["total_s"] >= 7 * openai_stub.delay_s
+    assert s.timings["first_token_s"] < s.timings["total_s"] / 3
+
+
+def test_cancel_closes_the_stream(openai_stub):
+    openai_stub.delay_s = 0.05
+    s = stream_answer("q", HITS)
+    it = iter(s)
+    first = next(it)
+    s.cancel()
+    rest = list(it)
+    assert first and len(rest) <= 1 and s.result["partial"] and "Stopped." in s.result["answer_markdown"]
+    assert s.timings["total_s"] < 0.3
+
+
+def test_timeout_falls_back_to_extractive(openai_stub, monkeypatch):
+    monkeypatch.setattr(answer, "ANSWER_TIMEOUT_S", 0.2)
+    monkeypatch.setattr(answer, "_client", None)
+    openai_stub.first_delay_s = 1.5
+    t = time.perf_counter()
+    res = synthesize_answer("q", HITS)
+    assert time.perf_counter() - t < 1.4  # includes the client's one retry
+    assert res["partial"] and "extractive fallback" in res["answer_markdown"] and res["citations"]
+
+    # a deadline mid-stream keeps what arrived
+    openai_stub.first_delay_s, openai_stub.delay_s = 0, 0.1
+    monkeypatch.setattr(answer, "ANSWER_DEADLINE_S", 0.25)
+    res = synthesize_answer("q", HITS)
+    assert res["partial"] and "cut off" in res["answer_markdown"]
+    assert res["answer_markdown"].startswith(openai_stub.reply[:5])
+
+
+def test_without_key_is_extractive(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    pieces = list(stream_answer("q", HITS))
+    assert len(pieces) == 1 and pieces[0].startswith("**Top relevant guidance")
@@ -0,0 +1,75 @@
+import re
+import numpy as np
+from rag import retrieve
+from rag.answer_cache import AnswerCache, cached_answer
+from conftest import CountingEncoder
+
+HITS = [{"doc_id": f"d{i}", "title": f"Doc {i}", "url": f"https://www.hdb.gov.sg/{i}", "text": f"Rule {i}."}
+        for i in range(1, 4)]
+ANS = {"answer_markdown": "- Check the ceiling [1].", "citations": [{"title": "Doc 1", "url": "u"}]}
+
+
+def _vec(*xs):
+    v = np.array(xs, dtype="float32")
+    return v / np.linalg.norm(v)
+
+
+class CaselessEncoder(CountingEncoder):
+    # near-duplicate questions (case, punctuation) embed identically
+    def encode(self, texts, **kwargs):
+        return super().encode([re.sub(r"[^a-z0-9 ]", "", t.lower()) for t in texts], **kwargs)
+
+
+def test_near_duplicates_share_an_answer():
+    c = AnswerCache(threshold=0.95)
+    c.put("How do I apply for the EHG?", _vec(1, 0, 0), "idx1", HITS, ANS)
+    assert c.get("How do I apply for the EHG?", _vec(0, 1, 0), "idx1", HITS) == ANS  # same text
+    assert c.get("how to apply for EHG", _vec(1, 0.1, 0), "idx1", HITS[::-1]) == ANS  # hit order doesn't matter
+    assert c.get("Something else", _vec(1, 1, 0), "idx1", HITS) is None  # below the threshold
+    assert c.get("how to apply for EHG", _vec(1, 0.1, 0), "idx2", HITS) is None  # rebuilt index
+    assert c.get("how to apply for EHG", _vec(1, 0.1, 0), "idx1", HITS[:2]) is None  # other context
+    assert c.stats == {"hits": 1, "near_hits": 1, "misses": 3}
+
+
+def test_numbers_must_match():
+    c = AnswerCache(threshold=0.9)
+    c.put("EHG at income $3,500?", _vec(1, 0), "idx", HITS, ANS)
+    assert c.get("EHG at income $4,000?", _vec(1, 0), "idx", HITS) is None
+    assert c.get("EHG for income 3500", _vec(1, 0), "idx", HITS) == ANS
+
+
+def test_lru_bound_and_persistence(tmp_path):
+    path = tmp_path / "answers.sqlite"
+    c = AnswerCache(path, maxsize=2)
+    for i, q in enumerate(["q1", "q2"]):
+        c.put(q, _vec(1, i), "idx", HITS, {**ANS, "n": i})
+    c.get("q1", None, "idx", HITS)  # q1 is now the most recently used
+    c.put("q3", _vec(0, 1), "idx", HITS, {**ANS, "n": 3})
+    assert c.get("q2", None, "idx", HITS) is None and c.get("q1", None, "idx", HITS)["n"] == 0
+    c.close()
+
+    c2 = AnswerCache(path, maxsize=2)  # the file was kept to 2 rows too
+    assert c2.get("q2", None, "idx", HITS) is None
+    assert c2.get("q1", None, "idx", HITS)["n"] == 0 and c2.get("q3", None, "idx", HITS)["n"] == 3
+
+
+def test_repeat_questions_skip_the_model(openai_stub, idx_dir, tmp_path):
+    r = retrieve.RuleRetriever(top_k=3, encoder=CaselessEncoder(np.load(idx_dir / "rules.npy").shape[1]))
+    c = AnswerCache(tmp_path / "answers.sqlite")
+    first = cached_answer(c, r, "Which grants can I get?")
+    again = cached_answer(c, r, "which grants can i get")
+    assert first["source"] == "live" and again["source"] == "cache"
+    assert again["answer_markdown"] == first["answer_markdown"] and len(openai_stub.requests) == 1
+
+    # streamed answers are stored once the stream completes; partial ones never are
+    s = cached_answer(c, r, "How long is the OTP valid?", stream=True)
+    assert len(c._lru) == 1
+    list(s)
+    assert cached_answer(c, r, "how long is the otp valid")["source"] == "cache"
+    openai_stub.first_delay_s = 0.3
+    s = cached_answer(c, r, "What is the MOP?", stream=True)
+    it = iter(s)
+    next(it)
+    s.cancel()
+    list(it)
+    assert cached_answer(c, r, "What is the MOP?")["source"] == "live"
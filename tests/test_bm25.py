@@ -0,0 +1,63 @@
+import numpy as np
+from rag import retrieve
+from rag.bm25 import BM25_FILE, bm25_scores, build_bm25, load_bm25, rrf, save_bm25, tokenize
+from rag.index_store import open_index
+from conftest import CountingEncoder
+
+CHUNKS = [
+    {"title": "EHG", "text": "Enhanced CPF Housing Grant (EHG) of up to $120,000 for first-timers."},
+    {"title": "PHG", "text": "Proximity Housing Grant for buying near parents."},
+    {"title": "Loans", "text": "Mortgage servicing ratio (MSR) caps the instalment at 30% of income."},
+]
+
+
+def test_tokenize_keeps_acronyms_and_numbers():
+    assert tokenize("What is the EHG for a 4-room flat?") == ["ehg", "4", "room", "flat"]
+
+
+def test_bm25_ranks_the_exact_term_first():
+    bm = build_bm25(CHUNKS)
+    assert int(bm["n_docs"]) == 3 and list(bm["terms"]) == sorted(bm["terms"])
+    s = bm25_scores(bm, "how much is the EHG?")
+    assert s.argmax() == 0 and s[1] == s[2] == 0
+    assert bm25_scores(bm, "msr limit").argmax() == 2
+    assert not bm25_scores(bm, "zzz").any()
+
+
+def test_vocabulary_is_stored_as_one_blob(tmp_path):
+    bm = build_bm25(CHUNKS)
+    save_bm25(tmp_path / BM25_FILE, bm)
+    with np.load(tmp_path / BM25_FILE) as z:
+        assert z["vocab"].dtype == np.uint8 and "terms" not in z.files  # no padded str array
+        assert z["vocab"].nbytes == sum(len(t) for t in bm["terms"])
+    back = load_bm25(tmp_path / BM25_FILE)
+    assert list(back["terms"]) == list(bm["terms"])
+    assert (bm25_scores(back, "EHG grant") == bm25_scores(bm, "EHG grant")).all()
+
+
+def test_rrf_rewards_agreement():
+    fused = rrf([[1, 2, 3], [3, 1]])
+    assert max(fused, key=fused.get) == 1 and fused[3] > fused[2]
+
+
+def test_hybrid_search_surfaces_exact_term(idx_dir):
+    emb, chunks, header = open_index(idx_dir)
+    assert header["bm25"]["file"] == BM25_FILE
+    # random embeddings: only the sparse side knows which chunk mentions valuation
+    target = next(i for i, c in enumerate(chunks) if "valuation" in c["text"].lower())
+    r = retrieve.RuleRetriever(top_k=4, encoder=CountingEncoder(emb.shape[1]))
+    hits = r.search("valuation")
+    assert hits[0]["text"] == chunks[target]["text"] and hits[0]["bm25_score"] > 0
+    assert [h["score"] for h in hits] == sorted((h["score"] for h in hits), reverse=True)
+    assert all(h["dense_score"] is not None for h in hits)
+
+
+def test_hybrid_off_is_dense_only(idx_dir, monkeypatch):
+    monkeypatch.setattr(retrieve, "RAG_HYBRID", "off")
+    emb, _, _ = open_index(idx_dir)
+    enc = CountingEncoder(emb.shape[1])
+    r = retrieve.RuleRetriever(top_k=3, encoder=enc)
+    assert r.bm25 is None
+    hits = r.search("valuation")
+    q = enc.encode(["valuation"])[0]
+    assert [h["score"] for h in hits] == sorted(np.asarray(emb, dtype="float32") @ q, reverse=True)[:3]
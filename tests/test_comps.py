@@ -0,0 +1,99 @@
+import os, statistics
+import pytest
+from tools.comps import sql_comps, batch_comps, SQM_TO_SQFT
+from tools import sql_utils, comps
+from tools.sql_utils import duckdb_conn
+from conftest import sample_rows
+from db.init_duckdb import build_aggregates, export_snapshot
+
+
+@pytest.fixture(params=["raw", "cube", "snapshot"])
+def comps_db(request, resale_db, monkeypatch):
+    if request.param != "raw":
+        con = duckdb_conn(write=True)
+        build_aggregates(con)
+        if request.param == "snapshot":
+            export_snapshot(con, resale_db.parent / "snapshot")
+        con.close()
+    if request.param == "snapshot":
+        # serve from the Parquet files only
+        resale_db.unlink()
+        monkeypatch.setattr(sql_utils, "SNAPSHOT_DIR", resale_db.parent / "snapshot")
+        assert sql_utils.store() == "snapshot"
+    return resale_db
+
+
+def _expected(town=None, block=None, flat_type="4 ROOM", since="2024-01-01"):
+    rows = [r for r in sample_rows()
+            if r[4] == flat_type and r[0] >= since
+            and (block is None or r[2] == block) and (town is None or r[1] == town)]
+    prices = sorted(r[9] for r in rows)
+    return rows, prices
+
+
+def test_town_comps_summary_series_recent(comps_db):
+    out = sql_comps(mode="town", town="TAMPINES", flat_type="4 ROOM", lookback_months=11)
+    rows, prices = _expected(town="TAMPINES")
+    s = out["summary"]
+    assert s["deals"] == len(rows)
+    assert s["median_price"] == statistics.median(prices)
+    assert s["p25_price"] == pytest.approx(statistics.quantiles(prices, n=4, method="inclusive")[0])
+    assert str(s["first_month"]) == "2024-01-01" and str(s["last_month"]) == "2024-12-01"
+    assert abs(s["avg_sqm"] - 92.0) < 1e-9
+    assert abs(s["median_psf"] - statistics.median(p / (92.0 * SQM_TO_SQFT) for p in prices)) < 1e-6
+
+    assert len(out["series"]) == 12
+    assert sum(m["deals"] for m in out["series"]) == len(rows)
+    assert [m["month"] for m in out["series"]] == sorted(m["month"] for m in out["series"])
+
+    assert len(out["recent"]) == 20
+    assert [str(r["month"]) for r in out["recent"][:4]] == ["2024-12-01"] * 4
+    assert [r["month"] for r in out["recent"]] == sorted((r["month"] for r in out["recent"]), reverse=True)
+    assert set(out["recent"][0]) >= {"street_name", "storey_range", "psf"}
+
+
+def test_block_mode_and_empty(comps_db):
+    out = sql_comps(mode="block", town="TAMPINES", block="201", flat_type="5 ROOM", lookback_months=11)
+    rows, _ = _expected(block="201", flat_type="5 ROOM")
+    assert out["summary"]["deals"] == len(rows)
+    assert {r["town"] for r in out["recent"]} == {"BEDOK"}
+
+    empty = sql_comps(mode="town", town="NOWHERE", flat_type="4 ROOM")
+    assert empty["summary"]["deals"] == 0
+    assert empty["series"] == [] and empty["recent"] == []
+
+
+def test_result_cache_hits_and_invalidates_on_reload(resale_db):
+    comps.clear_cache()
+    a = sql_comps(mode="town", town="TAMPINES", flat_type="4 ROOM", lookback_months=11)
+    b = sql_comps(mode="Town", town=" tampines ", flat_type="4 room", lookback_months="11")
+    assert b is a
+    # block mode ignores town, so these normalise to the same key
+    sql_comps(mode="block", town="TAMPINES", block="101", flat_type="4 ROOM")
+    sql_comps(mode="block", town="BEDOK", block="101", flat_type="4 ROOM")
+    assert comps.cache_stats()["hits"] == 2 and comps.cache_stats()["misses"] == 2
+
+    # a reload rewrites the file -> new db_version -> fresh numbers
+    con = duckdb_conn(write=True)
+    con.execute("DELETE FROM resale_txn WHERE town = 'TAMPINES' AND block = '102'")
+    con.close()
+    st = os.stat(resale_db)  # coarse-mtime filesystems may not see the rewrite otherwise
+    os.utime(resale_db, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    c = sql_comps(mode="town", town="TAMPINES", flat_type="4 ROOM", lookback_months=11)
+    assert c["summary"]["deals"] == a["summary"]["deals"] // 2
+    assert comps.cache_stats()["misses"] == 3
+
+
+def test_batch_comps_matches_single_queries(comps_db):
+    keys = [("TAMPINES", "101", "4 ROOM"), ("bedok", "202", "5 room"), ("BEDOK", "999", "4 ROOM")]
+    df = batch_comps(keys, lookback_months=11)
+    assert list(df["block"]) == ["202", "101"]  # ordered by town; no deals -> no row
+    for r in df.to_dict("records"):
+        one = sql_comps(mode="block", block=r["block"], flat_type=r["flat_type"], lookback_months=11)["summary"]
+        assert r["deals"] == one["deals"]
+        assert r["median_price"] == pytest.approx(one["median_price"])
+        assert r["p75_psf"] == pytest.approx(one["p75_psf"])
+
+    every = batch_comps(level="town", flat_type="4 ROOM", arrow=True)
+    assert every.num_rows == 2 and every.column("town").to_pylist() == ["BEDOK", "TAMPINES"]
+    assert batch_comps([]).empty
@@ -0,0 +1,41 @@
+from rag.answer import stream_answer
+from rag.context import count_tokens, pack_context
+from rag.extract import split_into_chunks
+
+URL = "https://www.hdb.gov.sg/grants"
+
+
+def _page(n=60):
+    lines = [f"Rule {i}: buyers in case {i} must wait {i} weeks before the next step." for i in range(n)]
+    lines[37] = "The Enhanced CPF Housing Grant is capped at an income ceiling of $9,000."
+    return "\n".join(lines)
+
+
+def test_overlapping_chunks_are_deduplicated():
+    chunks = split_into_chunks(_page(), "Grants", URL, max_tokens=200, overlap=80)
+    assert len(chunks) >= 3
+    ctx, stats = pack_context("waiting time", chunks, budget=100_000)
+    assert stats["dropped_duplicate"] > 0 and stats["dropped_budget"] == 0
+    for i in range(60):
+        assert ctx.count(f"Rule {i}:") == (i != 37)  # every sentence exactly once
+
+
+def test_budget_keeps_the_relevant_sentences():
+    chunks = split_into_chunks(_page(), "Grants", URL, max_tokens=200, overlap=80)
+    full = "".join(c["text"] for c in chunks)
+    ctx, stats = pack_context("What is the income ceiling for the Enhanced CPF Housing Grant?", chunks, budget=120)
+    assert stats["context_tokens"] == count_tokens(ctx) <= 120 < count_tokens(full)
+    assert "income ceiling of $9,000" in ctx and stats["dropped_budget"] > 0
+    # sources keep their citation numbers, in order
+    nums = [int(line[1:line.index("]")]) for line in ctx.splitlines() if line.startswith("[")]
+    assert nums[0] == 1 and nums == sorted(nums) and len(nums) < len(chunks)
+
+
+def test_stream_reports_prompt_tokens(openai_stub):
+    hits = split_into_chunks(_page(), "Grants", URL, max_tokens=200, overlap=80)
+    s = stream_answer("What is the income ceiling?", hits)
+    list(s)
+    prompt = openai_stub.requests[-1]["body"]["messages"][0]["content"]
+    assert s.usage["prompt_tokens"] == count_tokens(prompt)
+    assert s.usage["context_tokens"] <= s.usage["budget"] and s.usage["hits_used"] >= 1
+    assert s.usage["api_prompt_tokens"] == len(prompt.split())  # as the stub counts them
@@ -0,0 +1,33 @@
+import pytest
+from tools.sql_utils import duckdb_conn
+from tools.discovery import discover_blocks, discovery_towns
+from db.init_duckdb import build_aggregates
+
+
+@pytest.fixture(params=["table", "fallback"])
+def discovery_db(request, resale_db):
+    if request.param == "table":
+        con = duckdb_conn(write=True)
+        build_aggregates(con)
+        con.close()
+    return resale_db
+
+
+def test_ranked_by_value_score(discovery_db):
+    df = discover_blocks("4 room")
+    assert len(df) == 4 and set(df["deals"]) == {24}  # 12 months x 2 deals
+    assert list(df["value_score"]) == sorted(df["value_score"], reverse=True)
+    # block x01 is cheaper and has the longer lease -> better value than x02
+    assert set(df["block"][:2]) == {"101", "201"} and (df["value_score"][:2] > 100).all()
+    assert df["lease_years"].between(64, 65.5).all()
+    assert discovery_towns() == ["BEDOK", "TAMPINES"]
+
+
+def test_budget_lease_town_and_liquidity_filters(discovery_db):
+    # x01 blocks: P25/median/P75 = 418k/421k/424k; x02 blocks are 20k dearer
+    assert set(discover_blocks("4 ROOM", budget=422000, budget_basis="median")["block"]) == {"101", "201"}
+    assert discover_blocks("4 ROOM", budget=422000, budget_basis="p75").empty
+    assert len(discover_blocks("4 ROOM", budget=440000, budget_basis="p25")) == 4
+    assert set(discover_blocks("4 ROOM", min_lease_years=64.5)["block"]) == {"101", "201"}
+    assert set(discover_blocks("5 ROOM", towns=["tampines"])["town"]) == {"TAMPINES"}
+    assert discover_blocks("4 ROOM", min_deals=25).empty
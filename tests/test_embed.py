@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from rag.embed import load_encoder
+
+SENTENCES = [
+    "How long is the option to purchase valid for an HDB resale flat?",
+    "Enhanced CPF Housing Grant eligibility for first-timer families",
+    "Ethnic Integration Policy quota for Singapore permanent residents",
+    "Can I use CPF savings if the remaining lease does not cover me to age 95?",
+]
+
+
+def test_unknown_backend_rejected():
+    with pytest.raises(ValueError):
+        load_encoder("tensorrt")
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_backend_parity_with_torch(backend):
+    pytest.importorskip("sentence_transformers")
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("optimum")
+    try:
+        ref = load_encoder("torch").encode(SENTENCES, normalize_embeddings=True)
+    except OSError as e:  # weights neither cached nor downloadable
+        pytest.skip(f"model unavailable: {e}")
+    got = load_encoder(backend).encode(SENTENCES, normalize_embeddings=True)
+    assert got.shape == ref.shape
+    cos = np.sum(ref * got, axis=1)
+    assert cos.min() >= 0.99
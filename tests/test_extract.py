@@ -0,0 +1,68 @@
+import re
+import numpy as np
+from rag import index_rules
+from rag.extract import split_into_chunks, split_text
+from rag.fetch import Fetcher
+
+
+def _old_split(text, max_tokens=800, overlap=80):
+    # the previous split_into_chunks() body, as the reference for chunk boundaries
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    chunks, buf, tokens = [], [], 0
+    def tok_count(s): return max(1, len(s.split()))
+    for line in lines:
+        if re.match(r"^[A-Z].{0,80}$", line) and len(line.split()) <= 12:
+            if buf:
+                chunks.append("\n".join(buf))
+                buf, tokens = [], 0
+        if tokens + tok_count(line) > max_tokens and buf:
+            chunks.append("\n".join(buf))
+            keep = " ".join(" ".join(buf).split()[-overlap:])
+            buf = [keep, line]
+            tokens = tok_count(keep) + tok_count(line)
+        else:
+            buf.append(line)
+            tokens += tok_count(line)
+    if buf:
+        chunks.append("\n".join(buf))
+    return chunks
+
+
+def _policy_text(seed, sections=40):
+    rng = np.random.default_rng(seed)
+    words = ["grant", "Income", "ceiling", "flat", "resale", "(EHG)", "lease", "$5,000", "quota", "SPR"]
+    out = []
+    for j in range(sections):
+        out.append(f"Section {j}: eligibility" if j % 3 else f"{'x' * 90} not a heading")
+        for _ in range(rng.integers(1, 12)):
+            out.append("  " + " ".join(rng.choice(words, rng.integers(1, 300))) + "\n")
+    return "\n".join(out)
+
+
+def test_split_matches_previous_chunker():
+    for seed in range(5):
+        text = _policy_text(seed)
+        for max_tokens, overlap in ((800, 80), (120, 30), (50, 200)):
+            assert split_text(text, max_tokens, overlap) == _old_split(text, max_tokens, overlap)
+
+
+def test_chunk_ids_are_content_addressed():
+    text = "Intro\nfirst section body\nGrants\nsecond section body\nGrants\nsecond section body"
+    before = split_into_chunks(text, "t", "https://a.sg/x", retrieved_at="2025-01-01")
+    after = split_into_chunks("New notice\nsomething added on top\n" + text, "t", "https://a.sg/x")
+    assert len({c["doc_id"] for c in before}) == len(before)  # repeated text, distinct ids
+    assert [c["doc_id"] for c in after[1:]] == [c["doc_id"] for c in before]
+    assert split_into_chunks(text, "t", "https://a.sg/y")[0]["doc_id"] != before[0]["doc_id"]
+
+
+def test_extraction_pool_matches_inline(tmp_path, monkeypatch):
+    f = Fetcher(tmp_path / "s.sqlite", mode="offline")
+    sources = [{"title": f"P{i}", "url": f"https://a.sg/{i}"} for i in range(index_rules.EXTRACT_MIN_PAGES)]
+    for i, s in enumerate(sources[:-1]):  # the last page is missing from the snapshot
+        body = "".join(f"<h2>Part {j}</h2><p>{'Household income ceiling applies. ' * (20 + i)}</p>"
+                       for j in range(5))
+        f.put(s["url"], f"<html><body><article><h1>Page {i}</h1>{body}</article></body></html>")
+    inline = list(index_rules.page_texts(sources, f, procs=1))
+    pooled = list(index_rules.page_texts(sources, f, procs=2))
+    assert pooled == inline and inline[-1][1] == "" and all(t for _, t in inline[:-1])
+    assert f.timings[sources[0]["url"]]["extract_s"] > 0
@@ -0,0 +1,170 @@
+import sqlite3, threading, time
+import numpy as np
+import pytest
+from rag import index_rules
+from rag.fetch import FetchError, Fetcher
+from rag.index_store import open_index
+from conftest import ConnectionSpy, CountingEncoder
+
+SOURCES = [
+    {"title": "Grants", "url": "https://www.hdb.gov.sg/grants"},
+    {"title": "EIP", "url": "https://www.hdb.gov.sg/eip"},
+    {"title": "Loans", "url": "https://www.mas.gov.sg/msr"},
+]
+
+
+def _page(topic, n=3):
+    return "\n".join(f"{topic} Rules {i}\n" + f"{topic} paragraph {i} says something long enough. " * 5
+                     for i in range(n))
+
+
+def test_fetch_all_keeps_order_and_limits_each_host(monkeypatch):
+    monkeypatch.setattr(index_rules, "HOST_LIMIT", 2)
+    monkeypatch.setattr(index_rules, "_host_slots", {})
+    active, peak, lock = {}, {}, threading.Lock()
+    def fetch(url):
+        host = url.split("/")[2]
+        with lock:
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+        time.sleep(0.02)
+        with lock:
+            active[host] -= 1
+        return url
+    sources = [{"title": str(i), "url": f"https://{h}/{i}"} for i in range(6) for h in ("a.sg", "b.sg")]
+    out = list(index_rules.fetch_all(sources, fetch=fetch, workers=8))
+    assert [text for _, text, _ in out] == [s["url"] for s in sources]
+    assert peak == {"a.sg": 2, "b.sg": 2}
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    # offline replay of stored pages; the test pages are already plain text
+    monkeypatch.setattr(index_rules, "extract_text", lambda html, url: html)
+    return Fetcher(tmp_path / "snapshots.sqlite", mode="offline")
+
+
+def test_offline_fetcher_replays_snapshot_and_never_downloads(snapshot):
+    class NoNetwork:
+        def get(self, *a, **kw):
+            raise AssertionError("network used")
+    snapshot._session = NoNetwork()
+    sha = snapshot.put("https://a.sg/x", "<p>hello</p>", fetched_at=0)
+    assert snapshot.put("https://a.sg/y", "<p>hello</p>") == sha  # one body per content hash
+    assert snapshot.get("https://a.sg/x") == "<p>hello</p>"
+    assert snapshot.timings["https://a.sg/x"]["source"] == "snapshot"
+    assert snapshot.fetched_on("https://a.sg/x") == "1970-01-01"
+    with pytest.raises(FetchError):
+        snapshot.get("https://a.sg/missing")
+    assert index_rules.fetch_clean("https://a.sg/missing", snapshot) == ""
+    assert snapshot.timings["https://a.sg/missing"]["source"] == "miss"
+    with pytest.raises(ValueError):
+        Fetcher(mode="online")
+
+
+def test_cache_mode_downloads_stale_pages_once(tmp_path):
+    class Resp:
+        status_code, url, text = 200, "https://a.sg/x", "<p>new</p>"
+    class Session:
+        calls = 0
+        def get(self, url, **kw):
+            Session.calls += 1
+            return Resp()
+    f = Fetcher(tmp_path / "s.sqlite", mode="cache", session=Session())
+    f.put("https://a.sg/x", "<p>old</p>", fetched_at=1.0)  # older than max_age_s
+    assert f.get("https://a.sg/x") == "<p>new</p>" and f.timings["https://a.sg/x"]["source"] == "network"
+    assert f.get("https://a.sg/x") == "<p>new</p>" and Session.calls == 1
+
+
+def test_each_fetch_thread_gets_its_own_session(tmp_path):
+    f = Fetcher(tmp_path / "s.sqlite", mode="cache")
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(f.session)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(s) for s in seen}) == 4 and f.session is f.session
+
+
+def test_snapshot_connections_are_closed(snapshot, monkeypatch):
+    spy = ConnectionSpy()
+    monkeypatch.setattr(sqlite3, "connect", spy)
+    for i in range(3):
+        snapshot.put(f"https://a.sg/{i}", f"<p>{i}</p>")
+        assert snapshot.get(f"https://a.sg/{i}") == f"<p>{i}</p>"
+    assert len(spy.cons) == 6 and spy.open() == 0
+    assert spy.creates == 2  # both tables, by the first connection only
+
+
+def test_rebuild_only_embeds_changed_chunks(tmp_path, snapshot):
+    pages = {s["url"]: _page(s["title"]) for s in SOURCES}
+    def store():
+        for u, html in pages.items():
+            snapshot.put(u, html, fetched_at=1.7e9)
+    store()
+    enc = CountingEncoder(16)
+    idx = tmp_path / "idx"
+    header, stats = index_rules.build_index(SOURCES, idx, encoder=enc, fetcher=snapshot)
+    emb, chunks, _ = open_index(idx)
+    assert {c["retrieved_at"] for c in chunks} == {"2023-11-14"}  # the snapshot's date
+    first = {c["text"]: np.array(emb[i]) for i, c in enumerate(chunks)}
+    assert stats["changed"] == 3 and stats["embedded"] == len(chunks) == header["count"]
+
+    # nothing changed: no encoding, index untouched
+    enc.calls = 0
+    _, stats = index_rules.build_index(SOURCES, idx, encoder=enc, fetcher=snapshot)
+    assert enc.calls == 0 and stats["unchanged"] == 3 and stats["reused"] == len(chunks)
+
+    # one edited section on one page; one page fails and keeps its old chunks
+    pages[SOURCES[0]["url"]] = pages[SOURCES[0]["url"]].replace("paragraph 2", "paragraph TWO")
+    del pages[SOURCES[2]["url"]]
+    snapshot.path.unlink()
+    store()
+    _, stats = index_rules.build_index(SOURCES, idx, encoder=enc, fetcher=snapshot)
+    assert stats == {"unchanged": 1, "changed": 1, "failed": 1, "embedded": 1, "reused": len(chunks) - 1}
+    assert len(enc.texts) == 1 and "paragraph TWO" in enc.texts[0]
+    emb, chunks, _ = open_index(idx)
+    assert {c["url"] for c in chunks} == {s["url"] for s in SOURCES}
+    for i, c in enumerate(chunks):
+        if c["text"] in first:
+            assert np.allclose(emb[i], first[c["text"]])
+
+    # --full re-embeds everything; a from-scratch offline replay is byte-identical
+    enc.calls = 0
+    header, stats = index_rules.build_index(SOURCES[:2], idx, encoder=enc, fetcher=snapshot, full=True)
+    assert enc.calls == 1 and stats["reused"] == 0
+    again, _ = index_rules.build_index(SOURCES[:2], tmp_path / "idx2", encoder=enc, fetcher=snapshot)
+    assert again["digest"] == header["digest"]
+
+
+def test_streaming_build_resumes_after_a_failure(tmp_path, snapshot):
+    pages = {s["url"]: _page(s["title"]) for s in SOURCES}
+    for u, html in pages.items():
+        snapshot.put(u, html, fetched_at=1.7e9)
+    ref, _ = index_rules.build_index(SOURCES, tmp_path / "ref", encoder=CountingEncoder(16), fetcher=snapshot)
+
+    class Flaky(CountingEncoder):
+        def encode(self, texts, **kw):
+            if self.calls == 1:
+                raise RuntimeError("worker died")
+            return super().encode(texts, **kw)
+    idx = tmp_path / "idx"
+    with pytest.raises(RuntimeError):
+        index_rules.build_index(SOURCES, idx, encoder=Flaky(16), fetcher=snapshot, batch_size=2)
+    assert not (idx / "index.json").exists()  # nothing swapped in yet
+
+    enc = CountingEncoder(16)
+    header, stats = index_rules.build_index(SOURCES, idx, encoder=enc, fetcher=snapshot, batch_size=2, resume=True)
+    assert stats["embedded"] == 6 and len(enc.texts) == 3  # the first page came from the checkpoint
+    assert header["digest"] == ref["digest"] and not (idx / ".build").exists()
+
+
+def test_encoder_pool_matches_single_process():
+    from rag.embed import EncoderPool
+    texts = [f"text {i}" for i in range(10)]
+    pool = EncoderPool(2, CountingEncoder, (8,), chunk_size=3)
+    try:
+        assert np.allclose(pool.encode(texts), CountingEncoder(8).encode(texts))
+    finally:
+        pool.close()
@@ -0,0 +1,168 @@
+import csv, json
+import duckdb
+from tools import sql_utils
+from tools.sql_utils import duckdb_conn
+from conftest import sample_rows
+from db import init_duckdb
+
+HEADER = ["month", "town", "flat_type", "block", "street_name", "storey_range",
+          "floor_area_sqm", "flat_model", "lease_commence_date", "remaining_lease", "resale_price"]
+
+
+def _write_csv(path, rows, with_remaining_lease=True):
+    header = [h for h in HEADER if with_remaining_lease or h != "remaining_lease"]
+    with path.open("w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        for (month, town, blk, street, ft, storey, sqm, lease, rem, price) in rows:
+            rec = {"month": month[:7], "town": town, "flat_type": ft, "block": blk, "street_name": street,
+                   "storey_range": storey, "floor_area_sqm": sqm, "flat_model": "Model A",
+                   "lease_commence_date": lease, "remaining_lease": rem, "resale_price": int(price)}
+            w.writerow([rec[h] for h in header])
+
+
+def _count(sql):
+    con = duckdb_conn()
+    return con.execute(sql).fetchone()[0]
+
+
+def test_incremental_ingest_appends_only_new_rows(tmp_path, resale_db):
+    rows = sample_rows()
+    old = [r for r in rows if r[0] < "2024-01-01"]
+    # data.gov.sg style: an older file without remaining_lease, and a current file
+    # that is re-published with more months each time
+    _write_csv(tmp_path / "a_2023.csv", old, with_remaining_lease=False)
+    _write_csv(tmp_path / "b_2024.csv", [r for r in rows if "2024-01-01" <= r[0] < "2024-07-01"])
+
+    con = duckdb_conn(write=True)
+    con.execute("DROP TABLE resale_txn")
+    con.close()
+    init_duckdb.main([str(tmp_path / "a_2023.csv"), str(tmp_path / "b_2024.csv")])
+    first = _count("SELECT COUNT(*) FROM resale_txn")
+    assert first == len([r for r in rows if r[0] < "2024-07-01"])
+    # the older file's lease is derived from its start year
+    assert _count("SELECT COUNT(*) FROM resale_txn WHERE remaining_lease_months IS NULL") == 0
+
+    # Re-published current file: old months plus new ones; only the new ones are appended
+    _write_csv(tmp_path / "b_2024.csv", [r for r in rows if r[0] >= "2024-01-01"])
+    init_duckdb.main([str(tmp_path / "a_2023.csv"), str(tmp_path / "b_2024.csv")])
+    assert _count("SELECT COUNT(*) FROM resale_txn") == len(rows)
+    assert _count("SELECT COUNT(*) FROM load_manifest") == 3
+    assert _count("SELECT MAX(load_id) FROM load_manifest") == 2
+    assert _count("SELECT rows_added FROM load_manifest WHERE load_id = 2") == len(rows) - first
+    assert _count("SELECT SUM(deals) FROM comps_monthly") == len(rows)
+
+
+def test_identical_sales_in_same_month_are_kept(tmp_path, resale_db):
+    row = sample_rows()[0]
+    _write_csv(tmp_path / "dups.csv", [row, row])
+    con = duckdb_conn(write=True)
+    con.execute("DELETE FROM resale_txn")
+    con.close()
+    init_duckdb.main([str(tmp_path / "dups.csv")])
+    assert _count("SELECT COUNT(*) FROM resale_txn") == 2
+    init_duckdb.main(["--full", str(tmp_path / "dups.csv")])
+    assert _count("SELECT COUNT(*) FROM resale_txn") == 2
+
+
+def test_optimize_keeps_the_comps_cube(tmp_path, resale_db):
+    rows = sample_rows()
+    _write_csv(tmp_path / "all.csv", rows)
+    init_duckdb.main(["--full", str(tmp_path / "all.csv")])
+    # up to date: nothing is appended, but the re-sort must not lose the cube
+    init_duckdb.main(["--optimize", str(tmp_path / "all.csv")])
+    assert _count("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'comps_monthly'") == 1
+    assert _count("SELECT SUM(deals) FROM comps_monthly") == len(rows)
+    # the lease months survive the round trip through their display text
+    assert _count("SELECT COUNT(*) FROM resale_txn WHERE remaining_lease_months = 65 * 12 + 2") == len(rows) // 4
+
+
+def _baseline_db(tmp_path, monkeypatch, rows):
+    # the committed db/resale.duckdb: the baseline loader's TEXT table, lease_commence_year
+    path = tmp_path / "resale.duckdb"
+    con = duckdb.connect(path.as_posix())
+    con.execute("""
+        CREATE TABLE resale_txn (
+          month DATE, town TEXT, block TEXT, street_name TEXT, flat_type TEXT,
+          storey_range TEXT, floor_area_sqm DOUBLE, lease_commence_year INTEGER,
+          remaining_lease TEXT, resale_price DOUBLE
+        )
+    """)
+    con.executemany("INSERT INTO resale_txn VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+    con.close()
+    sql_utils.close_all()
+    monkeypatch.setattr(sql_utils, "DB_PATH", path)
+
+
+def test_baseline_schema_db_is_converted(tmp_path, monkeypatch):
+    rows = sample_rows()
+    _baseline_db(tmp_path, monkeypatch, [r for r in rows if r[0] < "2024-01-01"])
+    # a file that overlaps the stored months: only the new ones are added
+    _write_csv(tmp_path / "all.csv", rows)
+    init_duckdb.main([str(tmp_path / "all.csv")])
+    assert _count("SELECT COUNT(*) FROM resale_txn") == len(rows)
+    assert _count("SELECT SUM(deals) FROM comps_monthly") == len(rows)
+    assert _count("SELECT MIN(lease_commence_date) FROM resale_txn WHERE block = '101'") == 1990
+    sql_utils.close_all()
+
+
+def test_baseline_schema_db_is_converted_without_new_rows(tmp_path, monkeypatch):
+    rows = sample_rows()
+    _baseline_db(tmp_path, monkeypatch, rows)
+    _write_csv(tmp_path / "all.csv", rows)
+    init_duckdb.main([str(tmp_path / "all.csv")])
+    types = dict(duckdb_conn().execute(
+        "SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = 'resale_txn'"
+    ).fetchall())
+    assert types["town"].startswith("ENUM") and "lease_commence_year" not in types
+    assert _count("SELECT COUNT(*) FROM resale_txn") == len(rows)
+    assert _count("SELECT rows_added FROM load_manifest") == 0
+    assert _count("SELECT SUM(deals) FROM comps_monthly") == len(rows)
+    sql_utils.close_all()
+
+
+def test_typed_clustered_layout(resale_db):
+    con = duckdb_conn()
+    types = dict(con.execute(
+        "SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = 'resale_txn'"
+    ).fetchall())
+    assert types["town"].startswith("ENUM") and types["flat_type"].startswith("ENUM")
+    assert types["remaining_lease_months"] == "SMALLINT" and types["storey_range"].startswith("ENUM")
+    # nothing derivable is stored twice
+    assert not {"remaining_lease", "storey_lo", "storey_hi", "psf"} & set(types)
+
+    # "65 years 02 months" in the file -> months, and back to the same text for a relayout
+    row = sample_rows()[1]
+    months, text = con.execute(f"""
+        SELECT remaining_lease_months, {init_duckdb.REMAINING_LEASE_SQL}
+        FROM resale_txn WHERE storey_range = '04 TO 06' AND block = '101' LIMIT 1
+    """).fetchone()
+    assert months == 65 * 12 + 2 and text == row[8] == "65 years 02 months"
+
+    # Physically sorted by (town, flat_type, month)
+    keys = con.execute("SELECT town::VARCHAR, flat_type::VARCHAR, month FROM resale_txn").fetchall()
+    assert keys == sorted(keys)
+    assert _count("SELECT COUNT(*) FROM resale_txn WHERE town = 'Tampines'") == 0
+
+
+def test_lease_months_derived_for_files_without_remaining_lease(tmp_path, resale_db):
+    row = sample_rows()[0]  # 2023-01, lease commenced 1990
+    _write_csv(tmp_path / "old.csv", [row], with_remaining_lease=False)
+    init_duckdb.main(["--full", str(tmp_path / "old.csv")])
+    assert _count("SELECT remaining_lease_months FROM resale_txn") == (1990 + 99 - 2023) * 12
+
+
+def test_export_snapshot_partitions_and_manifest(resale_db, tmp_path):
+    con = duckdb_conn(write=True)
+    init_duckdb.build_aggregates(con)
+    m = init_duckdb.export_snapshot(con, tmp_path / "snap")
+    con.close()
+
+    out = tmp_path / "snap"
+    assert json.loads((out / "manifest.json").read_text()) == m
+    txn = m["tables"]["resale_txn"]
+    assert txn["rows"] == len(sample_rows()) and txn["files"] == 2 * 2  # 2 years x 2 towns
+    assert (out / "resale_txn" / "year=2024" / "town=BEDOK").is_dir()
+    assert (out / "load_manifest.parquet").exists()
+    assert m["min_month"] == "2023-01-01" and m["max_month"] == "2024-12-01"
+    assert not (tmp_path / "snap.tmp").exists()
@@ -0,0 +1,57 @@
+import sqlite3
+import numpy as np
+from rag import retrieve
+from rag.index_store import open_index, write_index
+from rag.precompute import (AnswerStore, answer_question, eip_key, eip_question, eip_questions,
+                            grant_questions, grants_question, income_bucket, precompute)
+from conftest import ConnectionSpy, CountingEncoder
+
+
+def test_income_buckets_keep_grant_tiers():
+    assert income_bucket(1500, "Family") == 1500 and income_bucket(1501, "Family") == 2000
+    assert income_bucket(4260, "Singles") == 4500 and income_bucket(4240, "Singles") == 4250
+    assert income_bucket(25000, "Family") == income_bucket(14001, "Family") == 14500
+    q = grants_question(True, "Family", "SC", 3210, "4 ROOM", None)
+    assert q == grants_question(True, "Family", "SC", 3500, "4 ROOM", None)
+    assert q in set(grant_questions())
+
+
+def test_precomputed_answers_with_live_fallback(idx_dir, tmp_path, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    enc = CountingEncoder(np.load(idx_dir / "rules.npy").shape[1])
+    r = retrieve.RuleRetriever(top_k=3, encoder=enc)
+    store = AnswerStore(tmp_path / "answers.sqlite")
+    qs = list(eip_questions(["TAMPINES"]))
+    assert precompute(r, qs + qs, store) == len(qs) == 9
+    assert precompute(r, qs, store) == 0  # already stored
+    assert "'Tampines'" in enc.texts[0]  # asked in display form, not the data's upper case
+
+    # the town as typed reads as typed, and still finds the stored answer
+    calls = enc.calls
+    q = eip_question("Malay", "SC", " tampines ")
+    assert "the town 'tampines'" in q
+    ans = answer_question(r, q, store, key=eip_key("Malay", "SC", " tampines "))
+    assert ans["source"] == "precomputed" and enc.calls == calls
+    assert ans["citations"] and ans["answer_markdown"]
+
+    live = answer_question(r, eip_question("Malay", "SC", "Tampines", block="123"), store,
+                           key=eip_key("Malay", "SC", "Tampines", block="123"))
+    assert live["source"] == "live" and enc.calls == calls + 1
+
+    # a different index version never serves old answers
+    emb, chunks, _ = open_index(idx_dir)
+    write_index(idx_dir, list(chunks), -np.array(emb), "test")
+    r2 = retrieve.RuleRetriever(top_k=3, encoder=enc)
+    assert answer_question(r2, qs[0][1], store, key=qs[0][0])["source"] == "live"
+    assert store.prune(r2.digest) == 9
+
+
+def test_answer_store_closes_its_connections(tmp_path, monkeypatch):
+    spy = ConnectionSpy()
+    monkeypatch.setattr(sqlite3, "connect", spy)
+    store = AnswerStore(tmp_path / "answers.sqlite")
+    store.put_many("d", "llm", [("q", [], {"answer_markdown": "a"})])
+    for _ in range(3):
+        assert store.get("d", "llm", "q")[1] == {"answer_markdown": "a"}
+    assert store.prune("other") == 1
+    assert len(spy.cons) == 5 and spy.open() == 0 and spy.creates == 1
@@ -0,0 +1,183 @@
+import sys, json, time, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from rag import retrieve
+from rag.index_store import LEGACY_CHUNKS, HEADER, open_index, write_index
+from conftest import CountingEncoder
+
+
+def test_retriever_defers_model_load(idx_dir):
+    r = retrieve.RuleRetriever(top_k=3)
+    assert len(r.chunks) == r.emb.shape[0] and r.emb.dtype == "float32"
+    assert not r.model_loaded
+    # building the retriever must not pull in torch / sentence_transformers
+    assert "sentence_transformers" not in sys.modules and "torch" not in sys.modules
+    assert set(r.timings) == {"index_load_s"}
+
+
+def test_query_and_result_caches(idx_dir, tmp_path):
+    enc = CountingEncoder(np.load(idx_dir / "rules.npy").shape[1])
+    r = retrieve.RuleRetriever(top_k=3, encoder=enc, cache_path=tmp_path / "q.sqlite")
+    first = r.search("Which grants can I get?")
+    again = r.search("  Which grants\ncan I get? ")
+    assert again == first and enc.calls == 1
+    assert r.cache_stats()["results"] == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+    # a rebuilt index drops cached results but keeps the query embedding
+    emb, chunks, _ = open_index(idx_dir)
+    write_index(idx_dir, list(chunks), -np.array(emb), "test")
+    flipped = r.search("Which grants can I get?")
+    assert enc.calls == 1 and r.cache_stats()["embeddings"]["hits"] == 1
+    assert [c["doc_id"] for c in flipped] != [c["doc_id"] for c in first]
+
+    # persisted embeddings survive a restart
+    r.emb_cache.close()
+    r2 = retrieve.RuleRetriever(top_k=3, encoder=CountingEncoder(enc.dim), cache_path=tmp_path / "q.sqlite")
+    assert r2.search("Which grants can I get?") == flipped
+    assert r2.model.calls == 0 and r2.cache_stats()["embeddings"]["disk_hits"] == 1
+
+
+def test_compact_float16_and_legacy_indexes_agree(idx_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieve, "RAG_HYBRID", "off")  # legacy indexes have no BM25 postings
+    emb, chunks, header = open_index(idx_dir)
+    assert isinstance(emb, np.memmap) and header["count"] == len(chunks) == emb.shape[0]
+    chunks = list(chunks)
+    enc = CountingEncoder(emb.shape[1])
+    queries = ["OTP validity", "EHG income ceiling", "EIP quota for SPR"]
+    ref = [[c["doc_id"] for c in retrieve.RuleRetriever(top_k=4, encoder=enc).search(q)] for q in queries]
+
+    half = tmp_path / "half"
+    write_index(half, chunks, np.array(emb), "test", float16=True)
+    legacy = tmp_path / "legacy"
+    legacy.mkdir()
+    np.save(legacy / "rules.npy", np.array(emb))
+    (legacy / LEGACY_CHUNKS).write_text(json.dumps(chunks, indent=2), encoding="utf-8")
+    assert not (legacy / HEADER).exists()
+
+    for d in (half, legacy):
+        monkeypatch.setattr(retrieve, "IDX_DIR", d)
+        r = retrieve.RuleRetriever(top_k=4, encoder=enc)
+        assert [[c["doc_id"] for c in r.search(q)] for q in queries] == ref
+    assert np.load(half / "rules.npy").dtype == np.float16
+
+
+class SlowEncoder(CountingEncoder):
+    # a forward pass takes a while, so concurrent searches pile up behind it
+    def encode(self, texts, **kwargs):
+        time.sleep(0.02)
+        return super().encode(texts, **kwargs)
+
+
+def test_concurrent_searches_are_batched(idx_dir, monkeypatch):
+    dim = np.load(idx_dir / "rules.npy").shape[1]
+    queries = [f"question {i} about grants" for i in range(32)] + ["question 0 about grants"]
+    for hybrid in ("auto", "off"):
+        monkeypatch.setattr(retrieve, "RAG_HYBRID", hybrid)
+        ref = retrieve.RuleRetriever(top_k=4, encoder=CountingEncoder(dim))
+        expected = {q: ref.search(q) for q in queries}
+        enc = SlowEncoder(dim)
+        r = retrieve.RuleRetriever(top_k=4, encoder=enc, batch_ms=10)
+        barrier = threading.Barrier(len(queries))
+        def ask(q):
+            barrier.wait()
+            return q, r.search(q)
+        with ThreadPoolExecutor(len(queries)) as pool:
+            got = dict(pool.map(ask, queries))
+        for q, hits in got.items():
+            assert [c["doc_id"] for c in hits] == [c["doc_id"] for c in expected[q]]
+            assert np.allclose([c["score"] for c in hits], [c["score"] for c in expected[q]], atol=1e-6)
+        # one encode per batch, each text once
+        stats = r.cache_stats()["batches"]
+        assert enc.calls == stats["batches"] < 8 and stats["largest"] > 1
+        assert stats["items"] <= len(queries)
+
+
+def test_batch_errors_reach_every_caller(idx_dir):
+    class Broken(CountingEncoder):
+        def encode(self, texts, **kwargs):
+            raise RuntimeError("encoder down")
+    r = retrieve.RuleRetriever(top_k=4, encoder=Broken(8), batch_ms=10)
+    def ask(q):
+        try:
+            r.search(q)
+        except RuntimeError as e:
+            return str(e)
+    with ThreadPoolExecutor(4) as pool:
+        assert list(pool.map(ask, ["a", "b", "c", "d"])) == ["encoder down"] * 4
+    r._batcher.window_s = 0
+    assert ask("e") == "encoder down"  # the worker thread survived
+
+
+def test_reload_closes_the_old_chunk_store_after_inflight_searches(idx_dir):
+    entered, release = threading.Event(), threading.Event()
+    class GatedEncoder(CountingEncoder):
+        def encode(self, texts, **kwargs):
+            if texts != ["warm up"]:
+                entered.set()
+                release.wait(5)
+            return super().encode(texts, **kwargs)
+    r = retrieve.RuleRetriever(top_k=3, encoder=GatedEncoder(np.load(idx_dir / "rules.npy").shape[1]))
+    old = r.chunks
+    t = threading.Thread(target=r.search, args=("question in flight",), daemon=True)
+    t.start()
+    entered.wait(5)
+    emb, chunks, _ = open_index(idx_dir)
+    write_index(idx_dir, list(chunks), -np.array(emb), "test")
+    r._check_index()
+    in_use = not old._f.closed
+    release.set()
+    t.join(5)
+    assert r.chunks is not old and in_use  # not closed under the search in flight
+    assert old._f.closed
+    r.search("another question")
+    assert not r.chunks._f.closed
+
+
+def test_search_in_flight_keeps_the_index_it_started_on(idx_dir):
+    entered, release = threading.Event(), threading.Event()
+    class GatedEncoder(CountingEncoder):
+        def encode(self, texts, **kwargs):
+            entered.set()
+            release.wait(5)
+            return super().encode(texts, **kwargs)
+    r = retrieve.RuleRetriever(top_k=3, encoder=GatedEncoder(np.load(idx_dir / "rules.npy").shape[1]))
+    old_ids = {c["doc_id"] for c in r.chunks}
+    out = []
+    t = threading.Thread(target=lambda: out.append(r.search("question in flight")), daemon=True)
+    t.start()
+    entered.wait(5)
+    # rebuilt meanwhile with fewer, renamed chunks: old rows must not be looked up in it
+    emb, chunks, _ = open_index(idx_dir)
+    new = [dict(c, doc_id="new-" + c["doc_id"]) for c in list(chunks)[:5]]
+    write_index(idx_dir, new, np.array(emb[:5]), "test")
+    r._check_index()
+    release.set()
+    t.join(5)
+    assert out and {c["doc_id"] for c in out[0]} <= old_ids
+    # and its results were not cached for the new index
+    assert all(c["doc_id"].startswith("new-") for c in r.search("question in flight"))
+
+
+def test_a_bad_query_fails_only_its_own_caller(idx_dir):
+    dim = np.load(idx_dir / "rules.npy").shape[1]
+    class Picky(SlowEncoder):
+        def encode(self, texts, **kwargs):
+            if any("\x00" in t for t in texts):
+                raise ValueError("cannot encode")
+            return super().encode(texts, **kwargs)
+    ref = retrieve.RuleRetriever(top_k=4, encoder=CountingEncoder(dim))
+    r = retrieve.RuleRetriever(top_k=4, encoder=Picky(dim), batch_ms=50)
+    queries = [f"question {i} about grants" for i in range(7)] + ["odd \x00 input"]
+    barrier = threading.Barrier(len(queries))
+    def ask(q):
+        barrier.wait()
+        try:
+            return [c["doc_id"] for c in r.search(q)]
+        except ValueError as e:
+            return str(e)
+    with ThreadPoolExecutor(len(queries)) as pool:
+        got = dict(zip(queries, pool.map(ask, queries)))
+    assert got.pop("odd \x00 input") == "cannot encode"
+    assert got == {q: [c["doc_id"] for c in ref.search(q)] for q in got}
+    stats = r.cache_stats()["batches"]
+    assert stats["split"] >= 1 and stats["largest"] > 1
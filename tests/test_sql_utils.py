@@ -0,0 +1,77 @@
+import os, threading
+from tools import sql_utils
+from tools.sql_utils import duckdb_conn, conn_stats, close_all
+
+
+def test_cursor_reused_within_thread(resale_db):
+    before = conn_stats()
+    a = duckdb_conn()
+    b = duckdb_conn()
+    assert a is b
+    assert a.execute("SELECT COUNT(*) FROM resale_txn").fetchone()[0] > 0
+    after = conn_stats()
+    assert after["opens"] == before["opens"] + 1
+    assert after["reuses"] >= before["reuses"] + 1
+
+
+def test_threads_get_own_cursor_on_shared_handle(resale_db):
+    main = duckdb_conn()
+    seen = []
+    t = threading.Thread(target=lambda: seen.append(duckdb_conn()))
+    t.start(); t.join()
+    assert seen[0] is not main
+    assert conn_stats()["opens"] >= 1
+
+
+def test_read_only_and_reopen_after_rewrite(resale_db):
+    con = duckdb_conn()
+    try:
+        con.execute("DELETE FROM resale_txn")
+        assert False, "shared handle should be read-only"
+    except Exception as e:
+        assert "read-only" in str(e).lower()
+
+    opened = []
+    sql_utils.on_open(opened.append)
+    try:
+        w = duckdb_conn(write=True)
+        w.execute("DELETE FROM resale_txn WHERE town = 'BEDOK'")
+        w.close()
+        st = os.stat(resale_db)
+        os.utime(resale_db, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        n = duckdb_conn().execute("SELECT COUNT(*) FROM resale_txn WHERE town = 'BEDOK'").fetchone()[0]
+        assert n == 0
+        assert len(opened) == 1
+    finally:
+        sql_utils._hooks["open"].remove(opened.append)
+        close_all()
+
+
+def test_reload_retires_the_old_handle_until_its_cursors_are_done(resale_db):
+    closed = []
+    sql_utils.on_close(closed.append)
+    mid_query, reloaded, results = threading.Event(), threading.Event(), []
+    def session():
+        cur = duckdb_conn()
+        mid_query.set()
+        reloaded.wait()
+        # still on the old handle: it must not have been closed under us
+        results.append(cur.execute("SELECT COUNT(*) FROM resale_txn").fetchone()[0])
+        results.append(duckdb_conn() is not cur)  # next call moves to the new handle
+    t = threading.Thread(target=session, daemon=True)
+    try:
+        t.start()
+        mid_query.wait(5)
+        st = os.stat(resale_db)
+        os.utime(resale_db, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        assert duckdb_conn().execute("SELECT COUNT(*) FROM resale_txn").fetchone()[0] > 0
+        closed_at_reload = list(closed)
+        reloaded.set()
+        t.join(5)
+        assert closed_at_reload == []
+        assert results[0] > 0 and results[1]
+        assert len(closed) == 1  # the last cursor on the old handle is gone
+    finally:
+        reloaded.set()
+        sql_utils._hooks["close"].remove(closed.append)
+        close_all()
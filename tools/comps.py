@@ -1,43 +1,135 @@
-from tools.sql_utils import duckdb_conn
+import threading
+from cachetools import TTLCache
+from tools.sql_utils import duckdb_conn, db_version, ENUM_TYPES
 
 SQM_TO_SQFT = 10.7639
+PSF_SQL = f"(resale_price / (floor_area_sqm * {SQM_TO_SQFT}))"  # derived per row, not stored
+CUBE_TABLE = "comps_monthly"  # built by db/init_duckdb.build_aggregates
 
-def sql_comps(mode="town", town=None, block=None, flat_type="4 ROOM", lookback_months=12):
-    """
-    mode: "town" or "block"
-    returns dict with summary stats + monthly series + recent comps (with PSF)
-    """
-    con = duckdb_conn()
-    filters = []
-    vals = []
+SUMMARY_COLS = [
+    "deals","first_month","last_month","median_price","p25_price","p75_price",
+    "median_psf","p25_psf","p75_psf","avg_sqm"
+]
+SERIES_COLS  = ["month","deals","median_price","median_psf"]
+RECENT_COLS  = ["month","town","block","street_name","flat_type","storey_range",
+                "floor_area_sqm","resale_price","psf"]
 
-    if flat_type:
-        filters.append("flat_type = ?")
-        vals.append(flat_type)
+# Shared comps results across Streamlit sessions. Keys carry db_version(), so a reload
+# never serves stale numbers; the TTL only bounds how long cold entries hold memory.
+CACHE_SIZE = 512
+CACHE_TTL_S = 30 * 60
+_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL_S)
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
 
-    if mode == "block" and block:
-        filters.append("block = ?")
-        vals.append(block)
-    elif town:
-        filters.append("town = ?")
-        vals.append(town)
+# Global MAX(month) and the catalog only change when the DB is reloaded -> cache per db_version()
+_meta_lock = threading.Lock()
+_meta_cache = {}
 
-    # Reference month for lookback
-    max_month = con.execute("SELECT MAX(month) FROM resale_txn").fetchone()[0]
-    filters.append("month >= (date_trunc('month', ?) - (? * INTERVAL '1' MONTH))")
-    vals.extend([max_month, lookback_months])
 
-    where_sql = " AND ".join(filters) if filters else "1=1"
+def _catalog(con) -> dict:
+    """What the loaded layout offers: cube, year partitions, ENUM columns."""
+    cols = {c: t for c, t in con.execute(
+        "SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = 'resale_txn'"
+    ).fetchall()}
+    return {
+        # information_schema also lists the views of a Parquet snapshot
+        "has_cube": con.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [CUBE_TABLE]
+        ).fetchone()[0] > 0,
+        # snapshot tables carry the hive partition column `year` -> prune directories
+        "has_year": "year" in cols,
+        # typed layout: ENUM columns (older DBs keep plain TEXT)
+        "enums": {c: ENUM_TYPES[c] for c, t in cols.items() if t.startswith("ENUM") and c in ENUM_TYPES},
+    }
 
-    # Summary: include PSF percentiles (derived)
-    summary_sql = f"""
-      WITH base AS (
-        SELECT *,
-               (resale_price / (floor_area_sqm * {SQM_TO_SQFT})) AS psf
+
+def _db_meta(con):
+    ver = db_version()
+    with _meta_lock:
+        if ver in _meta_cache:
+            return _meta_cache[ver]
+    meta = {"max_month": con.execute("SELECT MAX(month) FROM resale_txn").fetchone()[0], **_catalog(con)}
+    with _meta_lock:
+        _meta_cache.clear()
+        _meta_cache[ver] = meta
+    return meta
+
+
+def _eq(col, meta):
+    # Compare ENUM columns in their own type so filters reach the zone maps; TRY_CAST
+    # turns an unknown value (e.g. a typo'd town) into "no rows" instead of an error.
+    t = meta["enums"].get(col)
+    return f"{col} = TRY_CAST(? AS {t})" if t else f"{col} = ?"
+
+
+def _pick(row, cols):
+    return {c: row[c] for c in cols}
+
+
+def _raw_comps(con, where_sql, vals):
+    # One statement, one scan of resale_txn: the filtered slice (with PSF) is
+    # materialised once, then summary + monthly series come from a single GROUPING SETS
+    # aggregate over it and the recent rows from a top-N over the same slice.
+    comps_sql = f"""
+      WITH base AS MATERIALIZED (
+        SELECT month, town, block, street_name, flat_type, storey_range,
+               floor_area_sqm,
+               resale_price,
+               {PSF_SQL} AS psf
         FROM resale_txn
         WHERE {where_sql}
+      ),
+      agg AS (
+        SELECT
+          GROUPING(DATE_TRUNC('month', month))      AS is_summary,
+          DATE_TRUNC('month', month)                AS month,
+          COUNT(*)                                  AS deals,
+          MIN(month)                                AS first_month,
+          MAX(month)                                AS last_month,
+          MEDIAN(resale_price)                      AS median_price,
+          QUANTILE_CONT(resale_price, 0.25)         AS p25_price,
+          QUANTILE_CONT(resale_price, 0.75)         AS p75_price,
+          MEDIAN(psf)                               AS median_psf,
+          QUANTILE_CONT(psf, 0.25)                  AS p25_psf,
+          QUANTILE_CONT(psf, 0.75)                  AS p75_psf,
+          AVG(floor_area_sqm)                       AS avg_sqm
+        FROM base
+        GROUP BY GROUPING SETS ((), (DATE_TRUNC('month', month)))
+      ),
+      recent AS (
+        SELECT * FROM base ORDER BY month DESC LIMIT 20
+      )
+      SELECT
+        (SELECT LIST(agg ORDER BY is_summary DESC, month) FROM agg)  AS agg,
+        (SELECT LIST(recent ORDER BY month DESC) FROM recent)       AS recent
+    """
+    agg, recent = con.execute(comps_sql, tuple(vals)).fetchone()
+    agg, recent = agg or [], recent or []
+    # agg[0] is the grand total (is_summary=1); the rest are months in order
+    return (
+        _pick(agg[0], SUMMARY_COLS) if agg else {},
+        [_pick(r, SERIES_COLS) for r in agg[1:]],
+        [_pick(r, RECENT_COLS) for r in recent],
+    )
+
+
+def _cube_comps(con, where_sql, vals):
+    # Summary + series from the monthly cube: unnest the per-group sorted arrays, so the
+    # work depends on deals in the lookback window, not on how much history resale_txn
+    # holds. sum_sqm/deals per element re-sums to sum_sqm, giving an exact avg_sqm.
+    cube_sql = f"""
+      WITH base AS (
+        SELECT month,
+               UNNEST(prices)     AS resale_price,
+               UNNEST(psfs)       AS psf,
+               sum_sqm / deals    AS sqm_share
+        FROM {CUBE_TABLE}
+        WHERE {where_sql}
       )
       SELECT
+        GROUPING(DATE_TRUNC('month', month))      AS is_summary,
+        DATE_TRUNC('month', month)                AS month,
         COUNT(*)                                  AS deals,
         MIN(month)                                AS first_month,
         MAX(month)                                AS last_month,
@@ -47,59 +139,171 @@ def sql_comps(mode="town", town=None, block=None, flat_type="4 ROOM", lookback_m
         MEDIAN(psf)                               AS median_psf,
         QUANTILE_CONT(psf, 0.25)                  AS p25_psf,
         QUANTILE_CONT(psf, 0.75)                  AS p75_psf,
-        AVG(floor_area_sqm)                       AS avg_sqm
+        SUM(sqm_share) / COUNT(*)                 AS avg_sqm
       FROM base
+      GROUP BY GROUPING SETS ((), (DATE_TRUNC('month', month)))
+      ORDER BY is_summary DESC, month
     """
+    cur = con.execute(cube_sql, tuple(vals))
+    cols = [d[0] for d in cur.description]
+    agg = [dict(zip(cols, r)) for r in cur.fetchall()]
 
-    # Monthly median series (price + PSF) for charting
-    series_sql = f"""
-      WITH base AS (
-        SELECT DATE_TRUNC('month', month) AS mth,
-               resale_price,
-               (resale_price / (floor_area_sqm * {SQM_TO_SQFT})) AS psf
-        FROM resale_txn
-        WHERE {where_sql}
-      )
-      SELECT
-        mth,
-        COUNT(*)                     AS deals,
-        MEDIAN(resale_price)         AS median_price,
-        MEDIAN(psf)                  AS median_psf
-      FROM base
-      GROUP BY 1
-      ORDER BY 1
-    """
-
-    # Recent comps (20 latest)
-    recent_sql = f"""
+    # Recent comps (20 latest) still need the raw rows; the series tells us the oldest
+    # month they can come from, which lets zone maps skip everything before it.
+    since, n = None, 0
+    for r in reversed(agg[1:]):
+        since, n = r["month"], n + r["deals"]
+        if n >= 20:
+            break
+    recent = con.execute(f"""
       SELECT month, town, block, street_name, flat_type, storey_range,
-             floor_area_sqm,
-             resale_price,
-             (resale_price / (floor_area_sqm * {SQM_TO_SQFT})) AS psf
+             floor_area_sqm, resale_price,
+             {PSF_SQL} AS psf
       FROM resale_txn
-      WHERE {where_sql}
+      WHERE {where_sql} AND month >= ?::DATE
       ORDER BY month DESC
       LIMIT 20
+    """, (*vals, since)).fetchall() if since is not None else []
+    return (
+        _pick(agg[0], SUMMARY_COLS),
+        [_pick(r, SERIES_COLS) for r in agg[1:]],
+        [dict(zip(RECENT_COLS, r)) for r in recent],
+    )
+
+
+def _norm(v):
+    # data.gov.sg values are upper-case; treat " tampines " like "TAMPINES"
+    v = (v or "").strip().upper()
+    return v or None
+
+
+def cache_key(mode="town", town=None, block=None, flat_type="4 ROOM", lookback_months=12):
+    """Normalised request: only the parameters that reach the SQL, plus the data version."""
+    mode = (mode or "town").strip().lower()
+    block = _norm(block) if mode == "block" else None
+    town = None if block else _norm(town)
+    return (db_version(), mode, town, block, _norm(flat_type), int(lookback_months))
+
+
+def cache_stats() -> dict:
+    """Result cache counters for monitoring: hits, misses, current size."""
+    with _cache_lock:
+        return {**_cache_stats, "size": len(_cache), "maxsize": _cache.maxsize}
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        _cache_stats.update(hits=0, misses=0)
+
+
+def sql_comps(mode="town", town=None, block=None, flat_type="4 ROOM", lookback_months=12):
+    """
+    mode: "town" or "block"
+    returns dict with summary stats + monthly series + recent comps (with PSF)
+    Results are cached (shared, treat as read-only) until the DB is reloaded.
     """
+    key = cache_key(mode, town, block, flat_type, lookback_months)
+    with _cache_lock:
+        out = _cache.get(key)
+        _cache_stats["hits" if out is not None else "misses"] += 1
+    if out is None:
+        _, mode, town, block, flat_type, lookback_months = key
+        out = _run_comps(mode, town, block, flat_type, lookback_months)
+        with _cache_lock:
+            _cache[key] = out
+    return out
+
 
-    summary = con.execute(summary_sql, tuple(vals)).fetchone()
-    series  = con.execute(series_sql,  tuple(vals)).fetchall()
-    recent  = con.execute(recent_sql,  tuple(vals)).fetchall()
+def _run_comps(mode, town, block, flat_type, lookback_months):
+    con = duckdb_conn()
+    meta = _db_meta(con)
+    filters = []
+    vals = []
+
+    if flat_type:
+        filters.append(_eq("flat_type", meta))
+        vals.append(flat_type)
 
-    summary_cols = [
-        "deals","first_month","last_month","median_price","p25_price","p75_price",
-        "median_psf","p25_psf","p75_psf","avg_sqm"
-    ]
-    series_cols  = ["month","deals","median_price","median_psf"]
-    recent_cols  = ["month","town","block","street_name","flat_type","storey_range",
-                    "floor_area_sqm","resale_price","psf"]
+    if mode == "block" and block:
+        filters.append("block = ?")
+        vals.append(block)
+    elif town:
+        filters.append(_eq("town", meta))
+        vals.append(town)
 
-    def rows_to_dicts(rows, cols):
-        return [dict(zip(cols, r)) for r in rows]
+    # Reference month for lookback
+    filters.append("month >= (date_trunc('month', ?::DATE) - (? * INTERVAL '1' MONTH))")
+    vals.extend([meta["max_month"], lookback_months])
+    if meta["has_year"]:
+        filters.append("year >= year(date_trunc('month', ?::DATE) - (? * INTERVAL '1' MONTH))")
+        vals.extend([meta["max_month"], lookback_months])
+
+    where_sql = " AND ".join(filters) if filters else "1=1"
+
+    # DBs built before the cube existed still work straight off resale_txn
+    run = _cube_comps if meta["has_cube"] else _raw_comps
+    summary, series, recent = run(con, where_sql, vals)
 
     return {
-        "summary": dict(zip(summary_cols, summary)) if summary else {},
-        "series": rows_to_dicts(series, series_cols),
-        "recent": rows_to_dicts(recent, recent_cols),
+        "summary": summary,
+        "series": series,
+        "recent": recent,
         "params": {"mode": mode, "town": town, "block": block, "flat_type": flat_type, "lookback_months": lookback_months}
     }
+
+
+# Group columns per batch level, in the order batch keys are given
+BATCH_LEVELS = {"block": ["town", "block", "flat_type"], "town": ["town", "flat_type"]}
+
+
+def batch_comps(keys=None, level="block", flat_type=None, lookback_months=12, arrow=False):
+    """
+    Summary stats (SUMMARY_COLS) for many comps targets from one grouped scan.
+    keys: tuples in BATCH_LEVELS[level] order, e.g. ("TAMPINES", "101", "4 ROOM");
+    None screens every group (optionally only one `flat_type`).
+    Returns a DataFrame (pyarrow Table with arrow=True): one row per group with deals in
+    the lookback window; keys without any are simply absent.
+    """
+    cols = BATCH_LEVELS[level]
+    con = duckdb_conn()
+    meta = _db_meta(con)
+    filters, vals = [], []
+
+    join = ""
+    if keys is not None:
+        # keys travel as one LIST(STRUCT) parameter; a semi join keeps only their rows
+        struct = ", ".join(f"{c} VARCHAR" for c in cols)
+        join = (f"SEMI JOIN (SELECT UNNEST(?::STRUCT({struct})[], recursive := true)) k "
+                f"USING ({', '.join(cols)})")
+        vals.append([dict(zip(cols, map(_norm, k))) for k in keys])
+
+    filters.append("month >= (date_trunc('month', ?::DATE) - (? * INTERVAL '1' MONTH))")
+    vals.extend([meta["max_month"], int(lookback_months)])
+    if meta["has_year"]:
+        filters.append("year >= year(date_trunc('month', ?::DATE) - (? * INTERVAL '1' MONTH))")
+        vals.extend([meta["max_month"], int(lookback_months)])
+    if flat_type:
+        filters.append(_eq("flat_type", meta))
+        vals.append(_norm(flat_type))
+
+    cur = con.execute(f"""
+      SELECT
+        {", ".join(f"{c}::VARCHAR AS {c}" for c in cols)},
+        COUNT(*)                                  AS deals,
+        MIN(month)                                AS first_month,
+        MAX(month)                                AS last_month,
+        MEDIAN(resale_price)                      AS median_price,
+        QUANTILE_CONT(resale_price, 0.25)         AS p25_price,
+        QUANTILE_CONT(resale_price, 0.75)         AS p75_price,
+        MEDIAN({PSF_SQL})                             AS median_psf,
+        QUANTILE_CONT({PSF_SQL}, 0.25)                AS p25_psf,
+        QUANTILE_CONT({PSF_SQL}, 0.75)                AS p75_psf,
+        AVG(floor_area_sqm)                       AS avg_sqm
+      FROM resale_txn {join}
+      WHERE {" AND ".join(filters)}
+      GROUP BY ALL
+      ORDER BY {", ".join(cols)}
+    """, vals)
+    return cur.to_arrow_table() if arrow else cur.df()
+
@@ -0,0 +1,128 @@
+import threading
+from tools.sql_utils import duckdb_conn, db_version
+from tools.comps import PSF_SQL, _norm
+
+SUMMARY_TABLE = "block_summary"  # built by db/init_duckdb.build_aggregates
+LOOKBACK_MONTHS = 12
+BUDGET_BASIS = {"p25": "p25_price", "median": "median_price", "p75": "p75_price"}
+
+RESULT_COLS = ["town", "block", "street_name", "flat_type", "deals", "last_month",
+               "median_price", "p25_price", "p75_price", "median_psf", "avg_sqm",
+               "lease_years", "value_score"]
+
+
+def _lease_months_sql(cols) -> str:
+    # typed layout stores it; older DBs derive it from the 99-year lease start
+    if "remaining_lease_months" in cols:
+        return "remaining_lease_months"
+    start = "lease_commence_date" if "lease_commence_date" in cols else "lease_commence_year"
+    return f"(({start} + 99 - year(month)) * 12 - (month(month) - 1))"
+
+
+def block_summary_sql(con, lookback_months: int = LOOKBACK_MONTHS) -> str:
+    """
+    One row per town x block x flat_type over the last `lookback_months` of data: deal
+    count, price/PSF quartiles, remaining lease as of the latest data month, and a value
+    score = town's median PSF-per-lease-year / the block's (100 = typical for the town,
+    125 = 25% more lease per dollar).
+    """
+    cols = {c for (c,) in con.execute(
+        "SELECT column_name FROM duckdb_columns() WHERE table_name = 'resale_txn'"
+    ).fetchall()}
+    return f"""
+      WITH cutoff AS (
+        SELECT MAX(month) AS max_month FROM resale_txn
+      ),
+      recent AS (
+        SELECT town::VARCHAR AS town, block, street_name, flat_type::VARCHAR AS flat_type,
+               month, resale_price, floor_area_sqm,
+               {PSF_SQL}                                                        AS psf,
+               {_lease_months_sql(cols)} - date_diff('month', month, max_month) AS lease_left
+        FROM resale_txn, cutoff
+        WHERE month > max_month - INTERVAL {int(lookback_months)} MONTH
+      ),
+      blocks AS (
+        SELECT town, block, flat_type,
+               MODE(street_name)                  AS street_name,
+               COUNT(*)                           AS deals,
+               MAX(month)                         AS last_month,
+               MEDIAN(resale_price)               AS median_price,
+               QUANTILE_CONT(resale_price, 0.25)  AS p25_price,
+               QUANTILE_CONT(resale_price, 0.75)  AS p75_price,
+               MEDIAN(psf)                        AS median_psf,
+               AVG(floor_area_sqm)                AS avg_sqm,
+               ARG_MAX(lease_left, month) / 12.0  AS lease_years
+        FROM recent
+        GROUP BY ALL
+      ),
+      scored AS (
+        SELECT *, median_psf / GREATEST(lease_years, 1) AS psf_per_lease_year
+        FROM blocks
+      )
+      SELECT * EXCLUDE (psf_per_lease_year),
+             ROUND(100 * MEDIAN(psf_per_lease_year) OVER (PARTITION BY town, flat_type)
+                   / psf_per_lease_year, 1) AS value_score
+      FROM scored
+      ORDER BY flat_type, town, block
+    """
+
+
+# Older DBs have no block_summary: compute it once per data version instead
+_fallback_lock = threading.Lock()
+_fallback = {}
+
+
+def _summary_source(con) -> str:
+    has_table = con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [SUMMARY_TABLE]
+    ).fetchone()[0] > 0
+    if has_table:
+        return SUMMARY_TABLE
+    ver = db_version()
+    with _fallback_lock:
+        df = _fallback.get(ver)
+    if df is None:
+        df = con.execute(block_summary_sql(con)).df()
+        with _fallback_lock:
+            _fallback.clear()
+            _fallback[ver] = df
+    con.register("block_summary_df", df)
+    return "block_summary_df"
+
+
+def discover_blocks(flat_type, budget=None, budget_basis="median", min_lease_years=0,
+                    towns=None, min_deals=1, limit=50):
+    """
+    Candidate blocks for `flat_type`, best value_score first.
+    budget: keep blocks whose recent `budget_basis` price (p25/median/p75) fits it.
+    towns: optional list to restrict to; min_deals: liquidity floor in the lookback.
+    Returns a DataFrame with RESULT_COLS.
+    """
+    con = duckdb_conn()
+    src = _summary_source(con)
+    filters = ["flat_type = ?", "deals >= ?"]
+    vals = [_norm(flat_type), int(min_deals)]
+    if budget:
+        filters.append(f"{BUDGET_BASIS[budget_basis]} <= ?")
+        vals.append(float(budget))
+    if min_lease_years:
+        filters.append("lease_years >= ?")
+        vals.append(float(min_lease_years))
+    if towns:
+        filters.append("list_contains(?, town)")
+        vals.append([_norm(t) for t in towns])
+    vals.append(int(limit))
+    return con.execute(f"""
+        SELECT {", ".join(RESULT_COLS)}
+        FROM {src}
+        WHERE {" AND ".join(filters)}
+        ORDER BY value_score DESC, deals DESC, town, block
+        LIMIT ?
+    """, vals).df()
+
+
+def discovery_towns() -> list:
+    con = duckdb_conn()
+    return [t for (t,) in con.execute(
+        f"SELECT DISTINCT town FROM {_summary_source(con)} ORDER BY town"
+    ).fetchall()]
@@ -1,7 +1,196 @@
+import atexit, itertools, json, os, threading, weakref
 import duckdb
 from pathlib import Path
 
 DB_PATH = Path("db/resale.duckdb")
 
-def duckdb_conn():
-    return duckdb.connect(DB_PATH.as_posix(), read_only=False)
+# Parquet snapshot written by `python db/init_duckdb.py --snapshot`: hive-partitioned
+# year=/town= directories per table plus a manifest.json (written last = version stamp).
+SNAPSHOT_DIR = Path("db/snapshot")
+SNAPSHOT_MANIFEST = "manifest.json"
+# "duckdb", "snapshot", or "auto": the DuckDB file when present, else the snapshot
+STORE = os.getenv("RESALE_STORE", "auto")
+
+# ENUM types of the typed resale_txn layout (created by db/init_duckdb.py). Filters on
+# these columns should compare with TRY_CAST(? AS <type>): comparing an ENUM column to a
+# VARCHAR casts the column instead, which disables zone-map pruning.
+ENUM_TYPES = {"town": "town_t", "flat_type": "flat_type_t", "storey_range": "storey_range_t"}
+
+# One read-only database handle per process; each thread gets its own cursor on it.
+# Streamlit runs every session in its own thread, so sessions share the catalog/cache
+# but never contend on the write lock. Writers (db/init_duckdb.py) open explicitly.
+# After a reload the old handle is retired, not closed: threads may still be mid-query
+# on their cursors. It closes once the last of those cursors is released.
+_lock = threading.RLock()  # cursor finalizers may run while it is held
+_local = threading.local()
+_db = None
+_db_key = None
+_db_token = None
+_tokens = itertools.count()
+_handles = {}  # token -> [handle, live cursors, retired]
+_hooks = {"open": [], "close": []}
+_stats = {"opens": 0, "reuses": 0, "cursors": 0, "closes": 0, "write_opens": 0}
+
+
+def on_open(fn):
+    """Register fn(con) to run whenever the shared read-only handle is (re)opened."""
+    _hooks["open"].append(fn)
+    return fn
+
+
+def on_close(fn):
+    """Register fn(con) to run just before the shared handle is closed."""
+    _hooks["close"].append(fn)
+    return fn
+
+
+def _file_key(path: Path):
+    # mtime changes when init_duckdb.py rewrites the file -> reopen to see new data
+    try:
+        return (path.as_posix(), path.stat().st_mtime_ns)
+    except FileNotFoundError:
+        return (path.as_posix(), None)
+
+
+def store() -> str:
+    """Which store readers use: "duckdb" or "snapshot"."""
+    if STORE != "auto":
+        return STORE
+    if not DB_PATH.exists() and (SNAPSHOT_DIR / SNAPSHOT_MANIFEST).exists():
+        return "snapshot"
+    return "duckdb"
+
+
+def _source() -> Path:
+    # the file whose mtime versions the data readers see
+    return SNAPSHOT_DIR / SNAPSHOT_MANIFEST if store() == "snapshot" else DB_PATH
+
+
+def data_available() -> bool:
+    """True when there is a database file or snapshot for readers to open."""
+    return _source().exists()
+
+
+def _open_snapshot():
+    # In-memory DuckDB with one view per snapshot table over the Parquet scanner; filters
+    # on the partition columns (town = ?, year >= ?) skip whole directories unread.
+    manifest = json.loads((SNAPSHOT_DIR / SNAPSHOT_MANIFEST).read_text())
+    db = duckdb.connect(":memory:")
+    for name, t in manifest["tables"].items():
+        path = (SNAPSHOT_DIR / name).as_posix()
+        if t.get("partition_by"):
+            hive = "{" + ", ".join(f"'{c}': '{typ}'" for c, typ in t["partition_by"].items()) + "}"
+            src = f"read_parquet('{path}/**/*.parquet', hive_partitioning = true, hive_types = {hive})"
+        else:
+            src = f"read_parquet('{path}.parquet')"
+        db.execute(f"CREATE VIEW {name} AS SELECT * FROM {src}")
+    return db
+
+
+def _close_handle(token):
+    db = _handles.pop(token)[0]
+    for fn in _hooks["close"]:
+        fn(db)
+    db.close()
+    _stats["closes"] += 1
+
+
+def _cursor_gone(token):
+    # finalizer of a thread's cursor: the last one out closes a retired handle
+    with _lock:
+        entry = _handles.get(token)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[2] and entry[1] <= 0:
+            _close_handle(token)
+
+
+def _retire_locked():
+    # the current handle is replaced: close it now if no cursor is out, else when the last goes
+    global _db, _db_key, _db_token
+    if _db is None:
+        return
+    if _handles[_db_token][1] <= 0:
+        _close_handle(_db_token)
+    else:
+        _handles[_db_token][2] = True
+    _db, _db_key, _db_token = None, None, None
+
+
+def _close_locked():
+    # close everything now, retired handles included (writers, shutdown)
+    global _db, _db_key, _db_token
+    for token in list(_handles):
+        _close_handle(token)
+    _db, _db_key, _db_token = None, None, None
+
+
+def _shared_db():
+    global _db, _db_key, _db_token
+    key = _file_key(_source())
+    with _lock:
+        if _db is not None and _db_key != key:
+            _retire_locked()
+        if _db is None:
+            if store() == "snapshot":
+                _db = _open_snapshot()
+            else:
+                _db = duckdb.connect(DB_PATH.as_posix(), read_only=True)
+            _db_key = key
+            _db_token = next(_tokens)
+            _handles[_db_token] = [_db, 0, False]
+            _stats["opens"] += 1
+            for fn in _hooks["open"]:
+                fn(_db)
+        else:
+            _stats["reuses"] += 1
+        return _db, _db_token
+
+
+def duckdb_conn(write: bool = False):
+    """
+    Default: this thread's cursor on the shared read-only handle (do not close it); with
+    the snapshot store that handle is an in-memory DuckDB with views over the Parquet files.
+    write=True: a dedicated read-write connection to DB_PATH for loaders; the caller closes it.
+    """
+    if write:
+        with _lock:
+            # a read-only handle in this process would block the writer's file lock
+            _close_locked()
+            _stats["write_opens"] += 1
+        return duckdb.connect(DB_PATH.as_posix(), read_only=False)
+
+    cur = getattr(_local, "cursor", None)
+    with _lock:
+        db, token = _shared_db()
+        if cur is None or getattr(_local, "token", None) != token:
+            # dropping this thread's old cursor releases its hold on a retired handle
+            _local.cursor = cur = None
+            cur = db.cursor()
+            _handles[token][1] += 1
+            weakref.finalize(cur, _cursor_gone, token)
+            _local.cursor, _local.token = cur, token
+            _stats["cursors"] += 1
+    return cur
+
+
+def db_version() -> str:
+    """Stamp that changes whenever the database file (or snapshot) is rewritten (for caches)."""
+    path, mtime = _file_key(_source())
+    return f"{path}@{mtime}"
+
+
+def close_all():
+    """Close the shared handle (runs the on_close hooks). Safe to call repeatedly."""
+    with _lock:
+        _close_locked()
+
+
+def conn_stats() -> dict:
+    """Counters for monitoring: handle opens/reuses/closes, thread cursors, write opens."""
+    with _lock:
+        return dict(_stats)
+
+
+atexit.register(close_all)